@@ -1,5 +1,5 @@
 """Agents module."""
 
-from .agent import process_message, AgentContext, AgentResponse
+from .agent import process_message, close_client, AgentContext, AgentResponse
 
-__all__ = ["process_message", "AgentContext", "AgentResponse"]
+__all__ = ["process_message", "close_client", "AgentContext", "AgentResponse"]
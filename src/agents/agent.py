@@ -3,28 +3,37 @@ AI Agent
 
 Core agent logic for processing messages with RAG, Memory, MCP, and Telegram tool integration.
 Uses Anthropic Claude (Opus 4.6) for conversation.
+
+Requests are laid out for prompt caching: tool definitions, the system
+prompt and the conversation history form a stable prefix with cache
+breakpoints, and everything that changes per message (current time,
+memories, RAG context) is sent with the current message, after it. The
+history window starts at a multiple of MAX_HISTORY_MESSAGES rather than
+sliding by one message per turn, so a cached history prefix stays valid
+until the window advances. Tool loop iterations move a breakpoint to their
+latest turn, so each one only pays for what the previous one added.
 """
 
 import asyncio
+import time
+import weakref
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
-from anthropic import Anthropic
+import httpx
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
 
 from ..utils.logger import get_logger
 from ..config import get_config
-from ..memory.database import get_session_history, add_message, get_user_tasks
+from ..memory.database import get_session_history, get_session_window, add_message, get_user_tasks
 from ..memory.mem0_client import (
     search_memory,
     add_memory,
     build_memory_context,
     is_memory_enabled,
 )
-from ..rag import retrieve, build_context_string, should_use_rag
-from ..mcp import get_all_tools, execute_tool
-from ..mcp.client import is_mcp_tool
-from ..mcp.tool_converter import format_mcp_result
+from ..rag import retrieve, retrieve_many, RetrievalRequest, build_context_string, should_use_rag
 from ..tools.telegram_actions import (
     TELEGRAM_TOOLS,
     get_user_info,
@@ -37,6 +46,7 @@ from ..tools.telegram_actions import (
     unpin_message,
 )
 from ..tools.scheduler import task_scheduler, parse_relative_time
+from ..tools.registry import set_tool_group, get_catalog, dispatch
 
 logger = get_logger("agent")
 
@@ -94,6 +104,7 @@ class AgentContext:
     session_id: str
     user_name: str = "User"
     chat_type: str = "private"
+    message_id: Optional[int] = None  # Telegram message being answered
 
 
 @dataclass
@@ -103,21 +114,49 @@ class AgentResponse:
     tool_calls: list[dict] = field(default_factory=list)
     memories_retrieved: int = 0
     rag_results: int = 0
+    # Context gathering time per source (memory, rag, history) in ms
+    context_timings: dict[str, int] = field(default_factory=dict)
+    # Sources left out because they failed or missed their timeout
+    context_dropped: list[str] = field(default_factory=list)
+    # Time from receiving the message to the first streamed text (streaming only)
+    first_token_ms: Optional[int] = None
+    # Token usage summed over the model calls (input, output, cache read/write)
+    usage: dict[str, int] = field(default_factory=dict)
 
 
 # Anthropic client
-_client: Optional[Anthropic] = None
+_client: Optional[AsyncAnthropic] = None
 
 
-def _get_client() -> Anthropic:
-    """Get the Anthropic client."""
+def _get_client() -> AsyncAnthropic:
+    """Get the Anthropic client (async, over a shared, bounded HTTP connection pool)."""
     global _client
     if _client is None:
         config = get_config()
-        _client = Anthropic(api_key=config.ai.anthropic_api_key)
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=config.ai.max_connections,
+                max_keepalive_connections=config.ai.max_connections,
+            ),
+            timeout=config.ai.timeout,
+        )
+        _client = AsyncAnthropic(
+            api_key=config.ai.anthropic_api_key,
+            http_client=http_client,
+            timeout=config.ai.timeout,
+            max_retries=config.ai.max_retries,
+        )
     return _client
 
 
+async def close_client() -> None:
+    """Close the Anthropic client's connection pool."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
 # Built-in tools for the agent (Anthropic format)
 BUILT_IN_TOOLS = [
     {
@@ -137,13 +176,280 @@ BUILT_IN_TOOLS = [
 ]
 
 
-def _get_all_tools() -> list[dict]:
-    """Get all available tools (built-in + Telegram + MCP)."""
-    tools = BUILT_IN_TOOLS.copy()
-    tools.extend(TELEGRAM_TOOLS)
-    mcp_tools = get_all_tools()
-    tools.extend(mcp_tools)
-    return tools
+def _format_search_result(result) -> str:
+    """Format a knowledge base retrieval as a tool result."""
+    if not result.results:
+        return "No relevant messages found in the knowledge base."
+
+    formatted = []
+    for doc in result.results:
+        formatted.append(f"- [{doc.user_name}]: {doc.text}")
+
+    return "Found relevant messages:\n" + "\n".join(formatted)
+
+
+async def _search_knowledge_base_batch(blocks: list, context: AgentContext) -> dict[str, str]:
+    """
+    Run several search_knowledge_base calls from one turn as a single
+    batched retrieval.
+
+    Returns:
+        Tool result text by tool_use id (empty if the batch failed, so the
+        calls fall back to running one by one)
+    """
+    requests = [
+        RetrievalRequest(query=block.input.get("query", ""), chat_id=context.chat_id)
+        for block in blocks
+    ]
+    try:
+        responses = await retrieve_many(requests)
+    except Exception as e:
+        logger.error(f"Batched knowledge base search failed: {e}")
+        return {}
+
+    return {
+        block.id: _format_search_result(response)
+        for block, response in zip(blocks, responses)
+    }
+
+
+# Tools with side effects in a chat, and the argument naming that chat
+# (None: the conversation's own chat)
+_CHAT_ACTION_TOOLS = {
+    "send_message": "chat_id",
+    "forward_message": "to_chat_id",
+    "pin_message": "chat_id",
+    "unpin_message": "chat_id",
+    "schedule_reminder": None,
+    "schedule_recurring_reminder": None,
+    "cancel_reminder": None,
+}
+
+# Per-chat locks serializing chat actions (across turns and conversations)
+_chat_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _chat_action_lock(name: str, args: dict, context: AgentContext) -> Optional[asyncio.Lock]:
+    """Lock to hold while running a chat action (None for other tools)."""
+    if name not in _CHAT_ACTION_TOOLS or not get_config().ai.serialize_chat_actions:
+        return None
+    arg = _CHAT_ACTION_TOOLS[name]
+    chat_id = args.get(arg) if arg else context.chat_id
+    # Chat ids may arrive as numbers or strings
+    key = str(chat_id if chat_id is not None else context.chat_id)
+    lock = _chat_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _chat_locks[key] = lock
+    return lock
+
+
+async def _execute_tool_calls(
+    blocks: list,
+    context: AgentContext,
+    batched_results: dict[str, str],
+) -> list[str]:
+    """
+    Run a turn's tool calls concurrently.
+
+    At most AI_TOOL_CONCURRENCY run at once, each limited to AI_TOOL_TIMEOUT
+    seconds; chat actions run one at a time per chat, in the order the
+    model issued them. A failing or timed-out call returns an error text.
+
+    Returns:
+        Tool result text per block, in block order
+    """
+    config = get_config()
+    semaphore = asyncio.Semaphore(max(1, config.ai.tool_concurrency))
+
+    async def run(block) -> str:
+        if block.id in batched_results:
+            return batched_results[block.id]
+
+        lock = _chat_action_lock(block.name, block.input, context)
+        if lock is not None:
+            await lock.acquire()
+        try:
+            async with semaphore:
+                return await asyncio.wait_for(
+                    _execute_tool(block.name, block.input, context),
+                    timeout=config.ai.tool_timeout,
+                )
+        except asyncio.TimeoutError:
+            logger.error(f"Tool {block.name} timed out after {config.ai.tool_timeout}s")
+            return f"Tool error: {block.name} timed out after {config.ai.tool_timeout:g} seconds"
+        except Exception as e:
+            logger.error(f"Tool {block.name} failed: {e}")
+            return f"Tool error: {e}"
+        finally:
+            if lock is not None:
+                lock.release()
+
+    return await asyncio.gather(*(run(block) for block in blocks))
+
+
+# ============================================
+# Built-in RAG Tool
+# ============================================
+
+async def _tool_search_knowledge_base(args: dict, context: AgentContext) -> str:
+    query = args.get("query", "")
+    result = await retrieve(query, chat_id=context.chat_id)
+    return _format_search_result(result)
+
+
+# ============================================
+# Telegram Tools
+# ============================================
+
+async def _tool_send_message(args: dict, context: AgentContext) -> str:
+    chat_id = args.get("chat_id")
+    text = args.get("text")
+    result = await tg_send_message(chat_id, text)
+    if result:
+        return f"Message sent to chat {chat_id}"
+    return "Failed to send message"
+
+
+async def _tool_get_user_info(args: dict, context: AgentContext) -> str:
+    user_id = args.get("user_id")
+    user = await get_user_info(user_id)
+    if user:
+        return f"User Info:\n- ID: {user.id}\n- Username: @{user.username or 'N/A'}\n- Name: {user.first_name} {user.last_name or ''}"
+    return "User not found or not accessible"
+
+
+async def _tool_get_chat_info(args: dict, context: AgentContext) -> str:
+    chat_id = args.get("chat_id")
+    chat = await get_chat_info(chat_id)
+    if chat:
+        return f"Chat Info:\n- ID: {chat.id}\n- Type: {chat.type}\n- Title: {chat.title or 'N/A'}\n- Username: @{chat.username or 'N/A'}"
+    return "Chat not found or not accessible"
+
+
+async def _tool_get_chat_member_count(args: dict, context: AgentContext) -> str:
+    chat_id = args.get("chat_id")
+    count = await get_chat_member_count(chat_id)
+    return f"Chat {chat_id} has {count} members"
+
+
+async def _tool_get_chat_administrators(args: dict, context: AgentContext) -> str:
+    chat_id = args.get("chat_id")
+    admins = await get_chat_administrators(chat_id)
+    if admins:
+        admin_list = "\n".join([f"- {a.first_name} (@{a.username or 'N/A'})" for a in admins])
+        return f"Administrators ({len(admins)}):\n{admin_list}"
+    return "No administrators found or not accessible"
+
+
+async def _tool_forward_message(args: dict, context: AgentContext) -> str:
+    from_chat = args.get("from_chat_id")
+    to_chat = args.get("to_chat_id")
+    message_id = args.get("message_id")
+    result = await forward_message(from_chat, to_chat, message_id)
+    if result:
+        return f"Message forwarded to chat {to_chat}"
+    return "Failed to forward message"
+
+
+async def _tool_pin_message(args: dict, context: AgentContext) -> str:
+    chat_id = args.get("chat_id")
+    message_id = args.get("message_id")
+    success = await pin_message(chat_id, message_id)
+    if success:
+        return f"Message {message_id} pinned"
+    return "Failed to pin message"
+
+
+async def _tool_unpin_message(args: dict, context: AgentContext) -> str:
+    chat_id = args.get("chat_id")
+    message_id = args.get("message_id")
+    success = await unpin_message(chat_id, message_id)
+    if success:
+        return "Message unpinned"
+    return "Failed to unpin message"
+
+
+# ============================================
+# Reminder/Scheduler Tools
+# ============================================
+
+async def _tool_schedule_reminder(args: dict, context: AgentContext) -> str:
+    reminder_text = args.get("reminder_text")
+    time_expr = args.get("time_expression")
+
+    scheduled_time = parse_relative_time(time_expr)
+    if not scheduled_time:
+        return f"Could not parse time: '{time_expr}'. Try 'in 5 minutes', 'tomorrow at 9am', or 'at 3pm'."
+
+    task = await task_scheduler.schedule_task(
+        user_id=context.user_id,
+        chat_id=context.chat_id,
+        description=reminder_text,
+        scheduled_time=scheduled_time,
+    )
+
+    return f"Reminder scheduled for {scheduled_time.strftime('%Y-%m-%d %H:%M')}:\n\"{reminder_text}\"\n\nReminder ID: #{task.id}"
+
+
+async def _tool_schedule_recurring_reminder(args: dict, context: AgentContext) -> str:
+    reminder_text = args.get("reminder_text")
+    cron_expression = args.get("cron_expression")
+
+    task = await task_scheduler.schedule_task(
+        user_id=context.user_id,
+        chat_id=context.chat_id,
+        description=reminder_text,
+        cron_expression=cron_expression,
+    )
+
+    return f"Recurring reminder scheduled (cron: `{cron_expression}`):\n\"{reminder_text}\"\n\nReminder ID: #{task.id}"
+
+
+async def _tool_list_reminders(args: dict, context: AgentContext) -> str:
+    tasks = get_user_tasks(context.user_id)
+    pending = [t for t in tasks if t.status == "pending"]
+
+    if not pending:
+        return "No pending reminders."
+
+    lines = ["**Your Reminders:**"]
+    for t in pending[:10]:
+        lines.append(f"- #{t.id}: {t.task_description}")
+
+    return "\n".join(lines)
+
+
+async def _tool_cancel_reminder(args: dict, context: AgentContext) -> str:
+    reminder_id = args.get("reminder_id")
+    success = task_scheduler.cancel_task(reminder_id, context.user_id)
+    if success:
+        return f"Reminder #{reminder_id} cancelled"
+    return f"Could not cancel reminder #{reminder_id}. It may not exist or already be completed."
+
+
+_BUILT_IN_HANDLERS = {
+    "search_knowledge_base": _tool_search_knowledge_base,
+}
+
+_TELEGRAM_HANDLERS = {
+    "send_message": _tool_send_message,
+    "get_user_info": _tool_get_user_info,
+    "get_chat_info": _tool_get_chat_info,
+    "get_chat_member_count": _tool_get_chat_member_count,
+    "get_chat_administrators": _tool_get_chat_administrators,
+    "forward_message": _tool_forward_message,
+    "pin_message": _tool_pin_message,
+    "unpin_message": _tool_unpin_message,
+    "schedule_reminder": _tool_schedule_reminder,
+    "schedule_recurring_reminder": _tool_schedule_recurring_reminder,
+    "list_reminders": _tool_list_reminders,
+    "cancel_reminder": _tool_cancel_reminder,
+}
+
+# Built-in and Telegram tools come first in the catalog; MCP servers add theirs on connect
+set_tool_group("builtin", [(schema, _BUILT_IN_HANDLERS[schema["name"]]) for schema in BUILT_IN_TOOLS])
+set_tool_group("telegram", [(schema, _TELEGRAM_HANDLERS[schema["name"]]) for schema in TELEGRAM_TOOLS])
 
 
 async def _execute_tool(
@@ -153,156 +459,131 @@ async def _execute_tool(
 ) -> str:
     """Execute a tool and return the result."""
     logger.info(f"Executing tool: {name}")
+    return await dispatch(name, args, context)
 
-    # ============================================
-    # Built-in RAG Tool
-    # ============================================
-    if name == "search_knowledge_base":
-        query = args.get("query", "")
-        result = await retrieve(query, chat_id=context.chat_id)
-
-        if not result.results:
-            return "No relevant messages found in the knowledge base."
-
-        formatted = []
-        for doc in result.results:
-            formatted.append(f"- [{doc.user_name}]: {doc.text}")
-
-        return "Found relevant messages:\n" + "\n".join(formatted)
-
-    # ============================================
-    # Telegram Tools
-    # ============================================
-    if name == "send_message":
-        chat_id = args.get("chat_id")
-        text = args.get("text")
-        result = await tg_send_message(chat_id, text)
-        if result:
-            return f"Message sent to chat {chat_id}"
-        return "Failed to send message"
-
-    if name == "get_user_info":
-        user_id = args.get("user_id")
-        user = await get_user_info(user_id)
-        if user:
-            return f"User Info:\n- ID: {user.id}\n- Username: @{user.username or 'N/A'}\n- Name: {user.first_name} {user.last_name or ''}"
-        return "User not found or not accessible"
-
-    if name == "get_chat_info":
-        chat_id = args.get("chat_id")
-        chat = await get_chat_info(chat_id)
-        if chat:
-            return f"Chat Info:\n- ID: {chat.id}\n- Type: {chat.type}\n- Title: {chat.title or 'N/A'}\n- Username: @{chat.username or 'N/A'}"
-        return "Chat not found or not accessible"
-
-    if name == "get_chat_member_count":
-        chat_id = args.get("chat_id")
-        count = await get_chat_member_count(chat_id)
-        return f"Chat {chat_id} has {count} members"
-
-    if name == "get_chat_administrators":
-        chat_id = args.get("chat_id")
-        admins = await get_chat_administrators(chat_id)
-        if admins:
-            admin_list = "\n".join([f"- {a.first_name} (@{a.username or 'N/A'})" for a in admins])
-            return f"Administrators ({len(admins)}):\n{admin_list}"
-        return "No administrators found or not accessible"
-
-    if name == "forward_message":
-        from_chat = args.get("from_chat_id")
-        to_chat = args.get("to_chat_id")
-        message_id = args.get("message_id")
-        result = await forward_message(from_chat, to_chat, message_id)
-        if result:
-            return f"Message forwarded to chat {to_chat}"
-        return "Failed to forward message"
-
-    if name == "pin_message":
-        chat_id = args.get("chat_id")
-        message_id = args.get("message_id")
-        success = await pin_message(chat_id, message_id)
-        if success:
-            return f"Message {message_id} pinned"
-        return "Failed to pin message"
-
-    if name == "unpin_message":
-        chat_id = args.get("chat_id")
-        message_id = args.get("message_id")
-        success = await unpin_message(chat_id, message_id)
-        if success:
-            return "Message unpinned"
-        return "Failed to unpin message"
-
-    # ============================================
-    # Reminder/Scheduler Tools
-    # ============================================
-    if name == "schedule_reminder":
-        reminder_text = args.get("reminder_text")
-        time_expr = args.get("time_expression")
-
-        scheduled_time = parse_relative_time(time_expr)
-        if not scheduled_time:
-            return f"Could not parse time: '{time_expr}'. Try 'in 5 minutes', 'tomorrow at 9am', or 'at 3pm'."
-
-        task = await task_scheduler.schedule_task(
-            user_id=context.user_id,
-            chat_id=context.chat_id,
-            description=reminder_text,
-            scheduled_time=scheduled_time,
-        )
-
-        return f"Reminder scheduled for {scheduled_time.strftime('%Y-%m-%d %H:%M')}:\n\"{reminder_text}\"\n\nReminder ID: #{task.id}"
-
-    if name == "schedule_recurring_reminder":
-        reminder_text = args.get("reminder_text")
-        cron_expression = args.get("cron_expression")
 
-        task = await task_scheduler.schedule_task(
-            user_id=context.user_id,
-            chat_id=context.chat_id,
-            description=reminder_text,
-            cron_expression=cron_expression,
-        )
+async def _gather_context(
+    user_message: str,
+    context: AgentContext
+) -> tuple[dict[str, Any], dict[str, int], list[str]]:
+    """
+    Fetch memories, RAG results and history concurrently.
 
-        return f"Recurring reminder scheduled (cron: `{cron_expression}`):\n\"{reminder_text}\"\n\nReminder ID: #{task.id}"
+    Every source gets AI_CONTEXT_SOURCE_TIMEOUT seconds, and all of them
+    together AI_CONTEXT_TIMEOUT; a source that fails or runs late is
+    dropped and the reply is generated without it.
 
-    if name == "list_reminders":
-        tasks = get_user_tasks(context.user_id)
-        pending = [t for t in tasks if t.status == "pending"]
+    Returns:
+        (results by source, milliseconds by source, dropped sources)
+    """
+    config = get_config()
 
-        if not pending:
-            return "No pending reminders."
+    sources = {}
+    if is_memory_enabled():
+        sources["memory"] = search_memory(user_message, context.user_id)
+    if config.rag.enabled and should_use_rag(user_message):
+        sources["rag"] = retrieve(user_message, chat_id=context.chat_id)
+    # With prompt caching, history advances in whole windows so the cached
+    # prefix survives new messages (see get_session_window)
+    history = get_session_window if config.ai.prompt_caching else get_session_history
+    sources["history"] = asyncio.to_thread(
+        history, context.session_id, config.app.max_history_messages
+    )
 
-        lines = ["**Your Reminders:**"]
-        for t in pending[:10]:
-            lines.append(f"- #{t.id}: {t.task_description}")
+    started = time.monotonic()
+    timings: dict[str, int] = {}
 
-        return "\n".join(lines)
+    async def run(name: str, coro) -> Any:
+        try:
+            return await asyncio.wait_for(coro, timeout=config.ai.context_source_timeout)
+        finally:
+            timings.setdefault(name, round((time.monotonic() - started) * 1000))
+
+    tasks = {name: asyncio.create_task(run(name, coro)) for name, coro in sources.items()}
+    await asyncio.wait(tasks.values(), timeout=config.ai.context_timeout)
+
+    results: dict[str, Any] = {}
+    dropped: list[str] = []
+    for name, task in tasks.items():
+        if not task.done():
+            timings[name] = round((time.monotonic() - started) * 1000)
+            task.cancel()
+            dropped.append(name)
+            logger.warning(f"Context source {name} missed the deadline, dropped")
+        elif task.exception() is not None:
+            dropped.append(name)
+            error = task.exception()
+            if isinstance(error, asyncio.TimeoutError):
+                logger.warning(f"Context source {name} timed out, dropped")
+            else:
+                logger.error(f"Context source {name} failed: {error}")
+        else:
+            results[name] = task.result()
+
+    return results, timings, dropped
+
+
+# Marks the end of a cacheable prompt prefix
+_CACHE_BREAKPOINT = {"type": "ephemeral"}
+
+
+def _text_block(text: str, cache: bool = False) -> dict:
+    block = {"type": "text", "text": text}
+    if cache:
+        block["cache_control"] = _CACHE_BREAKPOINT
+    return block
+
+
+def _set_cache_breakpoint(message: dict, cache: bool = True) -> None:
+    """Mark (or unmark) the end of a message as a cache breakpoint."""
+    content = message["content"]
+    if isinstance(content, str):
+        if not cache:
+            return
+        content = message["content"] = [_text_block(content)]
+    if not content:
+        return
+    last = content[-1]
+    if cache:
+        content[-1] = {**last, "cache_control": _CACHE_BREAKPOINT}
+    elif "cache_control" in last:
+        content[-1] = {k: v for k, v in last.items() if k != "cache_control"}
+
+
+def _add_usage(totals: dict[str, int], response) -> None:
+    """Add a model call's token usage (including prompt cache reads/writes) to the totals."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    for name in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+        totals[name] = totals.get(name, 0) + (getattr(usage, name, None) or 0)
+    logger.info(
+        f"Model call: {usage.input_tokens} input tokens "
+        f"({getattr(usage, 'cache_read_input_tokens', None) or 0} read from cache, "
+        f"{getattr(usage, 'cache_creation_input_tokens', None) or 0} written), "
+        f"{usage.output_tokens} output tokens"
+    )
 
-    if name == "cancel_reminder":
-        reminder_id = args.get("reminder_id")
-        success = task_scheduler.cancel_task(reminder_id, context.user_id)
-        if success:
-            return f"Reminder #{reminder_id} cancelled"
-        return f"Could not cancel reminder #{reminder_id}. It may not exist or already be completed."
 
-    # ============================================
-    # MCP Tools
-    # ============================================
-    if is_mcp_tool(name):
-        try:
-            result = await execute_tool(name, args)
-            return format_mcp_result(result)
-        except Exception as e:
-            logger.error(f"MCP tool failed: {e}")
-            return f"Tool error: {e}"
+async def _call_model(
+    client: AsyncAnthropic,
+    request: dict,
+    on_text: Optional[Callable[[str], None]] = None,
+):
+    """Call the model; with on_text, stream the reply and pass on each piece of text."""
+    if on_text is None:
+        return await client.messages.create(**request)
 
-    return f"Unknown tool: {name}"
+    async with client.messages.stream(**request) as stream:
+        async for text in stream.text_stream:
+            on_text(text)
+        return await stream.get_final_message()
 
 
 async def process_message(
     user_message: str,
-    context: AgentContext
+    context: AgentContext,
+    on_text: Optional[Callable[[str], None]] = None,
 ) -> AgentResponse:
     """
     Process a user message and generate a response.
@@ -310,77 +591,104 @@ async def process_message(
     Args:
         user_message: The user's message
         context: Agent context with user/chat info
+        on_text: Called with each piece of reply text as it is generated
+            (streams the model calls). Text written before tool calls is
+            streamed too, followed by a blank line, and the response
+            content (also stored in history) is everything streamed.
 
     Returns:
         Agent response with content and metadata
     """
     config = get_config()
     client = _get_client()
+    started = time.monotonic()
+    first_token_ms = None
+    streamed = False
+    # Everything passed to on_text, i.e. the reply as the user sees it
+    shown: list[str] = []
+
+    def stream_text(text: str) -> None:
+        nonlocal first_token_ms, streamed
+        if first_token_ms is None:
+            first_token_ms = round((time.monotonic() - started) * 1000)
+            logger.info(f"First token after {first_token_ms}ms")
+        streamed = True
+        shown.append(text)
+        on_text(text)
 
     # Initialize response metadata
     memories_retrieved = 0
     rag_results = 0
     tool_calls_made = []
 
-    # Build system prompt with additional context
-    system_parts = [SYSTEM_PROMPT]
+    usage: dict[str, int] = {}
+    caching = config.ai.prompt_caching
+
+    # Per-message context; sent after the cached prefix
+    context_parts = []
 
     # Inject current date/time awareness
     now = datetime.now(timezone.utc)
     formatted_dt = now.strftime("%A, %B %d, %Y %I:%M %p")
-    system_parts.append(f"## Current Date & Time\n{formatted_dt} (timezone: UTC)")
+    context_parts.append(f"## Current Date & Time\n{formatted_dt} (timezone: UTC)")
+
+    # 1-3. Memories, RAG context (if appropriate) and history, concurrently
+    gathered, context_timings, context_dropped = await _gather_context(user_message, context)
+    logger.info(
+        "Context gathered in "
+        + ", ".join(f"{name} {ms}ms" for name, ms in context_timings.items())
+        + (f" (dropped: {', '.join(context_dropped)})" if context_dropped else "")
+    )
 
-    # 1. Retrieve relevant memories
-    if is_memory_enabled():
-        try:
-            memories = await search_memory(user_message, context.user_id)
-            if memories:
-                memories_retrieved = len(memories)
-                memory_context = build_memory_context(memories)
-                system_parts.append(memory_context)
-                logger.info(f"Retrieved {memories_retrieved} memories")
-        except Exception as e:
-            logger.error(f"Memory retrieval failed: {e}")
+    memories = gathered.get("memory")
+    if memories:
+        memories_retrieved = len(memories)
+        memory_context = build_memory_context(memories)
+        context_parts.append(memory_context)
+        logger.info(f"Retrieved {memories_retrieved} memories")
 
-    # 2. Retrieve RAG context (if appropriate)
-    if config.rag.enabled and should_use_rag(user_message):
-        try:
-            rag_response = await retrieve(user_message, chat_id=context.chat_id)
-            if rag_response.results:
-                rag_results = len(rag_response.results)
-                rag_context = build_context_string(rag_response.results)
-                system_parts.append(rag_context)
-                logger.info(f"Retrieved {rag_results} RAG results")
-        except Exception as e:
-            logger.error(f"RAG retrieval failed: {e}")
+    rag_response = gathered.get("rag")
+    if rag_response is not None and rag_response.results:
+        rag_results = len(rag_response.results)
+        rag_context = build_context_string(rag_response.results)
+        context_parts.append(rag_context)
+        logger.info(f"Retrieved {rag_results} RAG results")
 
-    # Combined system prompt
-    system_prompt = "\n\n".join(system_parts)
+    # Static system prompt; with the tools before it, the first cached prefix
+    system_prompt = [_text_block(SYSTEM_PROMPT, cache=caching)]
 
-    # 3. Build messages list from conversation history
+    # Build messages list from conversation history (the second cached prefix)
     messages = []
-    history = get_session_history(context.session_id, config.app.max_history_messages)
-    for msg in history:
+    for msg in gathered.get("history", []):
         messages.append({"role": msg.role, "content": msg.content})
+    if caching and messages:
+        _set_cache_breakpoint(messages[-1])
 
-    # 4. Add current message
-    messages.append({"role": "user", "content": user_message})
+    # 4. Add current message, preceded by its context
+    messages.append({
+        "role": "user",
+        "content": [_text_block("\n\n".join(context_parts)), _text_block(user_message)],
+    })
 
-    # 5. Get all available tools
-    tools = _get_all_tools()
+    # 5. Get all available tools (cached catalog: built-in + Telegram + MCP)
+    tools = get_catalog()
 
     logger.info(f"Calling Claude with {len(tools)} tools")
 
     # 6. Call Anthropic
-    response = client.messages.create(
-        model=config.ai.model,
-        max_tokens=config.ai.max_tokens,
-        system=system_prompt,
-        messages=messages,
-        tools=tools if tools else [],
-    )
+    request = {
+        "model": config.ai.model,
+        "max_tokens": config.ai.max_tokens,
+        "system": system_prompt,
+        "messages": messages,
+        "tools": tools if tools else [],
+        "timeout": config.ai.timeout,
+    }
+    response = await _call_model(client, request, stream_text if on_text else None)
+    _add_usage(usage, response)
 
     # 7. Handle tool calls in a loop
+    loop_breakpoint = None
     while response.stop_reason == "tool_use":
         # Extract text and tool_use blocks from assistant response
         assistant_content = response.content
@@ -388,49 +696,66 @@ async def process_message(
         # Add assistant message
         messages.append({"role": "assistant", "content": assistant_content})
 
-        # Execute each tool call and collect results
-        tool_results = []
-        for block in assistant_content:
-            if block.type == "tool_use":
-                tool_name = block.name
-                tool_args = block.input
-                tool_id = block.id
-
-                logger.info(f"Tool call: {tool_name}({tool_args})")
-                tool_calls_made.append({"name": tool_name, "args": tool_args})
-
-                # Execute the tool
-                tool_result = await _execute_tool(tool_name, tool_args, context)
-
-                tool_results.append({
-                    "type": "tool_result",
-                    "tool_use_id": tool_id,
-                    "content": tool_result,
-                })
+        # Separate text streamed before the tool calls from what follows
+        if streamed:
+            shown.append("\n\n")
+            on_text("\n\n")
+            streamed = False
+
+        # Knowledge base searches from the same turn are embedded and scored together
+        search_blocks = [
+            block for block in assistant_content
+            if block.type == "tool_use" and block.name == "search_knowledge_base"
+        ]
+        batched_results = {}
+        if len(search_blocks) > 1:
+            batched_results = await _search_knowledge_base_batch(search_blocks, context)
+
+        # Execute the tool calls (concurrently) and collect results in order
+        tool_blocks = [block for block in assistant_content if block.type == "tool_use"]
+        for block in tool_blocks:
+            logger.info(f"Tool call: {block.name}({block.input})")
+            tool_calls_made.append({"name": block.name, "args": block.input})
+
+        outputs = await _execute_tool_calls(tool_blocks, context, batched_results)
+        tool_results = [
+            {
+                "type": "tool_result",
+                "tool_use_id": block.id,
+                "content": output,
+            }
+            for block, output in zip(tool_blocks, outputs)
+        ]
 
         # Add tool results as a user message (Anthropic format)
         messages.append({"role": "user", "content": tool_results})
 
+        # Cache everything up to this turn for the next iteration (one
+        # moving breakpoint: requests allow only a few)
+        if caching:
+            if loop_breakpoint is not None:
+                _set_cache_breakpoint(loop_breakpoint, cache=False)
+            loop_breakpoint = messages[-1]
+            _set_cache_breakpoint(loop_breakpoint)
+
         # Continue the conversation
-        response = client.messages.create(
-            model=config.ai.model,
-            max_tokens=config.ai.max_tokens,
-            system=system_prompt,
-            messages=messages,
-            tools=tools if tools else [],
-        )
+        response = await _call_model(client, request, stream_text if on_text else None)
+        _add_usage(usage, response)
 
-    # Extract final text content
+    # Extract final text content; when streaming, keep what the user saw,
+    # including text written before tool calls
     content = ""
     for block in response.content:
         if hasattr(block, "text"):
             content += block.text
+    if on_text and "".join(shown).strip():
+        content = "".join(shown).strip()
 
     if not content:
         content = "I encountered an error processing your request."
 
     # 8. Store conversation in database
-    add_message(context.session_id, "user", user_message)
+    add_message(context.session_id, "user", user_message, message_id=context.message_id)
     add_message(context.session_id, "assistant", content)
 
     # 9. Store new memories (async, don't wait)
@@ -442,6 +767,10 @@ async def process_message(
         tool_calls=tool_calls_made,
         memories_retrieved=memories_retrieved,
         rag_results=rag_results,
+        context_timings=context_timings,
+        context_dropped=context_dropped,
+        first_token_ms=first_token_ms,
+        usage=usage,
     )
 
 
@@ -16,14 +16,22 @@ from telegram.ext import (
 from ..utils.logger import get_logger
 from ..config import get_config
 from ..agents.agent import process_message, AgentContext
+from .streaming import StreamingReply
 from ..memory.database import (
     get_or_create_session,
     clear_session_history,
     get_user_tasks,
 )
 from ..memory.mem0_client import is_memory_enabled, delete_all_memories
-from ..rag import index_single_message, get_document_count
+from ..rag import (
+    enqueue_message,
+    get_document_count,
+    get_embedding_stats,
+    get_indexer_status,
+    get_migration_status,
+)
 from ..tools.scheduler import task_scheduler
+from ..tools.registry import get_tool_stats
 
 logger = get_logger("handlers")
 
@@ -95,6 +103,43 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     if config.rag.enabled:
         status_parts.append(f"• Indexed Messages: {doc_count}")
+        indexer_status = get_indexer_status()
+        backlog = indexer_status["queue_depth"] + indexer_status["spilled"]
+        if backlog:
+            status_parts.append(
+                f"• Indexing Backlog: {backlog} (lag {indexer_status['lag_seconds']:.1f}s)"
+            )
+        batches = get_embedding_stats()
+        if batches["batches"]:
+            status_parts.append(
+                f"• Embedding Batches: {batches['batches']} "
+                f"(avg {batches['average_batch_size']}, max {batches['max_batch_size']})"
+            )
+        result_cache = indexer_status["result_cache"]
+        if result_cache["hits"] + result_cache["misses"]:
+            status_parts.append(
+                f"• Retrieval Cache: {result_cache['hit_rate']:.0%} hits "
+                f"({result_cache['entries']} entries)"
+            )
+        migration = get_migration_status()
+        if migration["shadow"]:
+            status_parts.append(
+                f"• Re-embedding: {migration['chats_done']}/{migration['chats_total']} chats "
+                f"({migration['active']} → {migration['shadow']})"
+            )
+    
+    # Tool usage since start, busiest tools first
+    tool_stats = get_tool_stats()
+    if tool_stats:
+        calls = sum(stats["calls"] for stats in tool_stats.values())
+        errors = sum(stats["errors"] for stats in tool_stats.values())
+        status_parts.append(f"• Tool Calls: {calls}{f' ({errors} failed)' if errors else ''}")
+        busiest = sorted(tool_stats.items(), key=lambda item: -item[1]["calls"])[:5]
+        for name, stats in busiest:
+            status_parts.append(
+                f"  `{name}`: {stats['calls']} "
+                f"(avg {stats['avg_ms']:.0f} ms, max {stats['max_ms']:.0f} ms)"
+            )
     
     # Check MCP servers
     from ..mcp import get_all_tools
@@ -211,11 +256,11 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Show typing indicator
     await context.bot.send_chat_action(chat_id=chat.id, action="typing")
     
-    # Index the message for RAG
+    # Queue the message for RAG indexing (indexed in the background)
     config = get_config()
     if config.rag.enabled:
         user_name = user.full_name or user.first_name or "User"
-        await index_single_message(
+        await enqueue_message(
             message_id=message.message_id,
             chat_id=chat.id,
             user_id=user.id,
@@ -231,8 +276,25 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             session_id=session.id,
             user_name=user.first_name or "User",
             chat_type=chat.type,
+            message_id=message.message_id,
         )
         
+        if config.ai.streaming:
+            # Post the reply as it is generated, editing it as text arrives
+            reply = StreamingReply(
+                chat.id,
+                reply_to_message_id=message.message_id if chat.type != "private" else None,
+                group=chat.type != "private",
+            )
+            try:
+                response = await process_message(message.text, agent_context, on_text=reply.append)
+            except Exception as e:
+                logger.error(f"Error processing message: {e}")
+                await reply.fail("Sorry, I encountered an error. Please try again.")
+                return
+            await reply.finish(fallback=response.content)
+            return
+        
         response = await process_message(message.text, agent_context)
         
         # Send response
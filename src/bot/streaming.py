@@ -0,0 +1,183 @@
+"""
+Streaming Replies
+
+Shows a reply while the model is still generating it: the first text
+posts a message, which is then edited as more text arrives. Edits are
+throttled to one every TELEGRAM_STREAM_EDIT_INTERVAL seconds in private
+chats and TELEGRAM_STREAM_GROUP_EDIT_INTERVAL seconds in groups (Telegram
+allows about 20 messages or edits per minute in a group), and pause for as
+long as Telegram asks when it answers with a flood-control error. Text past
+Telegram's message length rolls over into follow-up messages.
+
+Partial text is shown as plain text (half-written Markdown does not
+parse); the finished reply is rendered with Markdown.
+"""
+
+import asyncio
+from typing import Optional
+
+from ..utils.logger import get_logger
+from ..config import get_config
+from ..tools.telegram_actions import send_message, edit_message, flood_wait
+
+logger = get_logger("streaming")
+
+# Telegram's limit is 4096 characters; leave room for the cursor and Markdown
+MAX_MESSAGE_LENGTH = 4000
+CURSOR = " ▌"
+# Attempts at showing the finished reply (each after any flood-control wait)
+_FINAL_ATTEMPTS = 3
+# Characters that make Markdown render differently from plain text
+_MARKDOWN_CHARS = set("*_`[")
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Split text into message-sized chunks, at a line break where possible.
+
+    A chunk only depends on the text before its end, so chunks stay the
+    same as the text grows.
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", limit // 2, limit)
+        if cut == -1:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    chunks.append(text)
+    return chunks
+
+
+class StreamingReply:
+    """A reply that is posted and edited as its text streams in."""
+
+    def __init__(self, chat_id: int, reply_to_message_id: Optional[int] = None, group: bool = False):
+        self.chat_id = chat_id
+        self.reply_to_message_id = reply_to_message_id
+        self.group = group
+        self.text = ""
+        # Message ids, and the text and parse mode each one currently shows
+        self._message_ids: list[int] = []
+        self._shown: list[tuple[str, Optional[str]]] = []
+        self._changed = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def append(self, delta: str) -> None:
+        """Add streamed text; it is shown with the next edit."""
+        if not delta:
+            return
+        self.text += delta
+        self._changed.set()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        """Render the latest text, at most once per edit interval."""
+        config = get_config()
+        interval = (
+            config.telegram.stream_group_edit_interval if self.group
+            else config.telegram.stream_edit_interval
+        )
+        while not self._closed.is_set():
+            await self._changed.wait()
+            self._changed.clear()
+            if self._closed.is_set():
+                return
+            try:
+                await self._render(final=False)
+            except Exception as e:
+                logger.warning(f"Failed to update streaming reply: {e}")
+            try:
+                await asyncio.wait_for(
+                    self._closed.wait(),
+                    timeout=max(interval, flood_wait(self.chat_id)),
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def finish(self, fallback: str = "") -> None:
+        """
+        Show the complete reply.
+
+        Args:
+            fallback: Text to send if nothing was streamed
+        """
+        self._closed.set()
+        self._changed.set()
+        if self._task is not None:
+            # Let an edit in flight complete (cancelling could lose a sent message's id)
+            await self._task
+        if not self.text.strip():
+            self.text = fallback
+        if not self.text.strip():
+            return
+        for _ in range(_FINAL_ATTEMPTS):
+            wait = flood_wait(self.chat_id)
+            if wait:
+                await asyncio.sleep(wait)
+            if await self._render(final=True):
+                return
+            if not flood_wait(self.chat_id):
+                break
+        logger.warning(f"Could not show the complete reply in {self.chat_id}")
+
+    async def fail(self, notice: str) -> None:
+        """
+        Finish a reply whose generation failed: the streamed text ends with
+        the notice, so the chat gets one message rather than a cut-off
+        reply plus a separate error.
+
+        Args:
+            notice: Error text (sent alone if nothing was streamed)
+        """
+        self.text = f"{self.text.rstrip()}\n\n{notice}" if self.text.strip() else notice
+        await self.finish()
+
+    async def _render(self, final: bool) -> bool:
+        """
+        Bring the posted messages in line with the text.
+
+        Returns:
+            True if every chunk is shown (stops early under flood control)
+        """
+        chunks = split_message(self.text)
+        complete = True
+        for i, chunk in enumerate(chunks):
+            last = i == len(chunks) - 1
+            shown = chunk if final or not last else chunk + CURSOR
+            # Partial text is plain; the final text is Markdown, plain if it does not parse
+            parse_modes = ["Markdown", None] if final and _MARKDOWN_CHARS & set(chunk) else [None]
+            if i < len(self._shown) and self._shown[i] == (shown, parse_modes[0]):
+                continue
+            for parse_mode in parse_modes:
+                if await self._show(i, shown, parse_mode):
+                    break
+                if flood_wait(self.chat_id):
+                    return False
+            else:
+                complete = False
+                if i >= len(self._message_ids):
+                    # Later chunks would be posted out of order
+                    return False
+        return complete
+
+    async def _show(self, index: int, text: str, parse_mode: Optional[str]) -> bool:
+        if index < len(self._message_ids):
+            if not await edit_message(self.chat_id, self._message_ids[index], text, parse_mode=parse_mode):
+                return False
+            self._shown[index] = (text, parse_mode)
+            return True
+
+        message = await send_message(
+            self.chat_id,
+            text,
+            reply_to_message_id=self.reply_to_message_id if index == 0 else None,
+            parse_mode=parse_mode,
+        )
+        if message is None:
+            return False
+        self._message_ids.append(message.message_id)
+        self._shown.append((text, parse_mode))
+        return True
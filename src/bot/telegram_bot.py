@@ -19,8 +19,14 @@ def create_application() -> Application:
     
     logger.info("Creating Telegram application...")
     
-    # Build the application
-    application = Application.builder().token(config.telegram.bot_token).build()
+    # Build the application; updates are handled concurrently so one slow
+    # model call does not hold up other chats
+    application = (
+        Application.builder()
+        .token(config.telegram.bot_token)
+        .concurrent_updates(max(1, config.telegram.concurrent_updates))
+        .build()
+    )
     
     # Set up handlers
     setup_handlers(application)
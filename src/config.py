@@ -13,6 +13,9 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class TelegramSettings(BaseSettings):
     """Telegram bot settings."""
     bot_token: str = Field(..., alias="TELEGRAM_BOT_TOKEN")
+    concurrent_updates: int = Field(default=64, alias="TELEGRAM_CONCURRENT_UPDATES")  # updates handled at once; 1 = one at a time
+    stream_edit_interval: float = Field(default=1.0, alias="TELEGRAM_STREAM_EDIT_INTERVAL")  # seconds between edits of a streaming reply
+    stream_group_edit_interval: float = Field(default=4.0, alias="TELEGRAM_STREAM_GROUP_EDIT_INTERVAL")  # same, in groups (about 20 messages/minute)
 
 
 class AISettings(BaseSettings):
@@ -21,6 +24,16 @@ class AISettings(BaseSettings):
     openai_api_key: Optional[str] = Field(default=None, alias="OPENAI_API_KEY")  # For embeddings
     model: str = Field(default="claude-opus-4-6", alias="AI_MODEL")
     max_tokens: int = Field(default=4096, alias="AI_MAX_TOKENS")
+    max_connections: int = Field(default=20, alias="AI_MAX_CONNECTIONS")  # shared HTTP pool for model calls
+    timeout: float = Field(default=120.0, alias="AI_TIMEOUT")  # seconds per model call
+    max_retries: int = Field(default=2, alias="AI_MAX_RETRIES")
+    streaming: bool = Field(default=True, alias="AI_STREAMING")  # show replies as they are generated
+    prompt_caching: bool = Field(default=True, alias="AI_PROMPT_CACHING")  # cache breakpoints on tools, system prompt and history
+    tool_concurrency: int = Field(default=4, alias="AI_TOOL_CONCURRENCY")  # tool calls of one turn run at once
+    tool_timeout: float = Field(default=60.0, alias="AI_TOOL_TIMEOUT")  # seconds per tool call
+    serialize_chat_actions: bool = Field(default=True, alias="AI_SERIALIZE_CHAT_ACTIONS")  # one Telegram action per chat at a time
+    context_timeout: float = Field(default=5.0, alias="AI_CONTEXT_TIMEOUT")  # seconds for all context sources together
+    context_source_timeout: float = Field(default=3.0, alias="AI_CONTEXT_SOURCE_TIMEOUT")  # seconds per source (memory, RAG, history)
 
 
 class MemorySettings(BaseSettings):
@@ -35,6 +48,54 @@ class RAGSettings(BaseSettings):
     vector_db_path: str = Field(default="./data/vectors", alias="VECTOR_DB_PATH")
     min_score: float = Field(default=0.3, alias="RAG_MIN_SCORE")
     max_results: int = Field(default=10, alias="RAG_MAX_RESULTS")
+    wal_fsync_interval_ms: int = Field(default=200, alias="RAG_WAL_FSYNC_INTERVAL_MS")
+    wal_fsync_batch: int = Field(default=256, alias="RAG_WAL_FSYNC_BATCH")
+    compaction_interval: int = Field(default=300, alias="RAG_COMPACTION_INTERVAL")  # seconds
+    compaction_threshold: int = Field(default=5000, alias="RAG_COMPACTION_THRESHOLD")  # pending rows
+    compaction_dead_ratio: float = Field(default=0.3, alias="RAG_COMPACTION_DEAD_RATIO")
+    partition_by_user: bool = Field(default=False, alias="RAG_PARTITION_BY_USER")
+    max_loaded_partitions: int = Field(default=0, alias="RAG_MAX_LOADED_PARTITIONS")  # 0 = unlimited
+    ann_mode: str = Field(default="exact", alias="RAG_ANN_MODE")  # exact | hnsw | ivf
+    ann_min_size: int = Field(default=50000, alias="RAG_ANN_MIN_SIZE")  # smaller partitions stay exact
+    hnsw_m: int = Field(default=16, alias="RAG_HNSW_M")
+    hnsw_ef_construction: int = Field(default=100, alias="RAG_HNSW_EF_CONSTRUCTION")
+    hnsw_ef_search: int = Field(default=128, alias="RAG_HNSW_EF_SEARCH")
+    ann_build_workers: int = Field(default=1, alias="RAG_ANN_BUILD_WORKERS")  # graph build processes; 0 = in a thread
+    ivf_nlist: int = Field(default=0, alias="RAG_IVF_NLIST")  # 0 = 4 * sqrt(rows)
+    ivf_nprobe: int = Field(default=8, alias="RAG_IVF_NPROBE")
+    ivf_retrain_growth: float = Field(default=2.0, alias="RAG_IVF_RETRAIN_GROWTH")
+    ivf_train_sample: int = Field(default=20000, alias="RAG_IVF_TRAIN_SAMPLE")
+    quantization: str = Field(default="none", alias="RAG_QUANTIZATION")  # none | float16 | int8 | pq
+    pq_subvectors: int = Field(default=0, alias="RAG_PQ_SUBVECTORS")  # 0 = dimensions / 8
+    rescore_factor: int = Field(default=4, alias="RAG_RESCORE_FACTOR")  # exact re-score of limit * N; 0 = off
+    retrieval_mode: str = Field(default="semantic", alias="RAG_RETRIEVAL_MODE")  # semantic | lexical | hybrid
+    rrf_k: int = Field(default=60, alias="RAG_RRF_K")  # reciprocal rank fusion constant
+    index_queue_size: int = Field(default=1000, alias="RAG_INDEX_QUEUE_SIZE")
+    index_queue_policy: str = Field(default="spill", alias="RAG_INDEX_QUEUE_POLICY")  # spill | drop_oldest | drop_newest
+    index_workers: int = Field(default=2, alias="RAG_INDEX_WORKERS")
+    index_batch_size: int = Field(default=32, alias="RAG_INDEX_BATCH_SIZE")
+    backfill_enabled: bool = Field(default=False, alias="RAG_BACKFILL")  # index stored history on start
+    backfill_batch_size: int = Field(default=200, alias="RAG_BACKFILL_BATCH_SIZE")
+    backfill_rate: float = Field(default=20.0, alias="RAG_BACKFILL_RATE")  # messages per second; 0 = unthrottled
+    embedding_migration: bool = Field(default=True, alias="RAG_EMBEDDING_MIGRATION")  # re-embed in the background when the embedding version changes
+    migration_batch_size: int = Field(default=200, alias="RAG_MIGRATION_BATCH_SIZE")
+    migration_rate: float = Field(default=50.0, alias="RAG_MIGRATION_RATE")  # documents per second; 0 = unthrottled
+    embedding_backend: str = Field(default="openai", alias="RAG_EMBEDDING_BACKEND")  # openai | hashing
+    embedding_dimensions: int = Field(default=0, alias="RAG_EMBEDDING_DIMENSIONS")  # 0 = the model's full width
+    embedding_workers: int = Field(default=2, alias="RAG_EMBEDDING_WORKERS")  # local backend processes; 0 = in-process
+    embedding_concurrency: int = Field(default=4, alias="RAG_EMBEDDING_CONCURRENCY")  # batches in flight per call
+    embedding_rpm: int = Field(default=0, alias="RAG_EMBEDDING_RPM")  # requests per minute; 0 = unlimited
+    embedding_tpm: int = Field(default=0, alias="RAG_EMBEDDING_TPM")  # tokens per minute; 0 = unlimited
+    embedding_max_retries: int = Field(default=3, alias="RAG_EMBEDDING_MAX_RETRIES")
+    embedding_retry_delay: float = Field(default=0.5, alias="RAG_EMBEDDING_RETRY_DELAY")  # seconds, doubled per retry
+    embedding_timeout: float = Field(default=30.0, alias="RAG_EMBEDDING_TIMEOUT")  # seconds per request
+    embedding_max_connections: int = Field(default=20, alias="RAG_EMBEDDING_MAX_CONNECTIONS")
+    embedding_batch_window_ms: float = Field(default=10.0, alias="RAG_EMBEDDING_BATCH_WINDOW_MS")  # 0 = no coalescing
+    embedding_cache_enabled: bool = Field(default=True, alias="RAG_EMBEDDING_CACHE")
+    embedding_cache_memory_entries: int = Field(default=4096, alias="RAG_EMBEDDING_CACHE_MEMORY_ENTRIES")
+    embedding_cache_max_entries: int = Field(default=100000, alias="RAG_EMBEDDING_CACHE_MAX_ENTRIES")
+    result_cache_size: int = Field(default=256, alias="RAG_RESULT_CACHE_SIZE")  # cached retrievals; 0 = disabled
+    result_cache_ttl: float = Field(default=300.0, alias="RAG_RESULT_CACHE_TTL")  # seconds
 
 
 class MCPSettings(BaseSettings):
@@ -47,7 +108,7 @@ class AppSettings(BaseSettings):
     """Application settings."""
     log_level: str = Field(default="info", alias="LOG_LEVEL")
     database_path: str = Field(default="./data/clawdbot.db", alias="DATABASE_PATH")
-    max_history_messages: int = Field(default=20, alias="MAX_HISTORY_MESSAGES")
+    max_history_messages: int = Field(default=20, alias="MAX_HISTORY_MESSAGES")  # with prompt caching: windows of N to 2N-1
 
 
 class Config(BaseSettings):
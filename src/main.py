@@ -21,7 +21,19 @@ from src.config import load_config, get_config
 from src.utils.logger import setup_logging, get_logger
 from src.memory.database import init_database, close_database
 from src.memory.mem0_client import initialize_memory
-from src.rag import init_vectorstore, start_indexer, stop_indexer
+from src.rag import (
+    init_vectorstore,
+    start_indexer,
+    stop_indexer,
+    start_backfill,
+    stop_backfill,
+    start_migration,
+    stop_migration,
+    close_vectorstore,
+)
+from src.rag.embedding_cache import close_embedding_cache
+from src.rag.embeddings import close_embedding_backend
+from src.agents import close_client
 from src.mcp import initialize_mcp, shutdown_mcp
 from src.tools.scheduler import task_scheduler
 from src.tools.telegram_actions import set_bot
@@ -59,6 +71,9 @@ async def main():
             logger.info("Initializing RAG system...")
             init_vectorstore()
             start_indexer()
+            start_migration()
+            if config.rag.backfill_enabled:
+                start_backfill()
         
         # 5. Initialize Memory if enabled
         if config.memory.enabled and config.memory.api_key:
@@ -146,8 +161,19 @@ async def shutdown():
     # Stop scheduler
     task_scheduler.stop()
     
-    # Stop indexer
-    stop_indexer()
+    # Stop indexing and flush the vector store
+    await stop_backfill()
+    await stop_migration()
+    await stop_indexer()
+    try:
+        await close_vectorstore()
+    except Exception as e:
+        logger.warning(f"Error closing vector store: {e}")
+    close_embedding_cache()
+    await close_embedding_backend()
+    
+    # Close the model client's connection pool
+    await close_client()
     
     # Shutdown MCP
     await shutdown_mcp()
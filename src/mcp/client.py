@@ -9,10 +9,11 @@ import asyncio
 import json
 import os
 import subprocess
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any, Optional
 
 from ..utils.logger import get_logger
+from ..tools.registry import set_tool_group, remove_tool_group
 from .config import load_mcp_config, MCPServerConfig
 from .tool_converter import mcp_tools_to_anthropic, parse_tool_name, format_mcp_result
 
@@ -26,6 +27,8 @@ class MCPServer:
     process: subprocess.Popen
     tools: list[dict]
     request_id: int = 0
+    # Tool schemas in Anthropic format (converted once, on connect)
+    anthropic_tools: list[dict] = field(default_factory=list)
 
 
 # Connected servers
@@ -105,6 +108,7 @@ async def _connect_server(config: MCPServerConfig) -> None:
         logger.info(f"Server {config.name} connected with {len(server.tools)} tools")
         
         _servers[config.name] = server
+        _register_tools(server)
         
     except Exception as e:
         logger.error(f"Failed to initialize {config.name}: {e}")
@@ -112,6 +116,24 @@ async def _connect_server(config: MCPServerConfig) -> None:
         raise
 
 
+def _register_tools(server: MCPServer) -> None:
+    """Add a connected server's tools to the agent's tool registry."""
+    server.anthropic_tools = mcp_tools_to_anthropic(server.tools, server.name)
+    set_tool_group(
+        f"mcp:{server.name}",
+        [(schema, _tool_handler(schema["name"])) for schema in server.anthropic_tools],
+    )
+
+
+def _tool_handler(tool_name: str):
+    """Registry handler that runs an MCP tool and formats its result."""
+    async def handler(args: dict, context: Any = None) -> str:
+        # Failures are reported to the model by the agent's tool loop
+        result = await execute_tool(tool_name, args)
+        return format_mcp_result(result)
+    return handler
+
+
 async def _send_request(server: MCPServer, method: str, params: dict) -> dict:
     """Send a JSON-RPC request to the server."""
     server.request_id += 1
@@ -181,6 +203,7 @@ async def shutdown_mcp() -> None:
         except Exception as e:
             logger.warning(f"Error shutting down {name}: {e}")
             server.process.kill()
+        remove_tool_group(f"mcp:{name}")
     
     _servers.clear()
     logger.info("MCP servers shut down")
@@ -195,9 +218,8 @@ def get_all_tools() -> list[dict]:
     """
     all_tools = []
     
-    for name, server in _servers.items():
-        anthropic_tools = mcp_tools_to_anthropic(server.tools, name)
-        all_tools.extend(anthropic_tools)
+    for server in _servers.values():
+        all_tools.extend(server.anthropic_tools)
     
     return all_tools
 
@@ -6,6 +6,8 @@ from .database import (
     get_or_create_session,
     add_message,
     get_session_history,
+    get_session_window,
+    get_messages_after,
     clear_session_history,
     create_scheduled_task,
     get_pending_tasks,
@@ -30,6 +32,8 @@ __all__ = [
     "get_or_create_session",
     "add_message",
     "get_session_history",
+    "get_session_window",
+    "get_messages_after",
     "clear_session_history",
     "create_scheduled_task",
     "get_pending_tasks",
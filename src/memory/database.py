@@ -254,6 +254,101 @@ def get_session_history(session_id: str, limit: int = 20) -> list[Message]:
     return list(reversed(messages))
 
 
+def get_session_window(session_id: str, size: int = 20) -> list[Message]:
+    """
+    Get recent session history in a window that advances `size` messages at a time.
+
+    The window starts at a multiple of `size` (counting from the session's
+    first message) and holds between `size` and 2 * size - 1 messages, so
+    its beginning - and a cached prompt prefix built from it - stays the
+    same while the next `size` messages are added.
+    """
+    conn = _get_connection()
+    size = max(1, size)
+    
+    (total,) = conn.execute(
+        "SELECT COUNT(*) FROM messages WHERE session_id = ?",
+        (session_id,)
+    ).fetchone()
+    start = max(0, (total - size) // size * size)
+    
+    cursor = conn.execute(
+        """
+        SELECT * FROM messages
+        WHERE session_id = ?
+        ORDER BY created_at, id
+        LIMIT -1 OFFSET ?
+        """,
+        (session_id, start)
+    )
+    
+    return [
+        Message(
+            id=row["id"],
+            session_id=row["session_id"],
+            role=row["role"],
+            content=row["content"],
+            message_id=row["message_id"],
+            created_at=row["created_at"],
+        )
+        for row in cursor.fetchall()
+    ]
+
+
+def get_messages_after(
+    after_id: int,
+    limit: int,
+    role: Optional[str] = "user",
+) -> list[tuple[Message, Session]]:
+    """
+    Page through stored messages in id order (keyset pagination).
+    
+    Args:
+        after_id: Return messages with an id greater than this
+        limit: Page size
+        role: Only messages with this role (None = all)
+    
+    Returns:
+        (message, session) pairs ordered by message id
+    """
+    conn = _get_connection()
+    
+    cursor = conn.execute(
+        """
+        SELECT m.id, m.session_id, m.role, m.content, m.message_id, m.created_at,
+               s.user_id, s.chat_id, s.session_type,
+               s.created_at AS session_created_at, s.last_activity
+        FROM messages m
+        JOIN sessions s ON s.id = m.session_id
+        WHERE m.id > ? AND (? IS NULL OR m.role = ?)
+        ORDER BY m.id
+        LIMIT ?
+        """,
+        (after_id, role, role, limit)
+    )
+    
+    page = []
+    for row in cursor.fetchall():
+        message = Message(
+            id=row["id"],
+            session_id=row["session_id"],
+            role=row["role"],
+            content=row["content"],
+            message_id=row["message_id"],
+            created_at=row["created_at"],
+        )
+        session = Session(
+            id=row["session_id"],
+            user_id=row["user_id"],
+            chat_id=row["chat_id"],
+            session_type=row["session_type"],
+            created_at=row["session_created_at"],
+            last_activity=row["last_activity"],
+        )
+        page.append((message, session))
+    return page
+
+
 def clear_session_history(session_id: str) -> None:
     """Clear all messages for a session."""
     conn = _get_connection()
@@ -12,6 +12,7 @@ HOW IT WORKS:
 4. Before responding, we retrieve relevant memories for context
 """
 
+import asyncio
 from typing import Optional
 
 from ..utils.logger import get_logger
@@ -85,7 +86,8 @@ async def add_memory(
     try:
         logger.debug(f"Adding memories for user {user_id}")
         
-        result = _memory_client.add(
+        result = await asyncio.to_thread(
+            _memory_client.add,
             messages,
             user_id=str(user_id),
             metadata={
@@ -131,7 +133,9 @@ async def search_memory(
     try:
         logger.debug(f"Searching memories for user {user_id}: \"{query[:50]}...\"")
         
-        result = _memory_client.search(
+        # The client is synchronous; keep its round trip off the event loop
+        result = await asyncio.to_thread(
+            _memory_client.search,
             query,
             user_id=str(user_id),
             limit=limit,
@@ -1,37 +1,85 @@
 """RAG (Retrieval Augmented Generation) module."""
 
-from .embeddings import create_embedding, create_embeddings, cosine_similarity, preprocess_text
+from .embeddings import (
+    create_embedding,
+    create_embeddings,
+    cosine_similarity,
+    preprocess_text,
+    get_embedding_stats,
+)
 from .vectorstore import (
     init_vectorstore,
     add_documents,
     search,
+    search_many,
+    lexical_search,
     get_document_count,
     document_exists,
     clear_all,
+    compact,
+    shrink_index,
+    get_embedding_versions,
+    close_vectorstore,
+    load_partition,
+    unload_partition,
+    persist_partition,
+)
+from .indexer import (
+    start_indexer,
+    stop_indexer,
+    enqueue_message,
+    index_single_message,
+    get_indexer_status,
 )
-from .indexer import start_indexer, stop_indexer, index_single_message, get_indexer_status
-from .retriever import retrieve, build_context_string, should_use_rag
+from .backfill import run_backfill, start_backfill, stop_backfill, get_backfill_status
+from .migration import run_migration, start_migration, stop_migration, get_migration_status
+from .result_cache import get_result_cache_stats
+from .retriever import retrieve, retrieve_many, RetrievalRequest, build_context_string, should_use_rag
 
 __all__ = [
     # Embeddings
     "create_embedding",
     "create_embeddings",
+    "get_embedding_stats",
     "cosine_similarity",
     "preprocess_text",
     # Vector Store
     "init_vectorstore",
     "add_documents",
     "search",
+    "search_many",
+    "lexical_search",
     "get_document_count",
     "document_exists",
     "clear_all",
+    "compact",
+    "shrink_index",
+    "get_embedding_versions",
+    "close_vectorstore",
+    "load_partition",
+    "unload_partition",
+    "persist_partition",
     # Indexer
     "start_indexer",
     "stop_indexer",
+    "enqueue_message",
     "index_single_message",
     "get_indexer_status",
+    # Backfill
+    "run_backfill",
+    "start_backfill",
+    "stop_backfill",
+    "get_backfill_status",
+    # Embedding migration
+    "run_migration",
+    "start_migration",
+    "stop_migration",
+    "get_migration_status",
     # Retriever
+    "get_result_cache_stats",
     "retrieve",
+    "retrieve_many",
+    "RetrievalRequest",
     "build_context_string",
     "should_use_rag",
 ]
@@ -0,0 +1,165 @@
+"""
+Backfill Module
+
+Indexes the conversation history already stored in SQLite (messages seen
+before RAG was enabled) into the vector store.
+
+The job pages through the messages table by id (keyset pagination), runs
+each page through the indexer's batch path (preprocess_text, skip ids the
+vector store already has, one batched embedding request, one bulk insert)
+and records the last message id it finished in a checkpoint file next to
+the vector store, so it resumes where it left off after a restart.
+
+It yields to live traffic: it pauses while the live indexing queue has a
+backlog and is capped at RAG_BACKFILL_RATE messages per second.
+
+Only user messages are indexed, like live indexing. Messages stored with
+their Telegram message id share the live document id and are never indexed
+twice; older rows without one are indexed as "<chat_id>:db<row id>". Group
+sessions do not record who wrote each message, so those documents carry no
+author.
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from ..utils.logger import get_logger
+from ..config import get_config
+from ..memory.database import get_messages_after
+from .indexer import IndexJob, index_jobs, get_indexer_status
+
+logger = get_logger("backfill")
+
+CHECKPOINT_FILE = "backfill_checkpoint.json"
+
+# How often to re-check the live queue while yielding to it (seconds)
+_YIELD_INTERVAL = 1.0
+
+# Backfill state
+_task: Optional[asyncio.Task] = None
+_state = {"last_id": 0, "indexed": 0, "scanned": 0, "done": False}
+
+
+def _checkpoint_path() -> Path:
+    return Path(get_config().rag.vector_db_path) / CHECKPOINT_FILE
+
+
+def _load_checkpoint() -> None:
+    path = _checkpoint_path()
+    if path.exists():
+        with open(path, "r") as f:
+            _state.update(json.load(f))
+
+
+def _save_checkpoint() -> None:
+    """Atomically replace the checkpoint file."""
+    path = _checkpoint_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(_state, f)
+    tmp_path.replace(path)
+
+
+def _to_job(message, session) -> IndexJob:
+    private = session.session_type == "private"
+    return IndexJob(
+        message_id=message.message_id or 0,
+        chat_id=session.chat_id,
+        user_id=session.user_id if private else 0,
+        user_name="",
+        text=message.content,
+        timestamp=datetime.fromtimestamp(message.created_at).isoformat(),
+        doc_id=None if message.message_id else f"{session.chat_id}:db{message.id}",
+    )
+
+
+async def _yield_to_live_traffic() -> None:
+    """Wait until the live indexing queue is drained."""
+    while True:
+        status = get_indexer_status()
+        if not (status["queue_depth"] or status["in_flight"] or status["spilled"]):
+            return
+        await asyncio.sleep(_YIELD_INTERVAL)
+
+
+async def run_backfill() -> dict:
+    """
+    Index every stored user message after the checkpoint.
+
+    Returns:
+        Backfill state (last message id done, counters)
+    """
+    config = get_config()
+    batch_size = max(1, config.rag.backfill_batch_size)
+    rate = config.rag.backfill_rate
+
+    _load_checkpoint()
+    _state["done"] = False
+    logger.info(f"Backfill starting after message {_state['last_id']}")
+
+    while True:
+        await _yield_to_live_traffic()
+        started = time.monotonic()
+
+        page = await asyncio.to_thread(get_messages_after, _state["last_id"], batch_size)
+        if not page:
+            break
+
+        _state["indexed"] += await index_jobs([_to_job(m, s) for m, s in page])
+        _state["scanned"] += len(page)
+        _state["last_id"] = page[-1][0].id
+        _save_checkpoint()
+
+        if rate > 0:
+            remaining = len(page) / rate - (time.monotonic() - started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+    _state["done"] = True
+    _save_checkpoint()
+    logger.info(
+        f"Backfill complete: {_state['indexed']} of {_state['scanned']} messages indexed"
+    )
+    return dict(_state)
+
+
+def start_backfill() -> None:
+    """Run the backfill in the background (call from the running event loop)."""
+    global _task
+
+    if _task is not None and not _task.done():
+        logger.warning("Backfill already running")
+        return
+
+    async def run() -> None:
+        try:
+            await run_backfill()
+        except Exception as e:
+            # The checkpoint is kept; the next start resumes from it
+            logger.error(f"Backfill failed after message {_state['last_id']}: {e}")
+
+    _task = asyncio.get_running_loop().create_task(run())
+
+
+async def stop_backfill() -> None:
+    """Cancel a running backfill (progress up to the last page is kept)."""
+    global _task
+
+    if _task is None:
+        return
+    _task.cancel()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+
+
+def get_backfill_status() -> dict:
+    """Get backfill progress."""
+    return {
+        "is_running": _task is not None and not _task.done(),
+        **_state,
+    }
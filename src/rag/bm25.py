@@ -0,0 +1,136 @@
+"""
+BM25 Module
+
+Inverted index for lexical (keyword) search over a partition's messages.
+
+Postings reference MatrixIndex row numbers, like the approximate indexes,
+so the index can be rebuilt from the matrix's texts at any time and dead
+rows are filtered with the matrix's liveness flags.
+
+Tokens keep the characters people search for literally: "#1234", "@alice",
+"err_conn_refused", "v2.1.0"; compound tokens are also indexed by their parts.
+"""
+
+import math
+import re
+from typing import Optional
+
+import numpy as np
+
+from .matrix_index import MatrixIndex, top_k
+
+_TOKEN_PATTERN = re.compile(r"[@#]?\w+(?:[-_.:/]\w+)*")
+_PART_PATTERN = re.compile(r"[^\W_]+")
+
+_INITIAL_CAPACITY = 1024
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased search tokens of a text (compound tokens plus their parts)."""
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        parts = _PART_PATTERN.findall(token)
+        if len(parts) > 1 or (parts and parts[0] != token):
+            tokens.extend(parts)
+    return tokens
+
+
+def document_terms(text: str, metadata: dict) -> list[str]:
+    """Tokens indexed for a document: its text, author name and @mentions."""
+    extra = [metadata.get("user_name") or "", *metadata.get("mentions", ())]
+    return tokenize(" ".join([text, *extra]))
+
+
+class BM25Index:
+    """Okapi BM25 over the rows of a MatrixIndex."""
+
+    def __init__(self, index: MatrixIndex, k1: float = 1.2, b: float = 0.75):
+        self.index = index
+        self.k1 = k1
+        self.b = b
+
+        # token -> (rows, term frequencies)
+        self.postings: dict[str, tuple[list[int], list[int]]] = {}
+        self._lengths = np.zeros(_INITIAL_CAPACITY, dtype=np.float32)
+        self._total_length = 0
+        self._size = 0
+
+    @property
+    def size(self) -> int:
+        """Number of rows indexed (rows [0, size))."""
+        return self._size
+
+    def add(self, row: int) -> None:
+        """Index the next row. Rows must be added in order."""
+        if row != self._size:
+            raise ValueError(f"Expected row {self._size}, got {row}")
+
+        _, text, metadata = self.index.document(row)
+        terms = document_terms(text, metadata)
+
+        counts: dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            rows, frequencies = self.postings.setdefault(term, ([], []))
+            rows.append(row)
+            frequencies.append(count)
+
+        if row >= self._lengths.shape[0]:
+            lengths = np.zeros(self._lengths.shape[0] * 2, dtype=np.float32)
+            lengths[:self._size] = self._lengths[:self._size]
+            self._lengths = lengths
+        self._lengths[row] = len(terms)
+        self._total_length += len(terms)
+        self._size += 1
+
+    def catch_up(self) -> int:
+        """Index every matrix row not covered yet. Returns rows added."""
+        start = self._size
+        for row in range(start, self.index.size):
+            self.add(row)
+        return self.index.size - start
+
+    def search(
+        self,
+        query: str,
+        limit: int = 10,
+        user_id: Optional[int] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score live rows containing any query token.
+
+        Returns:
+            (rows, scores) arrays sorted by descending BM25 score
+        """
+        empty = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        terms = [term for term in dict.fromkeys(tokenize(query)) if term in self.postings]
+        if not terms or limit <= 0 or self._size == 0:
+            return empty
+
+        count = self._size
+        average_length = self._total_length / count or 1.0
+
+        all_rows = []
+        all_weights = []
+        for term in terms:
+            rows, frequencies = self.postings[term]
+            rows = np.asarray(rows, dtype=np.int64)
+            tf = np.asarray(frequencies, dtype=np.float32)
+            df = rows.shape[0]
+            idf = math.log(1 + (count - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[rows] / average_length)
+            all_rows.append(rows)
+            all_weights.append(idf * tf * (self.k1 + 1) / (tf + norm))
+
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_weights)).astype(np.float32)
+
+        keep = self.index.filter_rows(rows, user_id=user_id)
+        rows, scores = rows[keep], scores[keep]
+        if rows.shape[0] == 0:
+            return empty
+
+        best = top_k(scores, limit)
+        return rows[best], scores[best]
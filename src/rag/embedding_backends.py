@@ -0,0 +1,248 @@
+"""
+Embedding Backends Module
+
+Pluggable sources of embedding vectors, selected with RAG_EMBEDDING_BACKEND:
+
+- openai: OpenAI's embedding API (text-embedding-3-small, 1536 dimensions)
+- hashing: local feature hashing of words and character trigrams, computed
+  on CPU in a process pool. No API key or network round trip; retrieval is
+  lexical-ish rather than semantic, which is enough to run, benchmark and
+  test the whole RAG pipeline offline.
+
+RAG_EMBEDDING_DIMENSIONS selects a narrower width. OpenAI's text-embedding-3
+models are trained so that a prefix of a vector is itself a usable embedding
+(Matryoshka representation), and the API returns such shortened vectors
+directly when asked for fewer dimensions.
+
+Vectors from different backends (or widths) are not comparable. The index
+records the embedding version it holds, and changing the backend or width
+re-embeds it online with RAG_EMBEDDING_MIGRATION=true (see migration.py);
+searches keep using the old version until the new one is complete.
+"""
+
+import asyncio
+import hashlib
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import httpx
+import numpy as np
+import openai
+from openai import AsyncOpenAI
+
+from ..utils.logger import get_logger
+from ..config import get_config
+from .bm25 import tokenize
+
+logger = get_logger("embedding_backends")
+
+OPENAI_MODEL = "text-embedding-3-small"
+OPENAI_DIMENSIONS = 1536
+
+HASHING_DIMENSIONS = 1536
+# Character trigrams weigh less than whole words
+_TRIGRAM_WEIGHT = 0.5
+
+
+class EmbeddingBackend:
+    """Interface of an embedding backend."""
+
+    # RAG_EMBEDDING_BACKEND name
+    name: str = ""
+    model: str = ""
+    dimensions: int = 0
+    # Whether a prefix of a vector is itself a valid, narrower embedding
+    truncatable: bool = False
+
+    @property
+    def space(self) -> str:
+        """Identifies the vector space; part of the embedding cache key."""
+        return self.model
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        """
+        Embed a batch of non-empty texts.
+
+        Returns:
+            One vector per text, in input order
+        """
+        raise NotImplementedError
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Whether a failed request may succeed when retried."""
+        return False
+
+    async def close(self) -> None:
+        """Release connections or worker processes."""
+
+
+class OpenAIBackend(EmbeddingBackend):
+    """OpenAI embedding API over a shared, bounded HTTP connection pool."""
+
+    name = "openai"
+    model = OPENAI_MODEL
+    truncatable = True
+
+    def __init__(self, dimensions: int = 0):
+        self.dimensions = min(dimensions, OPENAI_DIMENSIONS) if dimensions > 0 else OPENAI_DIMENSIONS
+        self._client: Optional[AsyncOpenAI] = None
+
+    @property
+    def space(self) -> str:
+        if self.dimensions == OPENAI_DIMENSIONS:
+            return self.model
+        return f"{self.model}@{self.dimensions}"
+
+    def _get_client(self) -> AsyncOpenAI:
+        if self._client is None:
+            config = get_config()
+            if not config.ai.openai_api_key:
+                raise RuntimeError(
+                    "OPENAI_API_KEY is required for RAG embeddings. "
+                    "Set it in .env, use RAG_EMBEDDING_BACKEND=hashing, "
+                    "or disable RAG with RAG_ENABLED=false."
+                )
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=config.rag.embedding_max_connections,
+                    max_keepalive_connections=config.rag.embedding_max_connections,
+                ),
+                timeout=config.rag.embedding_timeout,
+            )
+            self._client = AsyncOpenAI(
+                api_key=config.ai.openai_api_key,
+                http_client=http_client,
+                timeout=config.rag.embedding_timeout,
+                # Retries are scheduled by embeddings, with the rate limiter
+                max_retries=0,
+            )
+        return self._client
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        if self.dimensions == OPENAI_DIMENSIONS:
+            response = await self._get_client().embeddings.create(
+                model=self.model,
+                input=texts
+            )
+        else:
+            response = await self._get_client().embeddings.create(
+                model=self.model,
+                input=texts,
+                dimensions=self.dimensions
+            )
+        return [item.embedding for item in response.data]
+
+    def is_retryable(self, error: Exception) -> bool:
+        # Timeouts are APIConnectionErrors
+        return isinstance(
+            error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+        )
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+def _hash_feature(feature: str, dimensions: int) -> tuple[int, float]:
+    """Bucket and sign of a feature (stable across processes, unlike hash())."""
+    digest = int.from_bytes(
+        hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little"
+    )
+    return digest % dimensions, 1.0 if digest >> 63 else -1.0
+
+
+def hash_embed(texts: list[str], dimensions: int) -> np.ndarray:
+    """
+    Feature-hashing embeddings of texts (runs in worker processes).
+
+    Words and character trigrams are hashed into signed buckets with
+    sublinear term frequency; rows are L2-normalized.
+
+    Returns:
+        (len(texts), dimensions) float32 array
+    """
+    vectors = np.zeros((len(texts), dimensions), dtype=np.float32)
+    for i, text in enumerate(texts):
+        counts: dict[str, float] = {}
+        words = tokenize(text)
+        for word in words:
+            counts[word] = counts.get(word, 0.0) + 1.0
+        for word in dict.fromkeys(words):
+            padded = f" {word} "
+            for start in range(len(padded) - 2):
+                trigram = "~" + padded[start:start + 3]
+                counts[trigram] = counts.get(trigram, 0.0) + _TRIGRAM_WEIGHT
+
+        row = vectors[i]
+        for feature, count in counts.items():
+            bucket, sign = _hash_feature(feature, dimensions)
+            weight = 1.0 + math.log(count) if count > 1.0 else count
+            row[bucket] += sign * weight
+
+        norm = np.linalg.norm(row)
+        if norm > 0:
+            row /= norm
+    return vectors
+
+
+class HashingBackend(EmbeddingBackend):
+    """Local feature-hashing embeddings, computed in a process pool."""
+
+    name = "hashing"
+
+    def __init__(self, dimensions: int = 0):
+        self.dimensions = dimensions if dimensions > 0 else HASHING_DIMENSIONS
+        self.model = f"hashing-v1-{self.dimensions}"
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def _get_pool(self) -> Optional[ProcessPoolExecutor]:
+        workers = get_config().rag.embedding_workers
+        if workers <= 0:
+            return None
+        if self._pool is None:
+            # spawn: forking a process with live threads (indexer, SQLite) is unsafe
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            logger.info(f"Started {workers} local embedding workers")
+        return self._pool
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        pool = self._get_pool()
+        if pool is None:
+            vectors = await asyncio.to_thread(hash_embed, texts, self.dimensions)
+        else:
+            loop = asyncio.get_running_loop()
+            vectors = await loop.run_in_executor(pool, hash_embed, texts, self.dimensions)
+        return vectors.tolist()
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await asyncio.to_thread(pool.shutdown, wait=True, cancel_futures=True)
+
+
+_BACKEND_CLASSES = {
+    "openai": OpenAIBackend,
+    "hashing": HashingBackend,
+}
+
+
+def create_backend(name: str, dimensions: int = 0) -> EmbeddingBackend:
+    """
+    Instantiate an embedding backend by name.
+
+    Args:
+        name: Backend name (RAG_EMBEDDING_BACKEND)
+        dimensions: Embedding width; 0 = the backend's full width
+    """
+    backend_class = _BACKEND_CLASSES.get(name)
+    if backend_class is None:
+        raise ValueError(
+            f"Unknown embedding backend {name!r} (expected one of {', '.join(_BACKEND_CLASSES)})"
+        )
+    return backend_class(dimensions)
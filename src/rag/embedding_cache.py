@@ -0,0 +1,225 @@
+"""
+Embedding Cache Module
+
+Content-addressed cache of embeddings, so repeated text ("thanks!",
+forwarded messages, the same question in several chats) is embedded once.
+
+Entries are keyed by a hash of the model name and the preprocess_text()
+output. A small in-memory LRU sits in front of an SQLite table next to the
+vector store; the table is bounded by RAG_EMBEDDING_CACHE_MAX_ENTRIES and
+evicts the least recently used entries when it grows past it.
+"""
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ..utils.logger import get_logger
+from ..config import get_config
+
+logger = get_logger("embedding_cache")
+
+CACHE_FILE = "embedding_cache.db"
+
+# Keys per SQL statement (stays below SQLite's bound-parameter limit)
+_SQL_CHUNK = 500
+
+# Cache state
+_memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_connection: Optional[sqlite3.Connection] = None
+# _lock guards the in-memory LRU (held briefly, also on the event loop);
+# _disk_lock serializes SQLite access from worker threads
+_lock = threading.Lock()
+_disk_lock = threading.Lock()
+_disk_entries = 0
+_touched: set[str] = set()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+
+def cache_key(normalized_text: str, model: str) -> str:
+    """Cache key: hash of the model name and the preprocessed text."""
+    return hashlib.sha256(f"{model}\n{normalized_text}".encode("utf-8")).hexdigest()
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Open (and create) the on-disk cache. Call with _disk_lock held."""
+    global _connection, _disk_entries
+    if _connection is None:
+        config = get_config()
+        path = Path(config.rag.vector_db_path) / CACHE_FILE
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        _connection = sqlite3.connect(str(path), check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode = WAL")
+        _connection.execute("PRAGMA synchronous = NORMAL")
+        _connection.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used);
+        """)
+        _disk_entries = _connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        logger.info(f"Embedding cache opened ({_disk_entries} entries)")
+    return _connection
+
+
+def _remember(key: str, vector: np.ndarray) -> None:
+    """Insert into the in-memory LRU. Call with _lock held."""
+    _memory[key] = vector
+    _memory.move_to_end(key)
+    limit = get_config().rag.embedding_cache_memory_entries
+    while len(_memory) > limit:
+        _memory.popitem(last=False)
+
+
+def _take_touched(skip=()) -> list[str]:
+    """Entries used since the last recency flush."""
+    with _lock:
+        touched = [key for key in _touched if key not in skip]
+        _touched.clear()
+    return touched
+
+
+def _flush_touched(connection: sqlite3.Connection, touched: list[str], now: float) -> None:
+    """Write recency of used entries. Call with _disk_lock held."""
+    for start in range(0, len(touched), _SQL_CHUNK):
+        chunk = touched[start:start + _SQL_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        connection.execute(
+            f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})",
+            [now, *chunk],
+        )
+
+
+def _lookup_disk(keys: list[str]) -> dict[str, np.ndarray]:
+    found: dict[str, np.ndarray] = {}
+    with _disk_lock:
+        connection = _get_connection()
+        for start in range(0, len(keys), _SQL_CHUNK):
+            chunk = keys[start:start + _SQL_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = connection.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype="<f4")
+    with _lock:
+        for key, vector in found.items():
+            _remember(key, vector)
+        _touched.update(found)
+    return found
+
+
+def _store_disk(entries: dict[str, np.ndarray]) -> None:
+    global _disk_entries
+    now = time.time()
+    touched = _take_touched(skip=entries)
+    with _disk_lock:
+        connection = _get_connection()
+        with connection:
+            _flush_touched(connection, touched, now)
+
+            before = connection.total_changes
+            connection.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, vector.astype("<f4").tobytes(), now) for key, vector in entries.items()],
+            )
+            _disk_entries += connection.total_changes - before
+
+            max_entries = get_config().rag.embedding_cache_max_entries
+            if _disk_entries > max_entries:
+                # Evict down to 90% so eviction does not run on every insert
+                excess = _disk_entries - int(max_entries * 0.9)
+                connection.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,),
+                )
+                _disk_entries -= excess
+                logger.info(f"Evicted {excess} embedding cache entries")
+
+
+async def get_cached(keys: list[str]) -> dict[str, list[float]]:
+    """
+    Look up cached embeddings.
+
+    Returns:
+        Embeddings for the keys that were found
+    """
+    config = get_config()
+    if not config.rag.embedding_cache_enabled or not keys:
+        return {}
+
+    found: dict[str, np.ndarray] = {}
+    missing = []
+    with _lock:
+        for key in dict.fromkeys(keys):
+            vector = _memory.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                _memory.move_to_end(key)
+                _touched.add(key)
+                found[key] = vector
+    _stats["memory_hits"] += len(found)
+
+    if missing:
+        try:
+            from_disk = await asyncio.to_thread(_lookup_disk, missing)
+        except Exception as e:
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            from_disk = {}
+        _stats["disk_hits"] += len(from_disk)
+        _stats["misses"] += len(missing) - len(from_disk)
+        found.update(from_disk)
+
+    return {key: vector.tolist() for key, vector in found.items()}
+
+
+async def store_cached(entries: dict[str, list[float]]) -> None:
+    """Add freshly created embeddings to the cache."""
+    config = get_config()
+    if not config.rag.embedding_cache_enabled or not entries:
+        return
+
+    vectors = {key: np.asarray(vector, dtype=np.float32) for key, vector in entries.items()}
+    with _lock:
+        for key, vector in vectors.items():
+            _remember(key, vector)
+
+    try:
+        await asyncio.to_thread(_store_disk, vectors)
+    except Exception as e:
+        logger.warning(f"Embedding cache write failed: {e}")
+
+
+def get_cache_stats() -> dict:
+    """Hit/miss counters and sizes of the embedding cache."""
+    return {
+        **_stats,
+        "memory_entries": len(_memory),
+        "disk_entries": _disk_entries,
+    }
+
+
+def close_embedding_cache() -> None:
+    """Flush recency updates and close the on-disk cache."""
+    global _connection
+    with _disk_lock:
+        if _connection is None:
+            return
+        with _connection:
+            _flush_touched(_connection, _take_touched(), time.time())
+        _connection.close()
+        _connection = None
+    with _lock:
+        _memory.clear()
@@ -1,80 +1,230 @@
 """
 Embeddings Module
 
-Converts text into vector embeddings using OpenAI's embedding API.
-Embeddings are numerical representations of text that capture semantic meaning.
+Converts text into vector embeddings using the configured backend
+(RAG_EMBEDDING_BACKEND; see embedding_backends). Embeddings are numerical
+representations of text that capture semantic meaning.
+
+The OpenAI backend sends requests through one AsyncOpenAI client with a
+shared, bounded HTTP connection pool, so concurrent chats overlap their
+embedding round trips instead of blocking the event loop. Each request has
+its own timeout and is cancelled together with the task awaiting it.
+
+Every vector belongs to an embedding version (EmbeddingSpec.version): the
+backend's vector space plus PREPROCESS_VERSION. The vector store records the
+version it was built with and keeps using it for queries while a shadow
+index for a newly configured version is built (see migration), so callers
+pass the spec they need; the default is the configured one.
+
+Single-text requests (live indexing, queries) are coalesced: callers arriving
+within RAG_EMBEDDING_BATCH_WINDOW_MS of each other share one batched API
+request (up to MAX_BATCH_SIZE texts) and each gets its own vector back.
 """
 
+import asyncio
+import random
 import re
-from typing import Optional
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
 
 import numpy as np
-from openai import OpenAI
 
 from ..utils.logger import get_logger
 from ..config import get_config
+from .embedding_backends import EmbeddingBackend, create_backend
+from .embedding_cache import cache_key, get_cached, store_cached
 
 logger = get_logger("embeddings")
 
 # Embedding configuration
-EMBEDDING_MODEL = "text-embedding-3-small"
-EMBEDDING_DIMENSIONS = 1536
 MAX_BATCH_SIZE = 100
+# Bump when preprocess_text() changes in a way that changes embeddings
+PREPROCESS_VERSION = 1
+
+# Backoff between retries of a failed request (seconds)
+_MAX_RETRY_DELAY = 30.0
+# Rough token estimate for the tokens-per-minute limit
+_CHARS_PER_TOKEN = 4
+
+
+@dataclass(frozen=True)
+class EmbeddingSpec:
+    """Backend and width that produce an embedding version."""
+    backend: str
+    dimensions: int
+    version: str
+
+
+# Backends in use, by (backend name, dimensions)
+_backends: dict[tuple[str, int], EmbeddingBackend] = {}
+_configured: Optional[EmbeddingSpec] = None
+
+# Coalescer state per backend: texts waiting for the current batching window
+_pending: dict[tuple[str, int], list[tuple[str, asyncio.Future]]] = {}
+_flush_handles: dict[tuple[str, int], asyncio.TimerHandle] = {}
+_batch_tasks: set[asyncio.Task] = set()
 
-# OpenAI client
-_client: Optional[OpenAI] = None
+# Achieved batch sizes of coalesced requests
+_BATCH_BUCKETS = (1, 4, 16, 64, MAX_BATCH_SIZE)
+_batch_stats = {
+    "batches": 0,
+    "texts": 0,
+    "max_batch_size": 0,
+    "histogram": {bucket: 0 for bucket in _BATCH_BUCKETS},
+}
 
 
-def _get_client() -> OpenAI:
-    """Get the OpenAI client (used for embeddings only)."""
-    global _client
-    if _client is None:
+def configured_spec() -> EmbeddingSpec:
+    """The embedding version selected by RAG_EMBEDDING_BACKEND / RAG_EMBEDDING_DIMENSIONS."""
+    global _configured
+    if _configured is None:
         config = get_config()
-        if not config.ai.openai_api_key:
-            raise RuntimeError(
-                "OPENAI_API_KEY is required for RAG embeddings. "
-                "Set it in .env or disable RAG with RAG_ENABLED=false."
+        backend = create_backend(config.rag.embedding_backend, config.rag.embedding_dimensions)
+        _configured = EmbeddingSpec(
+            backend=config.rag.embedding_backend,
+            dimensions=backend.dimensions,
+            version=f"{backend.space}+p{PREPROCESS_VERSION}",
+        )
+    return _configured
+
+
+def get_backend(spec: Optional[EmbeddingSpec] = None) -> EmbeddingBackend:
+    """Get the backend for an embedding version (default: the configured one)."""
+    spec = spec or configured_spec()
+    key = (spec.backend, spec.dimensions)
+    backend = _backends.get(key)
+    if backend is None:
+        backend = create_backend(spec.backend, spec.dimensions)
+        _backends[key] = backend
+        logger.info(f"Embedding backend: {backend.model} ({backend.dimensions} dimensions)")
+    return backend
+
+
+async def close_embedding_backend() -> None:
+    """Close the embedding backends (connection pools or worker processes)."""
+    backends = list(_backends.values())
+    _backends.clear()
+    for backend in backends:
+        await backend.close()
+
+
+class _TokenBucket:
+    """Per-minute quota, refilled continuously, with about one second of burst."""
+    
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60
+        self.capacity = max(1.0, self.rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self, amount: float) -> None:
+        """Take `amount` tokens, waiting until the quota allows it."""
+        async with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Go into debt rather than reject requests larger than the burst
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+_request_limiter: Optional[_TokenBucket] = None
+_token_limiter: Optional[_TokenBucket] = None
+
+
+async def _acquire_quota(texts: list[str]) -> None:
+    """Wait for request and token quota (RAG_EMBEDDING_RPM / RAG_EMBEDDING_TPM)."""
+    global _request_limiter, _token_limiter
+    config = get_config()
+    if config.rag.embedding_rpm > 0:
+        if _request_limiter is None:
+            _request_limiter = _TokenBucket(config.rag.embedding_rpm)
+        await _request_limiter.acquire(1)
+    if config.rag.embedding_tpm > 0:
+        if _token_limiter is None:
+            _token_limiter = _TokenBucket(config.rag.embedding_tpm)
+        tokens = sum(len(text) // _CHARS_PER_TOKEN + 1 for text in texts)
+        await _token_limiter.acquire(tokens)
+
+
+async def _embed_with_retries(backend: EmbeddingBackend, texts: list[str]) -> list[list[float]]:
+    """One backend request, rate limited and retried with backoff on transient errors."""
+    config = get_config()
+    attempt = 0
+    while True:
+        await _acquire_quota(texts)
+        try:
+            return await backend.embed(texts)
+        except Exception as e:
+            if attempt >= config.rag.embedding_max_retries or not backend.is_retryable(e):
+                raise
+            # Exponential backoff with jitter, so parallel batches do not retry in lockstep
+            delay = min(_MAX_RETRY_DELAY, config.rag.embedding_retry_delay * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+            attempt += 1
+            logger.warning(
+                f"Embedding request failed ({e}); retry {attempt}/"
+                f"{config.rag.embedding_max_retries} in {delay:.1f}s"
             )
-        _client = OpenAI(api_key=config.ai.openai_api_key)
-    return _client
+            await asyncio.sleep(delay)
 
 
-async def create_embedding(text: str) -> list[float]:
+async def create_embedding(text: str, spec: Optional[EmbeddingSpec] = None) -> list[float]:
     """
     Create an embedding for a single text string.
     
     Args:
         text: The text to embed
+        spec: Embedding version to produce (default: the configured one)
     
     Returns:
-        A vector of floating-point numbers (1536 dimensions)
+        A vector of floating-point numbers (the backend's dimensions)
     """
+    backend = get_backend(spec)
     if not text or not text.strip():
         logger.warning("Attempted to embed empty text")
-        return [0.0] * EMBEDDING_DIMENSIONS
+        return [0.0] * backend.dimensions
+    
+    key = _cache_key(text, backend)
+    cached = await get_cached([key])
+    if key in cached:
+        return cached[key]
     
     try:
-        client = _get_client()
-        response = client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=text
-        )
-        
-        embedding = response.data[0].embedding
+        if get_config().rag.embedding_batch_window_ms > 0:
+            embedding = await _coalesce(backend, text)
+        else:
+            embedding = (await _embed_with_retries(backend, [text]))[0]
         logger.debug(f"Created embedding for text ({len(text)} chars)")
         
+        await store_cached({key: embedding})
         return embedding
     except Exception as e:
         logger.error(f"Failed to create embedding: {e}")
         raise
 
 
-async def create_embeddings(texts: list[str]) -> list[list[float]]:
+async def create_embeddings(
+    texts: list[str],
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    spec: Optional[EmbeddingSpec] = None,
+) -> list[list[float]]:
     """
     Create embeddings for multiple texts in a batch.
     
+    Batches are sent concurrently within the configured request/token rate
+    limits; a failed batch is retried on its own. Batches that succeed are
+    cached even if the call fails, so rerunning a job skips them.
+    
     Args:
         texts: Array of texts to embed
+        on_progress: Called with (completed, total) whenever the first
+            `completed` inputs have their embeddings
+        spec: Embedding version to produce (default: the configured one)
     
     Returns:
         Array of embeddings in the same order as inputs
@@ -82,6 +232,8 @@ async def create_embeddings(texts: list[str]) -> list[list[float]]:
     if not texts:
         return []
     
+    backend = get_backend(spec)
+    
     # Filter out empty texts but track their positions
     valid_texts = []
     valid_indices = []
@@ -92,41 +244,171 @@ async def create_embeddings(texts: list[str]) -> list[list[float]]:
             valid_indices.append(i)
     
     if not valid_texts:
-        return [[0.0] * EMBEDDING_DIMENSIONS for _ in texts]
+        return [[0.0] * backend.dimensions for _ in texts]
     
     results = [None] * len(texts)
-    client = _get_client()
     
-    # Process in batches
-    for i in range(0, len(valid_texts), MAX_BATCH_SIZE):
-        batch = valid_texts[i:i + MAX_BATCH_SIZE]
-        batch_indices = valid_indices[i:i + MAX_BATCH_SIZE]
+    # Serve repeats from the cache; embed each distinct missing text once
+    keys = [_cache_key(text, backend) for text in valid_texts]
+    cached = await get_cached(keys)
+    
+    missing: dict[str, str] = {}
+    for key, text in zip(keys, valid_texts):
+        if key not in cached:
+            missing.setdefault(key, text)
+    missing_keys = list(missing)
+    missing_texts = list(missing.values())
+    
+    created: dict[str, list[float]] = {}
+    
+    # Inputs are reported done as a prefix, so callers can checkpoint
+    position_keys: list[Optional[str]] = [None] * len(texts)
+    for original_index, key in zip(valid_indices, keys):
+        position_keys[original_index] = key
+    completed = 0
+    
+    def report_progress() -> None:
+        nonlocal completed
+        while completed < len(texts):
+            key = position_keys[completed]
+            if key is not None and key not in cached and key not in created:
+                break
+            completed += 1
+        if on_progress is not None:
+            on_progress(completed, len(texts))
+    
+    report_progress()
+    
+    # Process in batches, up to RAG_EMBEDDING_CONCURRENCY at a time
+    semaphore = asyncio.Semaphore(max(1, get_config().rag.embedding_concurrency))
+    batch_count = (len(missing_texts) + MAX_BATCH_SIZE - 1) // MAX_BATCH_SIZE
+    
+    async def run_batch(start: int) -> None:
+        batch = missing_texts[start:start + MAX_BATCH_SIZE]
+        batch_keys = missing_keys[start:start + MAX_BATCH_SIZE]
         
-        try:
-            logger.info(f"Processing embedding batch {i // MAX_BATCH_SIZE + 1}")
-            
-            response = client.embeddings.create(
-                model=EMBEDDING_MODEL,
-                input=batch
-            )
-            
-            for j, item in enumerate(response.data):
-                original_index = batch_indices[j]
-                results[original_index] = item.embedding
-                
-        except Exception as e:
-            logger.error(f"Batch embedding failed: {e}")
-            raise
+        async with semaphore:
+            logger.info(f"Processing embedding batch {start // MAX_BATCH_SIZE + 1}/{batch_count}")
+            vectors = await _embed_with_retries(backend, batch)
+        
+        batch_created = dict(zip(batch_keys, vectors))
+        created.update(batch_created)
+        # Cache each batch as it lands: a failed job keeps its progress
+        await store_cached(batch_created)
+        report_progress()
+    
+    outcomes = await asyncio.gather(
+        *(run_batch(start) for start in range(0, len(missing_texts), MAX_BATCH_SIZE)),
+        return_exceptions=True,
+    )
+    errors = [outcome for outcome in outcomes if isinstance(outcome, BaseException)]
+    if errors:
+        logger.error(
+            f"Batch embedding failed: {len(errors)} of {batch_count} batches "
+            f"({len(created)} embeddings created and cached): {errors[0]}"
+        )
+        raise errors[0]
+    
+    for original_index, key in zip(valid_indices, keys):
+        results[original_index] = cached.get(key) or created[key]
     
     # Fill in zeros for empty texts
     for i in range(len(results)):
         if results[i] is None:
-            results[i] = [0.0] * EMBEDDING_DIMENSIONS
+            results[i] = [0.0] * backend.dimensions
     
-    logger.info(f"Created {len(valid_texts)} embeddings")
+    logger.info(
+        f"Created {len(created)} embeddings "
+        f"({len(valid_texts) - len(created)} served from cache)"
+    )
     return results
 
 
+async def _coalesce(backend: EmbeddingBackend, text: str) -> list[float]:
+    """Queue a text for the backend's next batched request and wait for its vector."""
+    key = (backend.name, backend.dimensions)
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    pending = _pending.setdefault(key, [])
+    pending.append((text, future))
+    
+    if len(pending) >= MAX_BATCH_SIZE:
+        _flush_pending(backend)
+    elif key not in _flush_handles:
+        window = get_config().rag.embedding_batch_window_ms / 1000
+        _flush_handles[key] = loop.call_later(window, _flush_pending, backend)
+    
+    return await future
+
+
+def _flush_pending(backend: EmbeddingBackend) -> None:
+    """Close the backend's current batching window and send its texts."""
+    key = (backend.name, backend.dimensions)
+    handle = _flush_handles.pop(key, None)
+    if handle is not None:
+        handle.cancel()
+    
+    batch = [(text, future) for text, future in _pending.pop(key, []) if not future.done()]
+    if not batch:
+        return
+    
+    task = asyncio.get_running_loop().create_task(_send_batch(backend, batch))
+    _batch_tasks.add(task)
+    task.add_done_callback(_batch_tasks.discard)
+
+
+async def _send_batch(backend: EmbeddingBackend, batch: list[tuple[str, asyncio.Future]]) -> None:
+    """Embed a coalesced batch and resolve each caller's future."""
+    texts = list(dict.fromkeys(text for text, _ in batch))
+    _record_batch(len(texts))
+    
+    try:
+        vectors = dict(zip(texts, await _embed_with_retries(backend, texts)))
+    except Exception as e:
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(e)
+        return
+    
+    for text, future in batch:
+        if not future.done():
+            future.set_result(vectors[text])
+
+
+def _record_batch(size: int) -> None:
+    _batch_stats["batches"] += 1
+    _batch_stats["texts"] += size
+    _batch_stats["max_batch_size"] = max(_batch_stats["max_batch_size"], size)
+    for bucket in _BATCH_BUCKETS:
+        if size <= bucket:
+            _batch_stats["histogram"][bucket] += 1
+            break
+
+
+def get_embedding_stats() -> dict:
+    """
+    Batch sizes achieved by the coalescer.
+    
+    Returns:
+        batches, texts, average/max batch size and a histogram of batch
+        sizes (counts of batches with size <= each bucket bound)
+    """
+    batches = _batch_stats["batches"]
+    return {
+        "batches": batches,
+        "texts": _batch_stats["texts"],
+        "average_batch_size": round(_batch_stats["texts"] / batches, 2) if batches else 0.0,
+        "max_batch_size": _batch_stats["max_batch_size"],
+        "histogram": dict(_batch_stats["histogram"]),
+    }
+
+
+def _cache_key(text: str, backend: EmbeddingBackend) -> str:
+    """Embedding cache key for a text (normalized with preprocess_text)."""
+    normalized = preprocess_text(text) or " ".join(text.split())
+    return cache_key(normalized, backend.space)
+
+
 def cosine_similarity(a: list[float], b: list[float]) -> float:
     """
     Calculate cosine similarity between two vectors.
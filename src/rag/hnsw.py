@@ -0,0 +1,507 @@
+"""
+HNSW Module
+
+Approximate nearest neighbour search with a hierarchical navigable
+small-world graph, implemented with NumPy.
+
+Graph nodes are MatrixIndex row numbers; vectors are read from the matrix
+rather than copied. Dead rows stay in the graph for navigation and are
+filtered out of results.
+
+Links are stored as fixed-width int32 arrays (-1 = empty slot), one row per
+node and layer, so each search step gathers and scores the neighbours of
+several candidates with a few array operations instead of walking them one
+by one. Inserts still run one at a time in Python, so full builds go through
+build_graph(), which a partition runs in a worker process (see
+RAG_ANN_BUILD_WORKERS); after a compaction rewrite the graph is carried over
+to the new row numbers with remap() instead of being rebuilt.
+
+Tuning:
+- m: links per node (2*m on the bottom layer); higher = better recall, more memory
+- ef_construction: candidate list size while inserting; higher = better graph, slower inserts
+- ef_search: candidate list size while querying; higher = better recall, slower queries
+"""
+
+import math
+import random
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .matrix_index import MatrixIndex, normalize
+
+GRAPH_FILE = "hnsw.npz"
+
+# Share of the result list expanded per search step (at least one candidate)
+_BEAM_FRACTION = 4
+
+
+class _Rows:
+    """Plain-array stand-in for a MatrixIndex (graph builds in a worker process)."""
+
+    def __init__(self, vectors: np.ndarray):
+        self._vectors = vectors
+
+    @property
+    def size(self) -> int:
+        return self._vectors.shape[0]
+
+    def vector(self, row: int) -> np.ndarray:
+        return self._vectors[row]
+
+    def vectors(self, rows) -> np.ndarray:
+        return self._vectors[rows]
+
+
+class _Layer:
+    """Fixed-width link lists of one graph layer."""
+
+    def __init__(self, width: int, dense: bool):
+        self.width = width
+        # The bottom layer holds every node, at row = node number
+        self.dense = dense
+        self.size = 0
+        self.links = np.full((0, width), -1, dtype=np.int32)
+        self.counts = np.zeros(0, dtype=np.int32)
+        # Upper layers: node of each row, and row of each node (-1 = not on this layer)
+        self.nodes = np.zeros(0, dtype=np.int32)
+        self.rows = np.full(0, -1, dtype=np.int32)
+
+    def _grow(self, array: np.ndarray, needed: int, fill: int) -> np.ndarray:
+        if needed <= array.shape[0]:
+            return array
+        capacity = max(needed, 2 * array.shape[0], 64)
+        grown = np.full((capacity,) + array.shape[1:], fill, dtype=array.dtype)
+        grown[:array.shape[0]] = array
+        return grown
+
+    def add_node(self, node: int) -> None:
+        row = self.size
+        self.size += 1
+        self.links = self._grow(self.links, self.size, -1)
+        self.counts = self._grow(self.counts, self.size, 0)
+        if not self.dense:
+            self.nodes = self._grow(self.nodes, self.size, -1)
+            self.nodes[row] = node
+            self.rows = self._grow(self.rows, node + 1, -1)
+            self.rows[node] = row
+
+    def row_of(self, nodes):
+        return nodes if self.dense else self.rows[nodes]
+
+    def neighbours(self, nodes: np.ndarray) -> np.ndarray:
+        """Linked nodes of several nodes, as one flat array."""
+        links = self.links[self.row_of(nodes)]
+        return links[links >= 0]
+
+    def set_links(self, node: int, neighbours: np.ndarray) -> None:
+        row = self.row_of(node)
+        self.links[row] = -1
+        self.links[row, :len(neighbours)] = neighbours
+        self.counts[row] = len(neighbours)
+
+    def node_list(self) -> np.ndarray:
+        """Node of each row."""
+        if self.dense:
+            return np.arange(self.size, dtype=np.int32)
+        return self.nodes[:self.size]
+
+    @classmethod
+    def restore(cls, width: int, dense: bool, nodes: np.ndarray, links: np.ndarray) -> "_Layer":
+        layer = cls(width, dense)
+        layer.size = links.shape[0]
+        layer.links = np.ascontiguousarray(links, dtype=np.int32).reshape(-1, width)
+        layer.counts = (layer.links >= 0).sum(axis=1).astype(np.int32)
+        if not dense:
+            layer.nodes = np.asarray(nodes, dtype=np.int32)
+            layer.rows = np.full(int(nodes.max()) + 1 if nodes.shape[0] else 0, -1, dtype=np.int32)
+            layer.rows[layer.nodes] = np.arange(layer.size, dtype=np.int32)
+        return layer
+
+
+class HNSWIndex:
+    """Incrementally built HNSW graph over the rows of a MatrixIndex."""
+
+    def __init__(
+        self,
+        index: MatrixIndex,
+        m: int = 16,
+        ef_construction: int = 100,
+        ef_search: int = 64,
+        seed: int = 42,
+    ):
+        self.index = index
+        self.m = m
+        self.m0 = 2 * m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self._level_mult = 1 / math.log(max(m, 2))
+        self._random = random.Random(seed)
+
+        self.levels: list[int] = []
+        self.layers: list[_Layer] = []
+        self.entry_point: Optional[int] = None
+
+        # Scratch space for _search_layer, reused across searches: a node is
+        # visited when its mark equals the current epoch
+        self._visit_marks = np.zeros(0, dtype=np.uint32)
+        self._first = np.empty(0, dtype=np.int32)
+        self._visit_epoch = 0
+
+    @property
+    def size(self) -> int:
+        """Number of rows inserted into the graph (rows [0, size))."""
+        return len(self.levels)
+
+    def _random_level(self) -> int:
+        return int(-math.log(1.0 - self._random.random()) * self._level_mult)
+
+    def _scores(self, nodes: np.ndarray, q: np.ndarray) -> np.ndarray:
+        return self.index.vectors(nodes) @ q
+
+    def _next_visit_epoch(self) -> int:
+        """Start a search: returns the mark for nodes it visits."""
+        if self._visit_marks.shape[0] < self.size:
+            capacity = max(self.size, 2 * self._visit_marks.shape[0], 64)
+            self._visit_marks = np.zeros(capacity, dtype=np.uint32)
+            self._first = np.empty(capacity, dtype=np.int32)
+            self._visit_epoch = 0
+        if self._visit_epoch == np.iinfo(np.uint32).max:
+            self._visit_marks[:] = 0
+            self._visit_epoch = 0
+        self._visit_epoch += 1
+        return self._visit_epoch
+
+    def _search_layer(
+        self,
+        q: np.ndarray,
+        nodes: np.ndarray,
+        scores: np.ndarray,
+        ef: int,
+        layer: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Best-first search of one layer from the entry (nodes, scores).
+
+        The result list doubles as the candidate queue: each step expands the
+        best few results not expanded yet, and the search ends once every
+        result has been expanded.
+
+        Returns:
+            Up to `ef` (nodes, scores), unordered
+        """
+        links = self.layers[layer]
+        beam = max(1, ef // _BEAM_FRACTION)
+        epoch = self._next_visit_epoch()
+        marks = self._visit_marks
+        marks[nodes] = epoch
+        # For de-duplicating gathered neighbours without sorting
+        first = self._first
+        expanded = np.zeros(nodes.shape[0], dtype=bool)
+
+        while True:
+            pending = np.flatnonzero(~expanded)
+            if pending.shape[0] == 0:
+                break
+            if pending.shape[0] > beam:
+                pending = pending[np.argpartition(-scores[pending], beam - 1)[:beam]]
+            expanded[pending] = True
+
+            fresh = links.neighbours(nodes[pending])
+            fresh = fresh[marks[fresh] != epoch]
+            if fresh.shape[0] == 0:
+                continue
+            positions = np.arange(fresh.shape[0], dtype=np.int32)
+            first[fresh[::-1]] = positions[::-1]
+            fresh = fresh[first[fresh] == positions]
+            marks[fresh] = epoch
+
+            fresh_scores = self._scores(fresh, q)
+            if nodes.shape[0] >= ef:
+                better = fresh_scores > scores.min()
+                fresh, fresh_scores = fresh[better], fresh_scores[better]
+                if fresh.shape[0] == 0:
+                    continue
+
+            nodes = np.concatenate((nodes, fresh))
+            scores = np.concatenate((scores, fresh_scores))
+            expanded = np.concatenate((expanded, np.zeros(fresh.shape[0], dtype=bool)))
+            if nodes.shape[0] > ef:
+                keep = np.argpartition(-scores, ef - 1)[:ef]
+                nodes, scores, expanded = nodes[keep], scores[keep], expanded[keep]
+
+        return nodes, scores
+
+    def _select_neighbours(self, nodes: np.ndarray, scores: np.ndarray, limit: int) -> np.ndarray:
+        """
+        Neighbour selection heuristic: keep a candidate only if it is closer to
+        the new node than to any neighbour already kept (keeps the graph navigable).
+        """
+        order = np.argsort(-scores)
+        nodes, scores = nodes[order], scores[order]
+        if nodes.shape[0] <= limit:
+            return nodes
+
+        vectors = self.index.vectors(nodes)
+        pairwise = vectors @ vectors.T
+
+        # closest[i] = highest similarity of candidate i to any kept neighbour
+        closest = np.full(nodes.shape[0], -np.inf, dtype=np.float32)
+        kept: list[int] = []
+        skipped: list[int] = []
+
+        for position in range(nodes.shape[0]):
+            if closest[position] > scores[position]:
+                skipped.append(position)
+                continue
+            kept.append(position)
+            if len(kept) >= limit:
+                break
+            np.maximum(closest, pairwise[position], out=closest)
+
+        # Top up with the best skipped candidates so nodes keep enough links
+        kept.extend(skipped[:limit - len(kept)])
+        return nodes[kept]
+
+    def _link_back(self, node: int, neighbours: np.ndarray, layer: int) -> None:
+        """
+        Add reverse links to a new node. A neighbour whose list is full
+        replaces its weakest link if the new node is closer.
+        """
+        links = self.layers[layer]
+        rows = links.row_of(neighbours)
+        counts = links.counts[rows]
+        free = counts < links.width
+        links.links[rows[free], counts[free]] = node
+        links.counts[rows[free]] += 1
+
+        full = ~free
+        if not full.any():
+            return
+        rows, owners = rows[full], neighbours[full]
+        linked = links.links[rows]
+        owner_vectors = self.index.vectors(owners)
+        linked_vectors = self.index.vectors(linked.ravel()).reshape(linked.shape + (-1,))
+        link_scores = np.einsum("kwd,kd->kw", linked_vectors, owner_vectors)
+        new_scores = owner_vectors @ self.index.vector(node)
+
+        weakest = link_scores.argmin(axis=1)
+        replace = new_scores > link_scores[np.arange(rows.shape[0]), weakest]
+        links.links[rows[replace], weakest[replace]] = node
+
+    def _descend(self, q: np.ndarray, target_layer: int) -> tuple[np.ndarray, np.ndarray]:
+        """Greedy search from the entry point down to `target_layer`."""
+        nodes = np.array([self.entry_point], dtype=np.int32)
+        scores = self._scores(nodes, q)
+        for layer in range(self.levels[self.entry_point], target_layer, -1):
+            nodes, scores = self._search_layer(q, nodes, scores, 1, layer)
+        return nodes, scores
+
+    def add(self, row: int) -> None:
+        """Insert the next row. Rows must be added in order."""
+        if row != self.size:
+            raise ValueError(f"Expected row {self.size}, got {row}")
+
+        q = self.index.vector(row)
+        level = self._random_level()
+        self.levels.append(level)
+        while len(self.layers) <= level:
+            self.layers.append(_Layer(self.m0 if not self.layers else self.m, dense=not self.layers))
+        for layer in range(level + 1):
+            self.layers[layer].add_node(row)
+
+        if self.entry_point is None:
+            self.entry_point = row
+            return
+
+        top_level = self.levels[self.entry_point]
+        nodes, scores = self._descend(q, level)
+
+        for layer in range(min(level, top_level), -1, -1):
+            nodes, scores = self._search_layer(q, nodes, scores, self.ef_construction, layer)
+            neighbours = self._select_neighbours(nodes, scores, self.layers[layer].width)
+            self.layers[layer].set_links(row, neighbours)
+            self._link_back(row, neighbours, layer)
+
+        if level > top_level:
+            self.entry_point = row
+
+    def build(self, target: int) -> None:
+        """Insert rows [size, target). Runs in a worker thread or process."""
+        for row in range(self.size, target):
+            self.add(row)
+
+    def needs_rebuild(self, count: int) -> bool:
+        """Graphs are maintained incrementally and never need retraining."""
+        return False
+
+    def catch_up(self) -> int:
+        """Insert every matrix row the graph does not cover yet. Returns rows added."""
+        start = self.size
+        for row in range(start, self.index.size):
+            self.add(row)
+        return self.index.size - start
+
+    def search(
+        self,
+        query,
+        limit: int = 10,
+        ef: Optional[int] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Approximate top-k search over live rows.
+
+        Returns:
+            (rows, scores) arrays sorted by descending cosine similarity
+        """
+        if self.entry_point is None or limit <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        q = normalize(query)
+        ef = max(ef or self.ef_search, limit)
+
+        nodes, scores = self._descend(q, 0)
+        nodes, scores = self._search_layer(q, nodes, scores, ef, 0)
+        live = self.index.live_mask()[nodes]
+        nodes, scores = nodes[live], scores[live]
+
+        best = np.argsort(-scores)[:limit]
+        return nodes[best].astype(np.int64), scores[best].astype(np.float32)
+
+    def remap(self, index: MatrixIndex, mapping: np.ndarray) -> "HNSWIndex":
+        """
+        Carry the graph over to a rewritten matrix whose rows were renumbered.
+
+        Args:
+            index: The new matrix
+            mapping: New row of each old row (-1 = dropped); must keep the
+                order of the rows it keeps
+
+        Nodes that linked to dropped ones are relinked to the dropped nodes'
+        neighbours, keeping the closest. Runs in a worker thread.
+
+        Returns:
+            A graph over the new matrix's rows [0, kept rows)
+        """
+        mapping = np.asarray(mapping, dtype=np.int32)[:self.size]
+        graph = HNSWIndex(index, m=self.m, ef_construction=self.ef_construction, ef_search=self.ef_search)
+        kept = np.flatnonzero(mapping >= 0)
+        levels = np.array(self.levels, dtype=np.int32)[kept]
+        graph.levels = levels.tolist()
+        if kept.shape[0] == 0:
+            return graph
+
+        def new_ids(old: np.ndarray) -> np.ndarray:
+            return np.where(old >= 0, mapping[np.maximum(old, 0)], -1)
+
+        for old in self.layers:
+            old_nodes = old.node_list()
+            rows = np.flatnonzero(mapping[old_nodes] >= 0)
+            links = old.links[rows]
+            mapped = new_ids(links)
+            lost = np.flatnonzero(((links >= 0) & (mapped < 0)).any(axis=1))
+            nodes = mapping[old_nodes[rows]]
+
+            for i in lost.tolist():
+                dropped = links[i][(links[i] >= 0) & (mapped[i] < 0)]
+                candidates = np.concatenate((mapped[i], new_ids(old.neighbours(dropped))))
+                candidates = np.unique(candidates[(candidates >= 0) & (candidates != nodes[i])])
+                if candidates.shape[0] > old.width:
+                    scores = index.vectors(candidates) @ index.vector(int(nodes[i]))
+                    candidates = candidates[np.argpartition(-scores, old.width - 1)[:old.width]]
+                mapped[i] = -1
+                mapped[i, :candidates.shape[0]] = candidates
+
+            graph.layers.append(_Layer.restore(old.width, old.dense, nodes, mapped))
+
+        if mapping[self.entry_point] >= 0:
+            graph.entry_point = int(mapping[self.entry_point])
+        else:
+            graph.entry_point = int(np.argmax(levels))
+        return graph
+
+    def state(self) -> dict[str, np.ndarray]:
+        """The graph as plain arrays (see from_state())."""
+        arrays = {
+            "meta": np.array(
+                [
+                    self.size,
+                    -1 if self.entry_point is None else self.entry_point,
+                    self.m,
+                    self.ef_construction,
+                    self.ef_search,
+                ],
+                dtype=np.int64,
+            ),
+            "levels": np.array(self.levels, dtype=np.int8),
+        }
+        for layer, links in enumerate(self.layers):
+            arrays[f"nodes_{layer}"] = links.node_list()
+            arrays[f"links_{layer}"] = links.links[:links.size]
+        return arrays
+
+    @classmethod
+    def from_state(
+        cls,
+        index: MatrixIndex,
+        arrays,
+        ef_search: Optional[int] = None,
+    ) -> "HNSWIndex":
+        """Recreate a graph from state() arrays."""
+        size, entry_point, m, ef_construction, saved_ef = arrays["meta"].tolist()
+        graph = cls(index, m=m, ef_construction=ef_construction, ef_search=ef_search or saved_ef)
+        graph.levels = arrays["levels"].tolist()
+        graph.entry_point = None if entry_point < 0 else entry_point
+
+        layer = 0
+        while f"nodes_{layer}" in arrays:
+            width = graph.m0 if layer == 0 else graph.m
+            graph.layers.append(
+                _Layer.restore(width, layer == 0, arrays[f"nodes_{layer}"], arrays[f"links_{layer}"])
+            )
+            layer += 1
+        return graph
+
+    def save(self, path: Path, generation: int) -> None:
+        """Write the graph next to the snapshot it was built against."""
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(tmp_path, generation=np.array([generation], dtype=np.int64), **self.state())
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(
+        cls,
+        path: Path,
+        index: MatrixIndex,
+        generation: int,
+        ef_search: Optional[int] = None,
+        **params,
+    ) -> Optional["HNSWIndex"]:
+        """
+        Load a saved graph if it still matches the index.
+
+        Returns None when the graph was built against another snapshot
+        generation, covers rows the index does not have, or was saved in
+        the older list-based format.
+        """
+        with np.load(path) as data:
+            if "generation" not in data:
+                return None
+            size = int(data["meta"][0])
+            if int(data["generation"][0]) != generation or size > index.size:
+                return None
+            return cls.from_state(index, {key: data[key] for key in data.files}, ef_search=ef_search)
+
+
+def build_graph(vectors: np.ndarray, m: int, ef_construction: int) -> dict[str, np.ndarray]:
+    """
+    Build a graph over normalized rows, for running in a worker process
+    (only the arrays travel between processes).
+
+    Returns:
+        The graph's state() arrays
+    """
+    graph = HNSWIndex(_Rows(np.ascontiguousarray(vectors, dtype=np.float32)), m=m, ef_construction=ef_construction)
+    graph.build(vectors.shape[0])
+    return graph.state()
@@ -2,28 +2,119 @@
 Indexer Module
 
 Background indexing of Telegram messages into the vector database.
+
+Message handlers only enqueue (enqueue_message); a pool of worker tasks
+drains the bounded queue in batches, embedding each batch with one
+create_embeddings() call and adding it to the vector store in one go, so
+indexing latency never lands on the reply path.
+
+When the queue is full, RAG_INDEX_QUEUE_POLICY decides what happens:
+"spill" appends the message to a file next to the vector store that the
+workers drain once the queue has room again, "drop_oldest" / "drop_newest"
+discard a message. Jobs still queued at shutdown are spilled too, and picked
+up again on the next start. The file is read from a persisted byte offset,
+so a refill only reads the lines it takes; the consumed head is cut off once
+it makes up most of the file, and the file is deleted once drained.
+
+While an embedding migration is building a shadow index, every message is
+embedded in both the active and the new version (see migration.py).
 """
 
 import asyncio
+import json
+import re
+import shutil
+import time
+from collections import deque
+from dataclasses import dataclass, asdict, field
 from datetime import datetime
+from pathlib import Path
 from typing import Optional
 
 from ..utils.logger import get_logger
 from ..config import get_config
-from .embeddings import create_embedding, preprocess_text
+from .embeddings import create_embeddings, get_embedding_stats, preprocess_text
 from .vectorstore import add_documents, document_exists, init_vectorstore, Document
+from .migration import index_specs
+from .result_cache import get_result_cache_stats
 
 logger = get_logger("indexer")
 
+SPILL_FILE = "index_queue.jsonl"
+# Byte offset of the first spilled line not re-queued yet
+SPILL_OFFSET_FILE = "index_queue.offset"
+
+# Rewrite the spill file without its consumed head once the head is this large
+# (and more than half the file)
+_SPILL_COMPACT_BYTES = 1 << 20
+
+# Window for the throughput figure in get_indexer_status() (seconds)
+_THROUGHPUT_WINDOW = 60.0
+
+# Seconds an idle worker waits before retrying a failed refill from the spill file
+_SPILL_RETRY_INTERVAL = 5.0
+
+
+@dataclass
+class IndexJob:
+    """A message waiting to be indexed."""
+    message_id: int
+    chat_id: int
+    user_id: int
+    user_name: str
+    text: str
+    timestamp: str = field(default_factory=lambda: datetime.now().isoformat())
+    enqueued_at: float = field(default_factory=time.time)
+    # Defaults to "<chat_id>:<message_id>"
+    doc_id: Optional[str] = None
+
+
 # Indexer state
 _is_running = False
-_task: Optional[asyncio.Task] = None
-_index_interval = 3600  # 1 hour in seconds
+_queue: Optional[asyncio.Queue] = None
+_workers: list[asyncio.Task] = []
+# Jobs each worker has taken off the queue but not finished yet
+_in_flight: dict[int, list[IndexJob]] = {}
+_spilled = 0
+_spill_lock = asyncio.Lock()
+# Set when messages start spilling, to wake workers waiting on an empty queue
+_spill_wakeup = asyncio.Event()
+_stats = {"indexed": 0, "skipped": 0, "failed": 0, "dropped": 0}
+_recent: deque[tuple[float, int]] = deque()
+_last_lag = 0.0
+
+
+def _spill_path() -> Path:
+    return Path(get_config().rag.vector_db_path) / SPILL_FILE
+
+
+def _spill_offset_path() -> Path:
+    return Path(get_config().rag.vector_db_path) / SPILL_OFFSET_FILE
+
+
+def _read_spill_offset(path: Path) -> int:
+    """
+    Persisted read offset into the spill file (0 if missing, unreadable, or
+    recorded for an earlier file, e.g. before a crash mid-compaction).
+    """
+    stat = path.stat()
+    try:
+        offset, inode = map(int, _spill_offset_path().read_text().split())
+    except (OSError, ValueError):
+        return 0
+    return offset if inode == stat.st_ino and 0 <= offset <= stat.st_size else 0
+
+
+def _write_spill_offset(path: Path, offset: int) -> None:
+    offset_path = _spill_offset_path()
+    tmp_path = offset_path.with_suffix(".tmp")
+    tmp_path.write_text(f"{offset} {path.stat().st_ino}")
+    tmp_path.replace(offset_path)
 
 
 def start_indexer() -> None:
-    """Start the background indexer."""
-    global _is_running, _task
+    """Start the background indexing workers (call from the running event loop)."""
+    global _is_running, _queue, _spilled
     
     config = get_config()
     if not config.rag.enabled:
@@ -34,31 +125,55 @@ def start_indexer() -> None:
         logger.warning("Indexer already running")
         return
     
+    _queue = asyncio.Queue(maxsize=max(1, config.rag.index_queue_size))
+    _spilled = _count_spilled()
+    
+    loop = asyncio.get_running_loop()
+    for number in range(max(1, config.rag.index_workers)):
+        _workers.append(loop.create_task(_worker(number)))
+    
     _is_running = True
-    logger.info("Indexer started (indexes on-demand via index_single_message)")
+    logger.info(
+        f"Indexer started ({len(_workers)} workers, queue size {_queue.maxsize}"
+        f"{f', {_spilled} spilled messages to catch up on' if _spilled else ''})"
+    )
 
 
-def stop_indexer() -> None:
-    """Stop the background indexer."""
-    global _is_running, _task
+async def stop_indexer() -> None:
+    """Stop the workers and spill unfinished messages for the next start."""
+    global _is_running, _queue
     
+    if not _is_running:
+        return
     _is_running = False
-    if _task:
-        _task.cancel()
-        _task = None
     
-    logger.info("Indexer stopped")
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+    _workers.clear()
+    
+    # Unfinished batches are re-indexed on the next start (indexing is idempotent)
+    leftover = [job for jobs in _in_flight.values() for job in jobs]
+    _in_flight.clear()
+    while not _queue.empty():
+        leftover.append(_queue.get_nowait())
+    _queue = None
+    if leftover:
+        await _spill(leftover)
+    
+    logger.info(f"Indexer stopped{f' ({len(leftover)} messages spilled)' if leftover else ''}")
 
 
-async def index_single_message(
+async def enqueue_message(
     message_id: int,
     chat_id: int,
     user_id: int,
     user_name: str,
     text: str,
+    wait: bool = False,
 ) -> bool:
     """
-    Index a single message immediately.
+    Queue a message for background indexing.
     
     Args:
         message_id: Telegram message ID
@@ -66,56 +181,319 @@ async def index_single_message(
         user_id: User ID
         user_name: User display name
         text: Message text
+        wait: Wait for room in the queue instead of applying the overflow
+            policy (for bulk producers that should be slowed down)
     
     Returns:
-        True if indexed successfully
+        True if the message was queued or spilled, False if it was dropped
     """
-    try:
-        init_vectorstore()
+    if _queue is None:
+        # Indexer not started (scripts, tests): index inline
+        return await index_single_message(message_id, chat_id, user_id, user_name, text)
+    
+    job = IndexJob(message_id, chat_id, user_id, user_name, text)
+    if wait:
+        await _queue.put(job)
+        return True
+    
+    policy = get_config().rag.index_queue_policy
+    # While spilled messages are waiting, new ones spill behind them (keeps order)
+    if not (policy == "spill" and _spilled):
+        try:
+            _queue.put_nowait(job)
+            return True
+        except asyncio.QueueFull:
+            pass
+    
+    if policy == "drop_newest":
+        _record_drop(job)
+        return False
+    if policy == "drop_oldest":
+        _record_drop(_queue.get_nowait())
+        _queue.task_done()
+        _queue.put_nowait(job)
+        return True
+    
+    await _spill([job])
+    return True
+
+
+def _record_drop(job: IndexJob) -> None:
+    _stats["dropped"] += 1
+    # Warn on the first drop of a burst, not on every message
+    if _stats["dropped"] % 100 == 1:
+        logger.warning(
+            f"Indexing queue full, dropping messages "
+            f"(e.g. {job.chat_id}:{job.message_id}; {_stats['dropped']} dropped so far)"
+        )
+
+
+async def _worker(number: int) -> None:
+    """Drain the queue in batches of up to RAG_INDEX_BATCH_SIZE messages."""
+    config = get_config()
+    batch_size = max(1, config.rag.index_batch_size)
+    
+    while True:
+        jobs = [await _next_job(number)]
+        while len(jobs) < batch_size and not _queue.empty():
+            jobs.append(_queue.get_nowait())
+    
+        _in_flight[number] = jobs
+        try:
+            await index_jobs(jobs)
+        except asyncio.CancelledError:
+            # Left in _in_flight for stop_indexer() to spill
+            raise
+        except Exception as e:
+            _stats["failed"] += len(jobs)
+            logger.error(f"Failed to index {len(jobs)} messages: {e}")
+        _in_flight.pop(number, None)
+        for _ in jobs:
+            _queue.task_done()
+
+
+async def _next_job(number: int) -> IndexJob:
+    """
+    Wait for the next queued message, refilling the queue from the spill file
+    whenever it runs empty while messages are spilled.
+    
+    New messages spill (instead of queueing) while others are spilled, so an
+    idle worker also wakes up when spilling starts, and retries a failed
+    refill every _SPILL_RETRY_INTERVAL seconds.
+    """
+    while True:
+        if _queue.empty() and _spilled:
+            await _refill_from_spill()
+        if not _queue.empty():
+            return _queue.get_nowait()
         
+        _spill_wakeup.clear()
+        getter = asyncio.ensure_future(_queue.get())
+        wakeup = asyncio.ensure_future(_spill_wakeup.wait())
+        try:
+            done, _ = await asyncio.wait(
+                (getter, wakeup),
+                timeout=_SPILL_RETRY_INTERVAL if _spilled else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        except asyncio.CancelledError:
+            if getter.done() and not getter.cancelled():
+                # Already off the queue: left in _in_flight for stop_indexer() to spill
+                _in_flight[number] = [getter.result()]
+            raise
+        finally:
+            wakeup.cancel()
+            if not getter.done():
+                getter.cancel()
+        if getter in done:
+            return getter.result()
+
+
+async def index_jobs(jobs: list[IndexJob]) -> int:
+    """
+    Embed and store a batch of messages.
+    
+    Returns:
+        Number of messages indexed (short and already indexed ones are skipped)
+    """
+    global _last_lag
+    init_vectorstore()
+    
+    prepared: list[tuple[IndexJob, str, str]] = []
+    seen: set[str] = set()
+    for job in jobs:
         # Preprocess text
-        processed_text = preprocess_text(text)
+        processed_text = preprocess_text(job.text)
         if not processed_text or len(processed_text) < 10:
-            return False
-        
+            continue
+    
         # Generate document ID
-        doc_id = f"{chat_id}:{message_id}"
-        
+        doc_id = job.doc_id or f"{job.chat_id}:{job.message_id}"
+    
         # Check if already indexed
-        if await document_exists(doc_id):
-            return False
-        
-        # Create embedding
-        embedding = await create_embedding(processed_text)
-        
-        # Create document
-        now = datetime.now().isoformat()
-        document = Document(
-            id=doc_id,
-            text=processed_text,
-            embedding=embedding,
-            metadata={
-                "chat_id": chat_id,
-                "user_id": user_id,
-                "user_name": user_name,
-                "message_id": message_id,
-                "timestamp": now,
-                "indexed_at": now,
-            }
-        )
-        
-        # Add to vector store
-        await add_documents([document])
+        if doc_id in seen or await document_exists(doc_id, chat_id=job.chat_id):
+            continue
+        seen.add(doc_id)
+        prepared.append((job, doc_id, processed_text))
+    
+    _stats["skipped"] += len(jobs) - len(prepared)
+    if not prepared:
+        return 0
+    
+    # Create embeddings (one batched request per embedding version)
+    specs = index_specs()
+    texts = [processed for _, _, processed in prepared]
+    embeddings = await asyncio.gather(*(create_embeddings(texts, spec=spec) for spec in specs))
+    
+    now = datetime.now().isoformat()
+    documents = []
+    for i, (job, doc_id, processed_text) in enumerate(prepared):
+        # Mentions are masked in the processed text, so keep them for keyword search
+        mentions = re.findall(r'@\w+', job.text)
+        metadata = {
+            "chat_id": job.chat_id,
+            "user_id": job.user_id,
+            "user_name": job.user_name,
+            "message_id": job.message_id,
+            "timestamp": job.timestamp,
+            "indexed_at": now,
+            **({"mentions": mentions} if mentions else {}),
+        }
+        for spec, vectors in zip(specs, embeddings):
+            documents.append(Document(
+                id=doc_id,
+                text=processed_text,
+                embedding=vectors[i],
+                metadata=metadata,
+                embedding_version=spec.version,
+            ))
+    
+    # Add to vector store
+    await add_documents(documents)
+    
+    finished = time.time()
+    _last_lag = finished - min(job.enqueued_at for job in jobs)
+    _stats["indexed"] += len(prepared)
+    _recent.append((time.monotonic(), len(prepared)))
+    
+    logger.debug(f"Indexed {len(prepared)} messages")
+    return len(prepared)
+
+
+async def _spill(jobs: list[IndexJob]) -> None:
+    """Append jobs to the spill file."""
+    global _spilled
+    payload = "".join(json.dumps(asdict(job)) + "\n" for job in jobs)
+    
+    def write() -> None:
+        path = _spill_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(payload)
+    
+    async with _spill_lock:
+        try:
+            await asyncio.to_thread(write)
+            if not _spilled:
+                _spill_wakeup.set()
+            _spilled += len(jobs)
+        except Exception as e:
+            _stats["dropped"] += len(jobs)
+            logger.error(f"Failed to spill {len(jobs)} messages, dropped them: {e}")
+
+
+async def _refill_from_spill() -> None:
+    """Move spilled jobs back into the queue, as many as fit."""
+    global _spilled
+    
+    def take(room: int) -> list[IndexJob]:
+        path = _spill_path()
+        if not path.exists():
+            return []
+        size = path.stat().st_size
+        offset = _read_spill_offset(path)
+        lines = []
+        with open(path, "rb") as f:
+            f.seek(offset)
+            while len(lines) < room:
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line)
+            offset = f.tell()
         
-        logger.debug(f"Indexed message: {doc_id}")
-        return True
+        if offset >= size:
+            # Offset first: a stale one must never apply to a new file
+            _spill_offset_path().unlink(missing_ok=True)
+            path.unlink()
+        elif offset >= _SPILL_COMPACT_BYTES and offset * 2 > size:
+            tmp_path = path.with_suffix(".tmp")
+            with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+                src.seek(offset)
+                shutil.copyfileobj(src, dst)
+            tmp_path.replace(path)
+            _write_spill_offset(path, 0)
+        else:
+            _write_spill_offset(path, offset)
+        return [IndexJob(**json.loads(line)) for line in lines]
+    
+    async with _spill_lock:
+        room = _queue.maxsize - _queue.qsize()
+        if room <= 0 or _spilled == 0:
+            return
+        try:
+            jobs = await asyncio.to_thread(take, room)
+        except Exception as e:
+            logger.error(f"Failed to read spilled messages: {e}")
+            return
+        _spilled = max(0, _spilled - len(jobs)) if jobs else 0
+        for job in jobs:
+            _queue.put_nowait(job)
+    if jobs:
+        logger.info(f"Re-queued {len(jobs)} spilled messages ({_spilled} left)")
+
+
+def _count_spilled() -> int:
+    path = _spill_path()
+    if not path.exists():
+        return 0
+    with open(path, "rb") as f:
+        f.seek(_read_spill_offset(path))
+        return sum(1 for _ in f)
+
+
+async def index_single_message(
+    message_id: int,
+    chat_id: int,
+    user_id: int,
+    user_name: str,
+    text: str,
+) -> bool:
+    """
+    Index a single message immediately, bypassing the queue.
+    
+    Args:
+        message_id: Telegram message ID
+        chat_id: Chat ID
+        user_id: User ID
+        user_name: User display name
+        text: Message text
+    
+    Returns:
+        True if indexed successfully
+    """
+    try:
+        job = IndexJob(message_id, chat_id, user_id, user_name, text)
+        return await index_jobs([job]) > 0
     except Exception as e:
         logger.error(f"Failed to index message: {e}")
         return False
 
 
 def get_indexer_status() -> dict:
-    """Get indexer status."""
+    """
+    Get indexer status.
+    
+    Returns:
+        Queue depth and capacity, spilled backlog, counters, throughput
+        (messages/s over the last minute) and lag (seconds from enqueue to
+        stored, for the latest batch), plus embedding batch and retrieval
+        cache statistics
+    """
+    now = time.monotonic()
+    while _recent and now - _recent[0][0] > _THROUGHPUT_WINDOW:
+        _recent.popleft()
+    
     return {
         "is_running": _is_running,
+        "workers": len(_workers),
+        "queue_depth": _queue.qsize() if _queue is not None else 0,
+        "queue_capacity": _queue.maxsize if _queue is not None else 0,
+        "in_flight": sum(len(jobs) for jobs in _in_flight.values()),
+        "spilled": _spilled,
+        **_stats,
+        "throughput_per_second": round(sum(count for _, count in _recent) / _THROUGHPUT_WINDOW, 2),
+        "lag_seconds": round(_last_lag, 3),
+        "embedding_batches": get_embedding_stats(),
+        "result_cache": get_result_cache_stats(),
     }
@@ -0,0 +1,240 @@
+"""
+IVF Module
+
+Inverted-file approximate nearest neighbour index.
+
+A spherical k-means coarse quantizer splits the partition into `nlist`
+clusters; every row is appended to the posting list of its nearest centroid
+and a query only scores the rows in its `nprobe` closest lists.
+
+Training runs off the event loop (see Partition._build_ann) and is repeated
+when the partition has grown by `retrain_growth` since the last training;
+until a retrained index is swapped in, searches keep using the old one.
+A compaction rewrite renumbers the posting lists (remap()) without retraining.
+"""
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from .matrix_index import MatrixIndex, normalize, normalize_rows, top_k
+
+IVF_FILE = "ivf.npz"
+
+_ASSIGN_CHUNK = 8192
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for each vector (chunked)."""
+    out = np.empty(vectors.shape[0], dtype=np.int64)
+    for start in range(0, vectors.shape[0], _ASSIGN_CHUNK):
+        chunk = np.asarray(vectors[start:start + _ASSIGN_CHUNK], dtype=np.float32)
+        out[start:start + chunk.shape[0]] = np.argmax(chunk @ centroids.T, axis=1)
+    return out
+
+
+def train_kmeans(
+    vectors: np.ndarray,
+    nlist: int,
+    iterations: int = 20,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Spherical k-means over normalized vectors.
+
+    Returns:
+        (nlist, dimensions) array of unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    n = vectors.shape[0]
+    nlist = max(1, min(nlist, n))
+
+    centroids = np.array(vectors[rng.choice(n, nlist, replace=False)], dtype=np.float32)
+
+    for _ in range(iterations):
+        assignments = nearest_centroids(vectors, centroids)
+        counts = np.bincount(assignments, minlength=nlist)
+
+        order = np.argsort(assignments, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        filled = counts > 0
+        sums = np.zeros_like(centroids)
+        sums[filled] = np.add.reduceat(
+            np.asarray(vectors, dtype=np.float32)[order], starts[filled], axis=0
+        )
+
+        # Re-seed empty clusters with random points
+        empty = ~filled
+        if empty.any():
+            sums[empty] = vectors[rng.choice(n, int(empty.sum()))]
+
+        centroids = normalize_rows(sums)
+
+    return centroids
+
+
+class IVFIndex:
+    """Coarse-quantized posting lists over the rows of a MatrixIndex."""
+
+    def __init__(
+        self,
+        index: MatrixIndex,
+        nlist: int = 0,
+        nprobe: int = 8,
+        retrain_growth: float = 2.0,
+        train_sample: int = 20000,
+        iterations: int = 10,
+    ):
+        self.index = index
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.retrain_growth = retrain_growth
+        self.train_sample = train_sample
+        self.iterations = iterations
+
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: list[list[int]] = []
+        self.assignments: list[int] = []
+        self.trained_size = 0
+
+    @property
+    def size(self) -> int:
+        """Number of rows assigned to a list (rows [0, size))."""
+        return len(self.assignments)
+
+    def build(self, target: int) -> None:
+        """Train the quantizer and assign rows [0, target). Runs in a worker thread."""
+        nlist = self.nlist or int(4 * np.sqrt(target))
+        nlist = max(1, min(nlist, target))
+
+        rng = np.random.default_rng(0)
+        sample_rows = np.arange(target)
+        if target > self.train_sample:
+            sample_rows = np.sort(rng.choice(target, self.train_sample, replace=False))
+        sample = self.index.vectors(sample_rows)
+
+        self.centroids = train_kmeans(sample, nlist, iterations=self.iterations)
+        self.trained_size = target
+
+        assignments = np.empty(target, dtype=np.int64)
+        for start in range(0, target, _ASSIGN_CHUNK):
+            rows = np.arange(start, min(start + _ASSIGN_CHUNK, target))
+            assignments[rows] = nearest_centroids(self.index.vectors(rows), self.centroids)
+        self._set_assignments(assignments)
+
+    def _set_assignments(self, assignments: np.ndarray) -> None:
+        nlist = self.centroids.shape[0]
+        order = np.argsort(assignments, kind="stable")
+        counts = np.bincount(assignments, minlength=nlist)
+        bounds = np.concatenate(([0], np.cumsum(counts))).tolist()
+        order = order.tolist()
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+        self.assignments = assignments.tolist()
+
+    def add(self, row: int) -> None:
+        """Append the next row to its nearest centroid's list. Rows must be added in order."""
+        if row != self.size:
+            raise ValueError(f"Expected row {self.size}, got {row}")
+        cluster = int(np.argmax(self.centroids @ self.index.vector(row)))
+        self.lists[cluster].append(row)
+        self.assignments.append(cluster)
+
+    def catch_up(self) -> int:
+        """Assign every matrix row the index does not cover yet. Returns rows added."""
+        start = self.size
+        for row in range(start, self.index.size):
+            self.add(row)
+        return self.index.size - start
+
+    def needs_rebuild(self, count: int) -> bool:
+        """Whether the corpus has grown enough since training to retrain."""
+        return count >= self.trained_size * self.retrain_growth
+
+    def search(
+        self,
+        query,
+        limit: int = 10,
+        nprobe: Optional[int] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score only the rows in the `nprobe` closest lists.
+
+        Returns:
+            (rows, scores) arrays sorted by descending cosine similarity
+        """
+        if self.centroids is None or limit <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        q = normalize(query)
+        nprobe = min(nprobe or self.nprobe, self.centroids.shape[0])
+        probe = top_k(self.centroids @ q, nprobe)
+
+        rows = np.fromiter(
+            (row for cluster in probe.tolist() for row in self.lists[cluster]),
+            dtype=np.int64,
+        )
+        rows = np.sort(rows[self.index.live_mask()[rows]]) if rows.shape[0] else rows
+        if rows.shape[0] == 0:
+            return rows, np.empty(0, dtype=np.float32)
+
+        scores = self.index.vectors(rows) @ q
+        best = top_k(scores, limit)
+        return rows[best], scores[best]
+
+    def remap(self, index: MatrixIndex, mapping: np.ndarray) -> "IVFIndex":
+        """
+        Carry the lists over to a rewritten matrix whose rows were renumbered
+        (`mapping`: new row of each old row, -1 = dropped, order kept).
+        The centroids are kept as they are.
+        """
+        ivf = IVFIndex(
+            index,
+            nlist=self.nlist,
+            nprobe=self.nprobe,
+            retrain_growth=self.retrain_growth,
+            train_sample=self.train_sample,
+            iterations=self.iterations,
+        )
+        ivf.centroids = self.centroids
+        ivf.trained_size = self.trained_size
+        assignments = np.array(self.assignments, dtype=np.int64)
+        ivf._set_assignments(assignments[np.asarray(mapping)[:self.size] >= 0])
+        return ivf
+
+    def save(self, path: Path, generation: int) -> None:
+        """Write centroids and row assignments next to the snapshot."""
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            meta=np.array([generation, self.size, self.trained_size], dtype=np.int64),
+            centroids=self.centroids,
+            assignments=np.array(self.assignments, dtype=np.int32),
+        )
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(
+        cls,
+        path: Path,
+        index: MatrixIndex,
+        generation: int,
+        **params,
+    ) -> Optional["IVFIndex"]:
+        """
+        Load a saved index if it still matches the matrix.
+
+        Returns None when it was built against another snapshot generation
+        or covers rows the matrix does not have.
+        """
+        with np.load(path) as data:
+            saved_generation, size, trained_size = data["meta"].tolist()
+            if saved_generation != generation or size > index.size:
+                return None
+
+            ivf = cls(index, **params)
+            ivf.centroids = data["centroids"]
+            ivf.trained_size = trained_size
+            ivf._set_assignments(data["assignments"].astype(np.int64))
+
+        return ivf
@@ -0,0 +1,468 @@
+"""
+Matrix Index Module
+
+Dense, contiguous storage for message embeddings.
+All vectors live in one pre-normalized float32 matrix with a parallel
+id/text/metadata table, so a query is scored with a single matrix-vector
+product instead of one cosine computation per document.
+
+The matrix is split into a read-only base segment (typically a memory-mapped
+snapshot, see storage.py) and an in-memory tail that new rows are appended to.
+When the snapshot carries quantized codes (quantization.py), base rows are
+scored from the codes and the best candidates can be re-scored exactly.
+"""
+
+from typing import Iterator, Optional
+
+import numpy as np
+
+# Sentinel stored for documents without a chat_id/user_id in their metadata
+MISSING_ID = np.iinfo(np.int64).min
+
+_INITIAL_CAPACITY = 1024
+
+
+def normalize(vector) -> np.ndarray:
+    """Return a unit-length float32 copy of a vector (zero vectors stay zero)."""
+    arr = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(arr))
+    if norm == 0:
+        return arr.copy()
+    return arr / norm
+
+
+def normalize_rows(matrix) -> np.ndarray:
+    """Return a float32 copy of a matrix with unit-length rows (zero rows stay zero)."""
+    arr = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(arr, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return arr / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first.
+
+    Uses a partial sort (argpartition) so only the k winners are fully sorted.
+    """
+    n = scores.shape[0]
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def _id_value(value) -> int:
+    """Convert a metadata id to the int64 filter column value."""
+    if value is None:
+        return MISSING_ID
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING_ID
+
+
+class MatrixIndex:
+    """
+    Embedding matrix with a parallel document table.
+
+    Rows are append-only: re-adding an existing id marks the old row dead and
+    appends a new one, so row numbers handed out stay valid.
+    Rows [0, base_size) live in the base segment, later rows in the tail.
+
+    With `partition_by_user`, row lists are also kept per user_id so a
+    user-filtered search only touches that user's rows.
+
+    With quantized base codes, `rescore` > 0 re-scores the best
+    `limit * rescore` candidates against the float32 rows.
+    """
+
+    def __init__(
+        self,
+        dimensions: Optional[int] = None,
+        partition_by_user: bool = False,
+        rescore: int = 0,
+    ):
+        self.dimensions = dimensions
+        self.partition_by_user = partition_by_user
+        self.rescore = rescore
+        self._user_rows: dict[int, list[int]] = {}
+        self._base: Optional[np.ndarray] = None
+        self._base_size = 0
+        self._codes: Optional[np.ndarray] = None
+        self._codec = None
+        self._vectors: Optional[np.ndarray] = None
+        self._chat_ids = np.empty(0, dtype=np.int64)
+        self._user_ids = np.empty(0, dtype=np.int64)
+        self._live = np.empty(0, dtype=bool)
+        self._ids: list[str] = []
+        self._texts: list[str] = []
+        self._metadata: list[dict] = []
+        self._rows: dict[str, int] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._rows
+
+    @property
+    def size(self) -> int:
+        """Number of rows in use, including dead rows."""
+        return self._size
+
+    @property
+    def base_size(self) -> int:
+        """Number of rows held in the read-only base segment."""
+        return self._base_size
+
+    def load(
+        self,
+        vectors: Optional[np.ndarray],
+        ids: list[str],
+        texts: list[str],
+        metadata: list[dict],
+        codes: Optional[np.ndarray] = None,
+        codec=None,
+    ) -> None:
+        """
+        Replace the contents with pre-normalized rows used as the base segment.
+
+        `vectors` is used as-is (no copy), so a read-only memmap stays on disk.
+        `codes` (with the codec that produced them) is what searches scan for
+        base rows, if given. Later duplicates of an id supersede earlier rows.
+        """
+        self.clear()
+        count = len(ids)
+        if count == 0:
+            return
+
+        self.dimensions = vectors.shape[1]
+        self._base = vectors
+        self._base_size = count
+        if codes is not None:
+            self._codes = codes
+            self._codec = codec
+        self._ensure_capacity(count)
+
+        self._chat_ids[:count] = [_id_value(m.get("chat_id")) for m in metadata]
+        self._user_ids[:count] = [_id_value(m.get("user_id")) for m in metadata]
+        self._ids = list(ids)
+        self._texts = list(texts)
+        self._metadata = list(metadata)
+        self._size = count
+
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._live[list(self._rows.values())] = True
+
+        if self.partition_by_user:
+            for row, user in enumerate(self._user_ids[:count].tolist()):
+                self._user_rows.setdefault(user, []).append(row)
+
+    def rebase(self, vectors: np.ndarray, codes: Optional[np.ndarray] = None, codec=None) -> None:
+        """
+        Swap in a longer base segment covering rows the tail already holds
+        (after they were appended to the snapshot), releasing their tail memory.
+        """
+        count = vectors.shape[0]
+        if count <= self._base_size or count > self._size:
+            return
+
+        tail_start = count - self._base_size
+        tail_size = self._size - count
+        tail = np.zeros((max(_INITIAL_CAPACITY, 2 * tail_size), self.dimensions), dtype=np.float32)
+        tail[:tail_size] = self._vectors[tail_start:tail_start + tail_size]
+
+        self._base = vectors
+        self._base_size = count
+        self._vectors = tail
+        self._codes = codes
+        self._codec = codec if codes is not None else None
+
+    def _ensure_capacity(self, needed: int) -> None:
+        """Grow the tail and column arrays (amortized doubling) to hold `needed` rows."""
+        capacity = self._live.shape[0]
+        if needed > capacity:
+            new_capacity = max(_INITIAL_CAPACITY, capacity)
+            while new_capacity < needed:
+                new_capacity *= 2
+
+            chat_ids = np.full(new_capacity, MISSING_ID, dtype=np.int64)
+            user_ids = np.full(new_capacity, MISSING_ID, dtype=np.int64)
+            live = np.zeros(new_capacity, dtype=bool)
+            chat_ids[:self._size] = self._chat_ids[:self._size]
+            user_ids[:self._size] = self._user_ids[:self._size]
+            live[:self._size] = self._live[:self._size]
+
+            self._chat_ids = chat_ids
+            self._user_ids = user_ids
+            self._live = live
+
+        tail_needed = needed - self._base_size
+        tail_capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if tail_needed <= tail_capacity:
+            return
+
+        new_capacity = max(_INITIAL_CAPACITY, tail_capacity)
+        while new_capacity < tail_needed:
+            new_capacity *= 2
+
+        vectors = np.zeros((new_capacity, self.dimensions), dtype=np.float32)
+        tail_size = self._size - self._base_size
+        if tail_size:
+            vectors[:tail_size] = self._vectors[:tail_size]
+        self._vectors = vectors
+
+    def add(self, doc_id: str, text: str, embedding, metadata: dict) -> int:
+        """
+        Add (or replace) a document.
+
+        Returns:
+            The row number the document was stored at
+        """
+        vector = normalize(embedding)
+        if self.dimensions is None:
+            self.dimensions = vector.shape[0]
+        elif vector.shape[0] != self.dimensions:
+            raise ValueError(
+                f"Embedding has {vector.shape[0]} dimensions, index expects {self.dimensions}"
+            )
+
+        old_row = self._rows.get(doc_id)
+        if old_row is not None:
+            self._live[old_row] = False
+
+        self._ensure_capacity(self._size + 1)
+        row = self._size
+
+        self._vectors[row - self._base_size] = vector
+        self._chat_ids[row] = _id_value(metadata.get("chat_id"))
+        self._user_ids[row] = _id_value(metadata.get("user_id"))
+        self._live[row] = True
+        self._ids.append(doc_id)
+        self._texts.append(text)
+        self._metadata.append(metadata)
+        self._rows[doc_id] = row
+        self._size += 1
+
+        if self.partition_by_user:
+            self._user_rows.setdefault(int(self._user_ids[row]), []).append(row)
+
+        return row
+
+    def remove(self, doc_id: str) -> bool:
+        """Mark a document's row as dead. Returns True if it existed."""
+        row = self._rows.pop(doc_id, None)
+        if row is None:
+            return False
+        self._live[row] = False
+        return True
+
+    def clear(self) -> None:
+        """Drop every row."""
+        self.__init__(self.dimensions, self.partition_by_user, self.rescore)
+
+    def search(
+        self,
+        query,
+        limit: int = 10,
+        chat_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Score all live rows against a query and keep the best `limit`.
+
+        Args:
+            query: Query vector (does not need to be normalized)
+            limit: Max results
+            chat_id: Optional filter by chat
+            user_id: Optional filter by user
+
+        Returns:
+            (rows, scores) arrays sorted by descending cosine similarity
+        """
+        if self._size == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        q = normalize(query)
+
+        if user_id and self.partition_by_user:
+            # Secondary partition: only this user's rows are considered
+            rows = np.asarray(self._user_rows.get(int(user_id), []), dtype=np.int64)
+            keep = self._live[rows]
+            if chat_id:
+                keep &= self._chat_ids[rows] == chat_id
+            rows = rows[keep]
+        else:
+            mask = self._live[:self._size]
+            if chat_id:
+                mask = mask & (self._chat_ids[:self._size] == chat_id)
+            if user_id:
+                mask = mask & (self._user_ids[:self._size] == user_id)
+            rows = np.flatnonzero(mask)
+
+        scores = self._score_rows(rows, q)
+        return self._select(rows, scores, q, limit)
+
+    def search_many(
+        self,
+        queries,
+        limits: list[int],
+        chat_ids: Optional[list[Optional[int]]] = None,
+        user_ids: Optional[list[Optional[int]]] = None,
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Search several queries at once.
+
+        All live rows are scored against every query with one matrix-matrix
+        product; each query's own filters and limit are applied afterwards.
+        User-filtered queries on a `partition_by_user` index use that user's
+        row list instead, as in search().
+
+        Args:
+            queries: (queries, dimensions) query vectors
+            limits: Max results per query
+            chat_ids: Optional chat filter per query
+            user_ids: Optional user filter per query
+
+        Returns:
+            One (rows, scores) pair per query, as returned by search()
+        """
+        count = len(limits)
+        chat_ids = chat_ids or [None] * count
+        user_ids = user_ids or [None] * count
+        if self._size == 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * count
+
+        q = normalize_rows(queries)
+        results: list[Optional[tuple[np.ndarray, np.ndarray]]] = [None] * count
+
+        shared = []
+        for i in range(count):
+            if user_ids[i] and self.partition_by_user:
+                results[i] = self.search(q[i], limits[i], chat_ids[i], user_ids[i])
+            else:
+                shared.append(i)
+
+        if shared:
+            rows = np.flatnonzero(self._live[:self._size])
+            scores = self._score_rows(rows, q[shared].T)
+            for column, i in enumerate(shared):
+                mask = None
+                if chat_ids[i]:
+                    mask = self._chat_ids[rows] == chat_ids[i]
+                if user_ids[i]:
+                    user_mask = self._user_ids[rows] == user_ids[i]
+                    mask = user_mask if mask is None else mask & user_mask
+                if mask is None:
+                    results[i] = self._select(rows, scores[:, column], q[i], limits[i])
+                else:
+                    results[i] = self._select(rows[mask], scores[mask, column], q[i], limits[i])
+
+        return results
+
+    def _select(
+        self,
+        rows: np.ndarray,
+        scores: np.ndarray,
+        q: np.ndarray,
+        limit: int,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Keep the best `limit` scored rows (re-scoring code-based scores if enabled)."""
+        if self._codes is not None and self.rescore:
+            # Approximate scores from codes: re-score the best candidates exactly
+            candidates = top_k(scores, limit * self.rescore)
+            rows = rows[candidates]
+            scores = self.vectors(rows) @ q
+
+        best = top_k(scores, limit)
+        return rows[best], scores[best]
+
+    def _score_rows(self, rows: np.ndarray, q: np.ndarray) -> np.ndarray:
+        """
+        Dot products of the given (sorted) rows with a normalized query of
+        shape (dimensions,), or with a batch of shape (dimensions, queries).
+        """
+        base_size = self._base_size
+        tail_size = self._size - base_size
+        split = int(np.searchsorted(rows, base_size))
+
+        parts = []
+        if split and self._codes is not None:
+            if split == base_size:
+                parts.append(self._codec.scores(self._codes, q))
+            else:
+                parts.append(self._codec.scores(self._codes[rows[:split]], q))
+        elif split:
+            if split == base_size:
+                parts.append(self._base @ q)
+            else:
+                parts.append(self._base[rows[:split]] @ q)
+        if split < rows.shape[0]:
+            if rows.shape[0] - split == tail_size:
+                parts.append(self._vectors[:tail_size] @ q)
+            else:
+                parts.append(self._vectors[rows[split:] - base_size] @ q)
+
+        if not parts:
+            return np.empty((0,) + q.shape[1:], dtype=np.float32)
+        if len(parts) == 1:
+            return np.asarray(parts[0], dtype=np.float32)
+        return np.concatenate(parts).astype(np.float32, copy=False)
+
+    def is_live(self, row: int) -> bool:
+        """Whether a row holds the current version of a document."""
+        return bool(self._live[row])
+
+    def filter_rows(
+        self,
+        rows: np.ndarray,
+        chat_id: Optional[int] = None,
+        user_id: Optional[int] = None,
+    ) -> np.ndarray:
+        """Boolean mask of the given rows that are live and match the filters."""
+        keep = self._live[rows]
+        if chat_id:
+            keep &= self._chat_ids[rows] == chat_id
+        if user_id:
+            keep &= self._user_ids[rows] == user_id
+        return keep
+
+    def live_mask(self) -> np.ndarray:
+        """Boolean liveness flag per row (a view, valid until the next add)."""
+        return self._live[:self._size]
+
+    def document(self, row: int) -> tuple[str, str, dict]:
+        """Get (id, text, metadata) for a row."""
+        return self._ids[row], self._texts[row], self._metadata[row]
+
+    def vector(self, row: int) -> np.ndarray:
+        """Get the normalized embedding stored at a row."""
+        if row < self._base_size:
+            return self._base[row]
+        return self._vectors[row - self._base_size]
+
+    def vectors(self, rows) -> np.ndarray:
+        """Get the normalized embeddings for several rows as one array."""
+        rows = np.asarray(rows, dtype=np.int64)
+        if self._base_size == 0:
+            return self._vectors[rows]
+        if rows.shape[0] and rows.max() < self._base_size:
+            return np.asarray(self._base[rows], dtype=np.float32)
+        if rows.shape[0] and rows.min() >= self._base_size:
+            return self._vectors[rows - self._base_size]
+        out = np.empty((rows.shape[0], self.dimensions or 0), dtype=np.float32)
+        in_base = rows < self._base_size
+        if in_base.any():
+            out[in_base] = self._base[rows[in_base]]
+        if (~in_base).any():
+            out[~in_base] = self._vectors[rows[~in_base] - self._base_size]
+        return out
+
+    def live_rows(self) -> Iterator[int]:
+        """Iterate the rows of all live documents in insertion order."""
+        return iter(np.flatnonzero(self._live[:self._size]).tolist())
@@ -0,0 +1,253 @@
+"""
+Embedding Migration Module
+
+Online re-embedding when the configured embedding version changes
+(RAG_EMBEDDING_BACKEND, RAG_EMBEDDING_DIMENSIONS, or PREPROCESS_VERSION).
+
+The vector store keeps answering searches from its active partitions, with
+queries embedded in the active version (active_spec()). Meanwhile the
+migration copies every chat's documents into a shadow index, re-embedded in
+the configured version, and the indexer writes new messages to both. Once
+the shadow index covers everything, promote_shadow() switches to it in one
+step and the old partitions are deleted.
+
+Documents are re-embedded from their stored (preprocessed) text. Progress
+lives in the shadow index itself, so a restart resumes where it stopped.
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+from ..utils.logger import get_logger
+from ..config import get_config
+from .embeddings import EmbeddingSpec, configured_spec, create_embeddings
+from .vectorstore import (
+    Document,
+    add_documents,
+    begin_shadow,
+    discard_shadow,
+    get_embedding_versions,
+    init_vectorstore,
+    list_chat_ids,
+    missing_from_shadow,
+    promote_shadow,
+    set_active_version,
+    shadow_gaps,
+)
+
+logger = get_logger("migration")
+
+# Promotion retries (while messages indexed in the old version only keep arriving)
+_PROMOTE_RETRY_DELAY = 0.5  # seconds; doubled after every attempt that closes no gap
+_PROMOTE_MAX_DELAY = 30.0
+_PROMOTE_MAX_ATTEMPTS = 50
+_PROMOTE_MAX_STALLED = 5  # consecutive attempts without re-embedding anything
+
+# Migration state
+_task: Optional[asyncio.Task] = None
+_state = {"target": None, "chats_done": 0, "chats_total": 0, "migrated": 0, "promoted": False}
+
+
+def _spec(record: dict) -> EmbeddingSpec:
+    return EmbeddingSpec(
+        backend=record["backend"],
+        dimensions=record["dimensions"],
+        version=record["version"],
+    )
+
+
+def active_spec() -> EmbeddingSpec:
+    """
+    The embedding version searches must use: the one of the active index.
+
+    An index without a recorded version is assumed to hold the configured
+    one (it was built before versions were recorded) and is stamped with it.
+    """
+    record = get_embedding_versions()["active"]
+    if record is None:
+        spec = configured_spec()
+        set_active_version(spec.version, spec.backend, spec.dimensions)
+        return spec
+    return _spec(record)
+
+
+def index_specs() -> list[EmbeddingSpec]:
+    """Embedding versions new documents are written in (active, then shadow)."""
+    specs = [active_spec()]
+    shadow = get_embedding_versions()["shadow"]
+    if shadow is not None:
+        specs.append(_spec(shadow))
+    return specs
+
+
+async def _migrate_chat(chat_id: int, target: EmbeddingSpec) -> None:
+    """Re-embed a chat's documents that the shadow index is missing."""
+    config = get_config()
+    batch_size = max(1, config.rag.migration_batch_size)
+    rate = config.rag.migration_rate
+
+    missing = missing_from_shadow(chat_id)
+    for start in range(0, len(missing), batch_size):
+        started = time.monotonic()
+        page = missing[start:start + batch_size]
+
+        embeddings = await create_embeddings([text for _, text, _ in page], spec=target)
+        await add_documents([
+            Document(
+                id=doc_id,
+                text=text,
+                embedding=embedding,
+                metadata={k: v for k, v in metadata.items() if k != "embedding_version"},
+                embedding_version=target.version,
+            )
+            for (doc_id, text, metadata), embedding in zip(page, embeddings)
+        ])
+        _state["migrated"] += len(page)
+
+        if rate > 0:
+            remaining = len(page) / rate - (time.monotonic() - started)
+            if remaining > 0:
+                await asyncio.sleep(remaining)
+
+
+async def _promote(target: EmbeddingSpec) -> bool:
+    """
+    Switch to the shadow index, first catching up with messages indexed in
+    the old version only while the migration ran.
+
+    Retries with a growing delay while catching up makes no progress, and
+    gives up (keeping the shadow index for the next start) after too many
+    attempts.
+
+    Returns:
+        True if the shadow index was promoted
+    """
+    delay = _PROMOTE_RETRY_DELAY
+    stalled = 0
+    for attempt in range(1, _PROMOTE_MAX_ATTEMPTS + 1):
+        if await promote_shadow():
+            return True
+
+        shadow = get_embedding_versions()["shadow"]
+        if shadow is None or shadow["version"] != target.version:
+            logger.warning(f"Shadow index for {target.version} is gone; migration stopped")
+            return False
+
+        migrated = _state["migrated"]
+        for chat_id in shadow_gaps():
+            await _migrate_chat(chat_id, target)
+
+        if _state["migrated"] > migrated:
+            stalled = 0
+            delay = _PROMOTE_RETRY_DELAY
+        else:
+            stalled += 1
+            if stalled >= _PROMOTE_MAX_STALLED:
+                break
+            delay = min(delay * 2, _PROMOTE_MAX_DELAY)
+
+        logger.debug(f"Promotion attempt {attempt} refused; retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    logger.warning(
+        f"Could not promote embedding version {target.version}: "
+        f"{len(shadow_gaps())} chats still have documents missing from the shadow index. "
+        f"Searches keep using the active version; the next start resumes the migration."
+    )
+    return False
+
+
+async def run_migration() -> dict:
+    """
+    Bring the index to the configured embedding version.
+
+    Returns:
+        Migration state (target version, counters, whether it was promoted)
+    """
+    init_vectorstore()
+    target = configured_spec()
+    active = active_spec()
+    _state.update(target=target.version, chats_done=0, chats_total=0, migrated=0, promoted=False)
+
+    if target.version == active.version:
+        # A shadow left over from an abandoned change
+        await discard_shadow()
+        return dict(_state)
+
+    shadow = get_embedding_versions()["shadow"]
+    if shadow is None or shadow["version"] != target.version:
+        await begin_shadow(target.version, target.backend, target.dimensions)
+
+    logger.info(f"Migrating embeddings from {active.version} to {target.version}")
+
+    chat_ids = list_chat_ids()
+    _state["chats_total"] = len(chat_ids)
+    for chat_id in chat_ids:
+        await _migrate_chat(chat_id, target)
+        _state["chats_done"] += 1
+
+    if not await _promote(target):
+        return dict(_state)
+
+    _state["promoted"] = True
+    logger.info(
+        f"Embedding migration complete: {_state['migrated']} documents re-embedded, "
+        f"now using {target.version}"
+    )
+    return dict(_state)
+
+
+def start_migration() -> None:
+    """Migrate in the background if the embedding version changed (call from the running event loop)."""
+    global _task
+
+    config = get_config()
+    target = configured_spec()
+    versions = get_embedding_versions()
+    active = active_spec()
+    if target.version == active.version and versions["shadow"] is None:
+        return
+
+    if not config.rag.embedding_migration:
+        logger.warning(
+            f"Configured embedding version {target.version} differs from the index "
+            f"({active.version}); searches keep using {active.version}. "
+            f"Set RAG_EMBEDDING_MIGRATION=true to re-embed."
+        )
+        return
+
+    if _task is not None and not _task.done():
+        logger.warning("Embedding migration already running")
+        return
+
+    async def run() -> None:
+        try:
+            await run_migration()
+        except Exception as e:
+            # The shadow index is kept; the next start resumes from it
+            logger.error(f"Embedding migration to {target.version} failed: {e}")
+
+    _task = asyncio.get_running_loop().create_task(run())
+
+
+async def stop_migration() -> None:
+    """Cancel a running migration (the shadow index built so far is kept)."""
+    global _task
+
+    if _task is None:
+        return
+    _task.cancel()
+    await asyncio.gather(_task, return_exceptions=True)
+    _task = None
+
+
+def get_migration_status() -> dict:
+    """Get embedding versions and migration progress."""
+    versions = get_embedding_versions()
+    return {
+        "is_running": _task is not None and not _task.done(),
+        "active": versions["active"]["version"] if versions["active"] else None,
+        "shadow": versions["shadow"]["version"] if versions["shadow"] else None,
+        **_state,
+    }
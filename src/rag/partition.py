@@ -0,0 +1,569 @@
+"""
+Partition Module
+
+One chat's slice of the vector store.
+Each partition owns its own matrix index, binary snapshot and write-ahead log
+in a separate directory, so it can be loaded, searched, compacted and
+unloaded independently of every other chat.
+
+With RAG_ANN_MODE=hnsw or ivf, partitions of at least RAG_ANN_MIN_SIZE
+documents also get an approximate index (an HNSW graph, hnsw.py, or IVF
+posting lists, ivf.py), built in the background and persisted next to the
+snapshot; smaller partitions keep using exact search. HNSW graphs are built
+in worker processes (RAG_ANN_BUILD_WORKERS), so the build does not hold the
+event loop's GIL, and a compaction rewrite renumbers the approximate index's
+rows instead of rebuilding it.
+
+A BM25 keyword index (bm25.py) over the same rows serves lexical and hybrid
+retrieval; it is rebuilt from the loaded texts rather than persisted.
+
+Each partition has its own embedding width (recorded in its snapshot
+manifest). Wider embeddings are truncated to it on insert and search, which
+is how a partition shrunk with shrink() keeps working with full-width
+embeddings (see fit_width).
+"""
+
+import asyncio
+import multiprocessing
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional, Union
+
+import numpy as np
+
+from ..utils.logger import get_logger
+from ..config import get_config
+from .bm25 import BM25Index
+from .hnsw import HNSWIndex, GRAPH_FILE, build_graph
+from .ivf import IVFIndex, IVF_FILE
+from .matrix_index import MatrixIndex, normalize_rows
+from .storage import SnapshotStore
+from .wal import WriteAheadLog
+
+logger = get_logger("partition")
+
+# RAG_ANN_MODE -> approximate index class and the file it is persisted to
+_ANN_CLASSES = {"hnsw": HNSWIndex, "ivf": IVFIndex}
+_ANN_FILES = {"hnsw": GRAPH_FILE, "ivf": IVF_FILE}
+
+# Worker processes for HNSW builds (shared by all partitions)
+_build_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_build_pool() -> Optional[ProcessPoolExecutor]:
+    global _build_pool
+
+    workers = get_config().rag.ann_build_workers
+    if workers <= 0:
+        return None
+    if _build_pool is None:
+        # spawn: forking a process with live threads (indexer, SQLite) is unsafe
+        _build_pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        logger.info(f"Started {workers} index build workers")
+    return _build_pool
+
+
+def shutdown_build_pool() -> None:
+    """Stop the index build workers (builds in progress are abandoned)."""
+    global _build_pool
+
+    if _build_pool is not None:
+        _build_pool.shutdown(wait=False, cancel_futures=True)
+        _build_pool = None
+
+
+def fit_width(vectors, width: Optional[int]) -> np.ndarray:
+    """
+    Truncate embeddings (one vector or a batch of rows) to an index's width.
+
+    Matryoshka-trained embeddings (OpenAI text-embedding-3) keep their
+    meaning in their leading components, so a truncated vector, once
+    renormalized (the indexes normalize everything they store or search
+    with), is a valid lower-dimensional embedding.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if width is None or vectors.shape[-1] == width:
+        return vectors
+    if vectors.shape[-1] < width:
+        raise ValueError(
+            f"{vectors.shape[-1]}-dim embeddings cannot be used with a {width}-dim index "
+            f"(re-index, or shrink the index to {vectors.shape[-1]} dimensions)"
+        )
+    return vectors[..., :width]
+
+
+class Partition:
+    """Index, snapshot and log for a single chat."""
+
+    def __init__(
+        self,
+        chat_id: int,
+        directory: Path,
+        partition_by_user: bool = False,
+        quantization: str = "none",
+        pq_subvectors: int = 0,
+        rescore: int = 0,
+    ):
+        self.chat_id = chat_id
+        self.directory = Path(directory)
+        self.index = MatrixIndex(partition_by_user=partition_by_user, rescore=rescore)
+        self.store = SnapshotStore(self.directory, quantization, pq_subvectors)
+        self.wal = WriteAheadLog(self.directory)
+        self.loaded = False
+        self.last_used = 0.0
+
+        # Index rows [0, compacted_rows) are already in the snapshot
+        self.compacted_rows = 0
+        self.lock = asyncio.Lock()
+
+        # Approximate index (None = exact search only)
+        self.ann: Optional[Union[HNSWIndex, IVFIndex]] = None
+        self._ann_task: Optional[asyncio.Task] = None
+        # Bumped whenever self.index is replaced, so stale background builds are dropped
+        self._epoch = 0
+
+        # Keyword index (built on first lexical search, or on load in hybrid mode)
+        self.lexical: Optional[BM25Index] = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self.index
+
+    @property
+    def pending_rows(self) -> int:
+        """Rows logged but not yet compacted into the snapshot."""
+        return self.index.size - self.compacted_rows
+
+    def load(self) -> None:
+        """Map the snapshot and replay the write-ahead log on top of it."""
+        if self.loaded:
+            return
+
+        snapshot = self.store.load()
+        self.index.load(
+            snapshot.vectors,
+            snapshot.ids,
+            snapshot.texts,
+            snapshot.metadata,
+            codes=snapshot.codes,
+            codec=snapshot.codec,
+        )
+        # An empty snapshot still fixes the partition's width
+        self.index.dimensions = self.index.dimensions or snapshot.dimensions
+        self.compacted_rows = self.index.size
+
+        # Crash recovery: replay inserts not yet folded into the snapshot
+        replayed = 0
+        for record in self.wal.replay(after_lsn=self.store.applied_lsn):
+            vector = fit_width(record.vector, self.index.dimensions)
+            self.index.add(record.doc_id, record.text, vector, record.metadata)
+            replayed += 1
+        if replayed:
+            logger.info(f"Chat {self.chat_id}: replayed {replayed} documents from write-ahead log")
+
+        self.loaded = True
+        self._load_ann()
+        if get_config().rag.retrieval_mode != "semantic":
+            self._lexical_index()
+
+    def add(self, doc_id: str, text: str, embedding, metadata: dict) -> int:
+        """Add a document to the index and log it."""
+        embedding = fit_width(embedding, self.index.dimensions)
+        row = self.index.add(doc_id, text, embedding, metadata)
+        self.wal.append(doc_id, text, metadata, self.index.vector(row))
+        if self.ann is not None:
+            self.ann.add(row)
+        if self.lexical is not None:
+            self.lexical.add(row)
+        return row
+
+    def search(
+        self,
+        query,
+        limit: int,
+        user_id: Optional[int] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Search this chat's rows.
+
+        Uses the approximate index when one is built and the partition is large
+        enough; user-filtered and small searches stay exact.
+        """
+        config = get_config()
+        query = fit_width(query, self.index.dimensions)
+        if (
+            self.ann is not None
+            and not user_id
+            and len(self.index) >= config.rag.ann_min_size
+        ):
+            return self.ann.search(query, limit=limit)
+        return self.index.search(query, limit=limit, user_id=user_id)
+
+    def search_many(
+        self,
+        queries: np.ndarray,
+        limits: list[int],
+        user_ids: list[Optional[int]],
+    ) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        Search several queries against this chat's rows.
+
+        Queries that would use the approximate index go through it one by
+        one; the rest share one matrix-matrix product.
+        """
+        config = get_config()
+        queries = fit_width(queries, self.index.dimensions)
+        use_ann = self.ann is not None and len(self.index) >= config.rag.ann_min_size
+
+        results: list[Optional[tuple[np.ndarray, np.ndarray]]] = [None] * len(limits)
+        exact = []
+        for i, user_id in enumerate(user_ids):
+            if use_ann and not user_id:
+                results[i] = self.ann.search(queries[i], limit=limits[i])
+            else:
+                exact.append(i)
+
+        if exact:
+            batch = self.index.search_many(
+                queries[exact],
+                [limits[i] for i in exact],
+                user_ids=[user_ids[i] for i in exact],
+            )
+            for i, result in zip(exact, batch):
+                results[i] = result
+
+        return results
+
+    def lexical_search(
+        self,
+        query: str,
+        limit: int,
+        user_id: Optional[int] = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """BM25 keyword search over this chat's rows."""
+        return self._lexical_index().search(query, limit=limit, user_id=user_id)
+
+    def _lexical_index(self) -> BM25Index:
+        if self.lexical is None:
+            lexical = BM25Index(self.index)
+            lexical.catch_up()
+            self.lexical = lexical
+            logger.info(f"Chat {self.chat_id}: built keyword index ({lexical.size} rows)")
+        return self.lexical
+
+    # ============================================
+    # Approximate index
+    # ============================================
+
+    @property
+    def _ann_path(self) -> Path:
+        return self.directory / _ANN_FILES[get_config().rag.ann_mode]
+
+    def _ann_params(self) -> dict:
+        """Constructor settings for the configured approximate index."""
+        config = get_config()
+        if config.rag.ann_mode == "ivf":
+            return {
+                "nlist": config.rag.ivf_nlist,
+                "nprobe": config.rag.ivf_nprobe,
+                "retrain_growth": config.rag.ivf_retrain_growth,
+                "train_sample": config.rag.ivf_train_sample,
+            }
+        return {
+            "m": config.rag.hnsw_m,
+            "ef_construction": config.rag.hnsw_ef_construction,
+            "ef_search": config.rag.hnsw_ef_search,
+        }
+
+    def _load_ann(self) -> None:
+        """Load a persisted approximate index and add rows it has not seen yet."""
+        mode = get_config().rag.ann_mode
+        if mode not in _ANN_CLASSES or not self._ann_path.exists():
+            return
+
+        params = self._ann_params()
+        if mode == "hnsw":
+            # Graph shape comes from the file; only the query-time setting applies
+            params = {"ef_search": params["ef_search"]}
+
+        try:
+            ann = _ANN_CLASSES[mode].load(self._ann_path, self.index, self.store.generation, **params)
+        except Exception as e:
+            logger.warning(f"Chat {self.chat_id}: could not load {mode} index: {e}")
+            ann = None
+
+        if ann is None:
+            # Built against another snapshot; rebuild in the background
+            self._ann_path.unlink(missing_ok=True)
+            return
+
+        added = ann.catch_up()
+        self.ann = ann
+        logger.info(f"Chat {self.chat_id}: loaded {mode} index ({ann.size} rows, {added} caught up)")
+
+    def maybe_build_ann(self) -> None:
+        """
+        Start a background build once the partition is large enough, or a
+        rebuild once the current index asks for one (IVF retraining).
+        The current index keeps serving searches until the new one is swapped in.
+        """
+        config = get_config()
+        if (
+            config.rag.ann_mode not in _ANN_CLASSES
+            or not self.loaded
+            or (self._ann_task and not self._ann_task.done())
+            or len(self.index) < config.rag.ann_min_size
+        ):
+            return
+        if self.ann is not None and not self.ann.needs_rebuild(len(self.index)):
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._ann_task = loop.create_task(self._build_ann())
+
+    async def _build_ann(self) -> None:
+        """Build an index over the current rows off the event loop, then swap it in."""
+        epoch = self._epoch
+        mode = get_config().rag.ann_mode
+        ann = _ANN_CLASSES[mode](self.index, **self._ann_params())
+        target = self.index.size
+
+        logger.info(f"Chat {self.chat_id}: building {mode} index over {target} rows...")
+
+        try:
+            pool = _get_build_pool() if mode == "hnsw" else None
+            if pool is None:
+                await asyncio.to_thread(ann.build, target)
+            else:
+                vectors = await asyncio.to_thread(self.index.vectors, np.arange(target))
+                state = await asyncio.get_running_loop().run_in_executor(
+                    pool, build_graph, vectors, ann.m, ann.ef_construction
+                )
+                ann = HNSWIndex.from_state(self.index, state, ef_search=ann.ef_search)
+        except Exception as e:
+            logger.error(f"Chat {self.chat_id}: {mode} build failed: {e}")
+            return
+
+        if epoch != self._epoch:
+            return
+
+        # Rows added while the build was running
+        ann.catch_up()
+        self.ann = ann
+        self._save_ann()
+        logger.info(f"Chat {self.chat_id}: {mode} index ready ({ann.size} rows)")
+
+    def _save_ann(self) -> None:
+        if self.ann is None:
+            return
+        try:
+            self.ann.save(self._ann_path, self.store.generation)
+        except Exception as e:
+            logger.error(f"Chat {self.chat_id}: failed to save approximate index: {e}")
+
+    def _drop_ann(self) -> None:
+        self._epoch += 1
+        if self._ann_task:
+            self._ann_task.cancel()
+            self._ann_task = None
+        self.ann = None
+
+    async def _remap_ann(self, ann: Union[HNSWIndex, IVFIndex], mapping: np.ndarray) -> None:
+        """Carry an approximate index over to renumbered rows off the event loop, then swap it in."""
+        epoch = self._epoch
+        try:
+            ann = await asyncio.to_thread(ann.remap, self.index, mapping)
+        except Exception as e:
+            logger.error(f"Chat {self.chat_id}: failed to carry approximate index over: {e}")
+            self._ann_task = None
+            self.maybe_build_ann()
+            return
+
+        if epoch != self._epoch:
+            return
+
+        ann.catch_up()
+        self.ann = ann
+        self._save_ann()
+        logger.info(f"Chat {self.chat_id}: approximate index carried over ({ann.size} rows)")
+
+    def _reload_after_rewrite(self, cutoff_row: int, rows: Optional[list[int]] = None) -> None:
+        """
+        Re-map the rewritten snapshot so row numbers match it again.
+
+        Rows logged after the cutoff are carried over in order, exactly as a
+        write-ahead log replay would re-create them. With `rows` (the old rows
+        the snapshot now holds, in order), the approximate index is renumbered
+        to match; otherwise it is rebuilt.
+        """
+        old = self.index
+        old_ann = self.ann if rows is not None else None
+        snapshot = self.store.load()
+
+        index = MatrixIndex(partition_by_user=old.partition_by_user, rescore=old.rescore)
+        index.load(
+            snapshot.vectors,
+            snapshot.ids,
+            snapshot.texts,
+            snapshot.metadata,
+            codes=snapshot.codes,
+            codec=snapshot.codec,
+        )
+        index.dimensions = index.dimensions or snapshot.dimensions
+        compacted_rows = index.size
+        for row in range(cutoff_row, old.size):
+            doc_id, text, metadata = old.document(row)
+            index.add(doc_id, text, fit_width(old.vector(row), index.dimensions), metadata)
+
+        self._drop_ann()
+        for name in _ANN_FILES.values():
+            (self.directory / name).unlink(missing_ok=True)
+        self.index = index
+        self.lexical = None
+        self.compacted_rows = compacted_rows
+
+        if old_ann is not None:
+            mapping = np.full(old.size, -1, dtype=np.int64)
+            mapping[rows] = np.arange(len(rows))
+            mapping[cutoff_row:] = np.arange(len(rows), len(rows) + old.size - cutoff_row)
+            self._ann_task = asyncio.get_running_loop().create_task(self._remap_ann(old_ann, mapping))
+        else:
+            self.maybe_build_ann()
+
+    def stored_count(self) -> int:
+        """
+        Document count without loading.
+
+        For unloaded partitions: the snapshot's live documents plus the
+        distinct ids logged after it (an id logged again after being
+        compacted counts twice until the partition is loaded).
+        """
+        if self.loaded:
+            return len(self.index)
+        try:
+            live, applied_lsn = self.store.read_count() if self.store.exists() else (0, 0)
+            return live + len(self.wal.logged_ids(after_lsn=applied_lsn))
+        except Exception:
+            return 0
+
+    async def compact(self, dead_ratio: float, dimensions: Optional[int] = None) -> None:
+        """
+        Fold logged inserts into the snapshot and drop the compacted log segments.
+
+        Pending rows are appended to the snapshot as-is (dead ones included,
+        so snapshot rows keep matching index rows); if too many rows are dead
+        (superseded by re-added ids) the snapshot is rewritten and re-mapped.
+        With `dimensions`, the snapshot is always rewritten, with embeddings
+        truncated to that width (see shrink).
+        """
+        if not self.loaded:
+            return
+
+        async with self.lock:
+            index = self.index
+            cutoff_row = index.size
+            if cutoff_row == self.compacted_rows and dimensions is None:
+                return
+
+            # Everything up to here is covered; later inserts go to a new segment
+            applied_lsn = self.wal.last_lsn
+            sealed = self.wal.rotate()
+
+            live = len(index)
+            dead = index.size - live
+            rewrite = dimensions is not None or dead > dead_ratio * index.size
+            first_row = 0 if rewrite else self.compacted_rows
+
+            if rewrite:
+                rows = [row for row in range(first_row, cutoff_row) if index.is_live(row)]
+            else:
+                rows = list(range(first_row, cutoff_row))
+            documents = [index.document(row) for row in rows]
+            vectors = index.vectors(rows) if rows else None
+            if dimensions is not None and vectors is not None:
+                vectors = normalize_rows(fit_width(vectors, dimensions))
+            ids = [doc_id for doc_id, _, _ in documents]
+            texts = [text for _, text, _ in documents]
+            metadata = [meta for _, _, meta in documents]
+
+            try:
+                if rewrite:
+                    await asyncio.to_thread(
+                        self.store.rewrite, vectors, ids, texts, metadata, applied_lsn, dimensions
+                    )
+                else:
+                    await asyncio.to_thread(
+                        self.store.append, vectors, ids, texts, metadata, applied_lsn, live
+                    )
+            except Exception as e:
+                # Sealed segments are kept, so nothing is lost; retry next round
+                logger.error(f"Chat {self.chat_id}: failed to compact write-ahead log: {e}")
+                return
+
+            self.compacted_rows = cutoff_row
+            self.wal.remove(sealed)
+            if rewrite:
+                # Row numbers only shift when the width stays the same
+                self._reload_after_rewrite(cutoff_row, rows if dimensions is None else None)
+            elif not (self._ann_task and not self._ann_task.done()):
+                # Serve the compacted rows from the snapshot (and its codes)
+                # instead of the in-memory tail; skipped while a background
+                # build is reading rows from another thread
+                vectors, codes = self.store.mapped()
+                index.rebase(vectors, codes, self.store.codec)
+            logger.info(
+                f"Chat {self.chat_id}: compacted {cutoff_row - first_row} rows into snapshot"
+                f"{' (rewritten)' if rewrite else ''}"
+            )
+
+    async def shrink(self, dimensions: int) -> bool:
+        """
+        Truncate this partition's embeddings to their first `dimensions`
+        components (renormalized), in place and without re-embedding.
+
+        Returns:
+            True if the partition was wider and has been rewritten
+        """
+        self.load()
+        width = self.index.dimensions
+        if width is None or width <= dimensions:
+            return False
+
+        await self.compact(get_config().rag.compaction_dead_ratio, dimensions=dimensions)
+        logger.info(f"Chat {self.chat_id}: shrunk embeddings from {width} to {dimensions} dimensions")
+        return True
+
+    async def unload(self, dead_ratio: float) -> None:
+        """Persist pending rows, close the log and release memory."""
+        if not self.loaded:
+            return
+
+        await self.compact(dead_ratio)
+        async with self.lock:
+            self._save_ann()
+            self._drop_ann()
+            self.lexical = None
+            self.wal.close()
+            self.index.clear()
+            self.compacted_rows = 0
+            self.loaded = False
+
+    async def destroy(self) -> None:
+        """Delete the partition and its files."""
+        async with self.lock:
+            self._drop_ann()
+            self.lexical = None
+            self.wal.close()
+            self.index.clear()
+            self.compacted_rows = 0
+            self.loaded = False
+            await asyncio.to_thread(shutil.rmtree, self.directory, True)
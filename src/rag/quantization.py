@@ -0,0 +1,222 @@
+"""
+Quantization Module
+
+Compressed encodings for the snapshot's embedding matrix.
+
+Full-precision float32 rows stay on disk (memory-mapped, paged in only when
+touched), while searches scan a compact code matrix that is what actually
+stays resident:
+- float16: half-precision copy (2 bytes per dimension)
+- int8: symmetric scalar quantization with a per-vector scale
+  (1 byte per dimension + 4 bytes per row)
+- pq: product quantization; each row is split into `subvectors` slices and
+  every slice is replaced by the id of its nearest of 256 centroids
+  (1 byte per slice). Queries use asymmetric distance computation: one
+  lookup table of query-slice x centroid dot products, summed per row.
+
+Scores from codes are approximate; Matrix search can re-score the best
+candidates against the float32 rows (see MatrixIndex.rescore).
+
+Every codec's `scores` accepts a single normalized query of shape
+(dimensions,) or a batch of shape (dimensions, queries) and returns (n,) or
+(n, queries) scores respectively.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+QUANTIZATION_MODES = ("none", "float16", "int8", "pq")
+
+# Rows decoded/scored per step, bounding temporary memory on large matrices
+_CHUNK = 16384
+
+# PQ codebooks are trained once a snapshot holds this many rows
+PQ_MIN_TRAIN_ROWS = 4096
+
+_PQ_CENTROIDS = 256
+_PQ_TRAIN_SAMPLE = 10000
+_PQ_ITERATIONS = 8
+
+
+class Float16Codec:
+    """Half-precision copy of each row."""
+
+    name = "float16"
+    dtype = np.dtype("<f2")
+    trained = True
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.width = dimensions
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        return np.asarray(vectors, dtype=self.dtype)
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        return np.asarray(codes, dtype=np.float32)
+
+    def scores(self, codes: np.ndarray, q: np.ndarray) -> np.ndarray:
+        out = np.empty((codes.shape[0],) + q.shape[1:], dtype=np.float32)
+        for start in range(0, codes.shape[0], _CHUNK):
+            chunk = np.asarray(codes[start:start + _CHUNK], dtype=np.float32)
+            out[start:start + chunk.shape[0]] = chunk @ q
+        return out
+
+
+class Int8Codec:
+    """
+    Symmetric int8 quantization with a per-vector scale.
+
+    Each code row is `dimensions` int8 values followed by the row's float32
+    scale stored in 4 trailing bytes, so one contiguous matrix holds both.
+    """
+
+    name = "int8"
+    dtype = np.dtype("i1")
+    trained = True
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.width = dimensions + 4
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scale = np.abs(vectors).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+
+        codes = np.empty((vectors.shape[0], self.width), dtype=self.dtype)
+        codes[:, :self.dimensions] = np.rint(vectors / scale[:, None])
+        codes[:, self.dimensions:] = scale.astype("<f4").view(self.dtype).reshape(-1, 4)
+        return codes
+
+    def _scales(self, codes: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(codes[:, self.dimensions:]).view("<f4").ravel()
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        codes = np.asarray(codes)
+        return codes[:, :self.dimensions].astype(np.float32) * self._scales(codes)[:, None]
+
+    def scores(self, codes: np.ndarray, q: np.ndarray) -> np.ndarray:
+        out = np.empty((codes.shape[0],) + q.shape[1:], dtype=np.float32)
+        for start in range(0, codes.shape[0], _CHUNK):
+            chunk = np.asarray(codes[start:start + _CHUNK])
+            raw = chunk[:, :self.dimensions].astype(np.float32) @ q
+            out[start:start + chunk.shape[0]] = (raw.T * self._scales(chunk)).T
+        return out
+
+
+class PQCodec:
+    """Product quantizer with 256 centroids per subvector."""
+
+    name = "pq"
+    dtype = np.dtype("u1")
+
+    def __init__(self, dimensions: int, subvectors: int, codebooks: Optional[np.ndarray] = None):
+        if subvectors <= 0 or dimensions % subvectors:
+            raise ValueError(
+                f"PQ subvectors ({subvectors}) must divide the dimensions ({dimensions})"
+            )
+        self.dimensions = dimensions
+        self.subvectors = subvectors
+        self.width = subvectors
+        self.sub_dimensions = dimensions // subvectors
+        # (subvectors, 256, sub_dimensions)
+        self.codebooks = codebooks
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def _split(self, vectors: np.ndarray) -> np.ndarray:
+        """(n, dimensions) -> (subvectors, n, sub_dimensions)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return vectors.reshape(vectors.shape[0], self.subvectors, self.sub_dimensions).transpose(1, 0, 2)
+
+    def train(self, sample: np.ndarray, seed: int = 0) -> None:
+        """Run k-means in every subspace of a sample of rows."""
+        rng = np.random.default_rng(seed)
+        if sample.shape[0] > _PQ_TRAIN_SAMPLE:
+            # Index before converting, so a memory-mapped input is not read in full
+            sample = sample[np.sort(rng.choice(sample.shape[0], _PQ_TRAIN_SAMPLE, replace=False))]
+        sample = np.asarray(sample, dtype=np.float32)
+        n = sample.shape[0]
+        if n < _PQ_CENTROIDS:
+            raise ValueError(f"PQ training needs at least {_PQ_CENTROIDS} rows, got {n}")
+
+        codebooks = np.empty(
+            (self.subvectors, _PQ_CENTROIDS, self.sub_dimensions), dtype=np.float32
+        )
+        for s, part in enumerate(self._split(sample)):
+            centroids = part[rng.choice(n, _PQ_CENTROIDS, replace=False)].copy()
+            for _ in range(_PQ_ITERATIONS):
+                assignments = self._nearest(part, centroids)
+                counts = np.bincount(assignments, minlength=_PQ_CENTROIDS)
+                sums = np.stack(
+                    [np.bincount(assignments, weights=part[:, d], minlength=_PQ_CENTROIDS)
+                     for d in range(self.sub_dimensions)],
+                    axis=1,
+                )
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+                # Re-seed empty centroids with random points
+                empty = ~filled
+                if empty.any():
+                    centroids[empty] = part[rng.choice(n, int(empty.sum()))]
+            codebooks[s] = centroids
+        self.codebooks = codebooks
+
+    @staticmethod
+    def _nearest(part: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        """Nearest centroid by squared L2 distance."""
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2; |x|^2 is constant per row
+        distances = (centroids * centroids).sum(axis=1) - 2 * (part @ centroids.T)
+        return np.argmin(distances, axis=1)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.empty((vectors.shape[0], self.subvectors), dtype=self.dtype)
+        for start in range(0, vectors.shape[0], _CHUNK):
+            parts = self._split(vectors[start:start + _CHUNK])
+            for s in range(self.subvectors):
+                codes[start:start + parts.shape[1], s] = self._nearest(parts[s], self.codebooks[s])
+        return codes
+
+    def decode(self, codes: np.ndarray) -> np.ndarray:
+        codes = np.asarray(codes)
+        parts = [self.codebooks[s][codes[:, s]] for s in range(self.subvectors)]
+        return np.concatenate(parts, axis=1)
+
+    def scores(self, codes: np.ndarray, q: np.ndarray) -> np.ndarray:
+        # Asymmetric distance: table[s, c] = <query slice s, centroid c>
+        batch = q.shape[1:]
+        q_slices = q.reshape((self.subvectors, self.sub_dimensions) + batch)
+        table = np.einsum("scd,sd...->sc...", self.codebooks, q_slices).astype(np.float32)
+        out = np.empty((codes.shape[0],) + batch, dtype=np.float32)
+        for start in range(0, codes.shape[0], _CHUNK):
+            chunk = np.asarray(codes[start:start + _CHUNK])
+            total = np.zeros((chunk.shape[0],) + batch, dtype=np.float32)
+            for s in range(self.subvectors):
+                total += table[s][chunk[:, s]]
+            out[start:start + chunk.shape[0]] = total
+        return out
+
+
+def get_codec(mode: str, dimensions: int, pq_subvectors: int = 0):
+    """
+    Create the codec for a quantization mode.
+
+    Returns:
+        A codec, or None for "none" (search scans the float32 rows directly)
+    """
+    if mode == "none":
+        return None
+    if mode == "float16":
+        return Float16Codec(dimensions)
+    if mode == "int8":
+        return Int8Codec(dimensions)
+    if mode == "pq":
+        if not pq_subvectors:
+            # Default: 8-dimensional slices (1536 dims -> 192 bytes per row)
+            pq_subvectors = dimensions // 8 if dimensions % 8 == 0 else dimensions
+        return PQCodec(dimensions, pq_subvectors)
+    raise ValueError(f"Unknown quantization mode: {mode} (expected one of {QUANTIZATION_MODES})")
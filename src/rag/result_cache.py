@@ -0,0 +1,153 @@
+"""
+Retrieval Result Cache Module
+
+In-memory LRU of RetrievalResponses, so the same question asked again in a
+chat (for example by the agent's search_knowledge_base tool, with the query
+that was already used for the system prompt context) skips embedding and
+search.
+
+Entries are keyed by the whitespace-normalized query, the chat and user
+filters, limit, minimum score and retrieval mode, and expire after
+RAG_RESULT_CACHE_TTL seconds. Writes invalidate them per chat: every write
+(add_documents()) bumps a write counter and stamps its chats with it, and an
+entry is only served while the stamp it was computed at is current. Searches
+across all chats depend on every write; clearing the store or switching
+embedding versions drops everything.
+
+Only chats with cached entries keep their own stamp: the others are pruned
+now and then and share the highest pruned stamp, so the stamps stay bounded
+by the cache size however many chats are written to.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from ..utils.logger import get_logger
+from ..config import get_config
+
+logger = get_logger("result_cache")
+
+# Cache state: key -> (generation, expires_at, response)
+_entries: "OrderedDict[tuple, tuple[tuple[int, int], float, Any]]" = OrderedDict()
+# Writes to any chat (generation of searches without a chat filter)
+_write_generation = 0
+# Per chat: _write_generation after its latest write
+_chat_generations: dict[int, int] = {}
+# Generation of chats without a stamp of their own (see _prune_chat_generations())
+_pruned_generation = 0
+# Bumped by invalidate_all(); part of every generation
+_epoch = 0
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+
+def make_key(
+    query: str,
+    chat_id: Optional[int],
+    user_id: Optional[int],
+    limit: int,
+    min_score: float,
+    mode: str,
+) -> tuple:
+    """Cache key of a retrieval."""
+    return (" ".join(query.split()), chat_id, user_id, limit, min_score, mode)
+
+
+def _generation(chat_id: Optional[int]) -> tuple[int, int]:
+    if chat_id:
+        return (_epoch, _chat_generations.get(chat_id, _pruned_generation))
+    return (_epoch, _write_generation)
+
+
+def generation(key: tuple) -> tuple[int, int]:
+    """
+    Current generation of the data a key's results come from.
+
+    Take it before searching and pass it to put(), so results computed
+    while a write landed are not cached.
+    """
+    return _generation(key[1])
+
+
+def get(key: tuple) -> Optional[Any]:
+    """Get a cached response, or None."""
+    config = get_config()
+    if config.rag.result_cache_size <= 0:
+        return None
+
+    entry = _entries.get(key)
+    if entry is None:
+        _stats["misses"] += 1
+        return None
+
+    entry_generation, expires_at, response = entry
+    if entry_generation != _generation(key[1]) or time.monotonic() >= expires_at:
+        del _entries[key]
+        _stats["misses"] += 1
+        return None
+
+    _entries.move_to_end(key)
+    _stats["hits"] += 1
+    return response
+
+
+def put(key: tuple, entry_generation: tuple[int, int], response: Any) -> None:
+    """Cache a response computed at `entry_generation` (see generation())."""
+    config = get_config()
+    max_entries = config.rag.result_cache_size
+    if max_entries <= 0 or entry_generation != _generation(key[1]):
+        return
+
+    _entries[key] = (entry_generation, time.monotonic() + config.rag.result_cache_ttl, response)
+    _entries.move_to_end(key)
+    while len(_entries) > max_entries:
+        _entries.popitem(last=False)
+
+
+def invalidate_chats(chat_ids: set[int]) -> None:
+    """Invalidate entries that may include documents of these chats."""
+    global _write_generation
+    if not chat_ids:
+        return
+    _write_generation += 1
+    for chat_id in chat_ids:
+        _chat_generations[chat_id] = _write_generation
+    _stats["invalidations"] += 1
+    if len(_chat_generations) > max(2 * get_config().rag.result_cache_size, 64):
+        _prune_chat_generations()
+
+
+def _prune_chat_generations() -> None:
+    """
+    Forget the stamps of chats without cached entries.
+
+    Their generation becomes the highest stamp forgotten, which is at least
+    their latest write, so a search that started before it still cannot be
+    cached; chats with entries but no stamp keep the generation they had.
+    """
+    global _pruned_generation
+    cached = {key[1] for key in _entries if key[1]}
+    for chat_id in cached - _chat_generations.keys():
+        _chat_generations[chat_id] = _pruned_generation
+    for chat_id in _chat_generations.keys() - cached:
+        _pruned_generation = max(_pruned_generation, _chat_generations.pop(chat_id))
+
+
+def invalidate_all() -> None:
+    """Invalidate every entry."""
+    global _epoch
+    _epoch += 1
+    _entries.clear()
+    # Generations from before the new epoch never match again
+    _chat_generations.clear()
+    _stats["invalidations"] += 1
+
+
+def get_result_cache_stats() -> dict:
+    """Hit/miss counters and size of the result cache."""
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "entries": len(_entries),
+        "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+    }
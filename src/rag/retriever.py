@@ -3,20 +3,42 @@ Retriever Module
 
 Semantic search over indexed messages.
 Transforms user queries into relevant context for the LLM.
+
+Retrieval modes (RAG_RETRIEVAL_MODE):
+- semantic: vector search only
+- lexical: BM25 keyword search only (no embedding call)
+- hybrid: both, fused with reciprocal rank fusion; short queries with an
+  identifier (issue numbers, @usernames, error codes, paths, code symbols)
+  take the lexical-only fast path
+
+Responses are cached (result_cache.py) until a write to a chat they cover.
 """
 
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import datetime
 from typing import Optional
 
 from ..utils.logger import get_logger
 from ..config import get_config
-from .embeddings import create_embedding, preprocess_text
-from .vectorstore import search, SearchResult, init_vectorstore
+from .embeddings import create_embedding, create_embeddings, preprocess_text
+from .vectorstore import search, search_many, lexical_search, SearchResult, init_vectorstore
+from .migration import active_spec
+from . import result_cache
 
 logger = get_logger("retriever")
 
+# Words that are identifiers rather than prose
+_IDENTIFIER_PATTERN = re.compile(
+    r"^[#@]\w"              # #123, @alice
+    r"|^\d{3,}$"            # 12345
+    r"|^[A-Za-z]+\d+\w*$"   # E1234, v2, sha256
+    r"|^[A-Z]{3,}$"         # ECONNREFUSED
+    r"|^[a-z]+[A-Z]\w*$"    # camelCase
+    r"|\w[_.:/\\]+\w"       # snake_case, v1.2, src/main.py, ns::name
+    r"|\w\(\)$"             # handler()
+)
+
 
 @dataclass
 class RetrievedDocument:
@@ -29,6 +51,17 @@ class RetrievedDocument:
     formatted: str
 
 
+@dataclass
+class RetrievalRequest:
+    """One query of a batched retrieval, with its own filters and limit."""
+    query: str
+    limit: int = 10
+    min_score: float = 0.3
+    chat_id: Optional[int] = None
+    user_id: Optional[int] = None
+    mode: Optional[str] = None
+
+
 @dataclass
 class RetrievalResponse:
     """Retrieval response with metadata."""
@@ -44,6 +77,7 @@ async def retrieve(
     min_score: float = 0.3,
     chat_id: Optional[int] = None,
     user_id: Optional[int] = None,
+    mode: Optional[str] = None,
 ) -> RetrievalResponse:
     """
     Retrieve relevant documents for a query.
@@ -51,12 +85,14 @@ async def retrieve(
     Args:
         query: User's natural language query
         limit: Max results
-        min_score: Minimum similarity score
+        min_score: Minimum similarity score (applies to vector results)
         chat_id: Optional filter by chat
         user_id: Optional filter by user
+        mode: semantic | lexical | hybrid (defaults to RAG_RETRIEVAL_MODE)
     
     Returns:
-        Retrieved documents with relevance scores
+        Retrieved documents with relevance scores (cosine similarity,
+        BM25 or fused rank score, depending on the mode used)
     """
     start_time = datetime.now()
     
@@ -71,52 +107,257 @@ async def retrieve(
     
     init_vectorstore()
     
-    logger.info(f"Retrieving for query: \"{query[:50]}...\"")
+    plan = _retrieval_plan(query, mode or config.rag.retrieval_mode)
+    
+    cache_key = result_cache.make_key(query, chat_id, user_id, limit, min_score, plan)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return _from_cache(cached, start_time)
+    generation = result_cache.generation(cache_key)
+    
+    logger.info(f"Retrieving ({plan}) for query: \"{query[:50]}...\"")
     
     try:
-        # Preprocess and embed query
-        processed_query = preprocess_text(query) or query
-        query_embedding = await create_embedding(processed_query)
+        semantic_results = []
+        if plan != "lexical":
+            # Preprocess and embed query (in the version the index was built with)
+            processed_query = preprocess_text(query) or query
+            query_embedding = await create_embedding(processed_query, spec=active_spec())
+            
+            # Search vector store
+            semantic_results = await search(
+                query_embedding,
+                limit=limit * 2,  # Get extra for filtering
+                chat_id=chat_id,
+                user_id=user_id,
+            )
         
-        # Search vector store
-        search_results = await search(
-            query_embedding,
-            limit=limit * 2,  # Get extra for filtering
-            chat_id=chat_id,
-            user_id=user_id,
-        )
+        lexical_results = []
+        if plan != "semantic":
+            lexical_results = await lexical_search(
+                query,
+                limit=limit * 2,
+                chat_id=chat_id,
+                user_id=user_id,
+            )
         
-        # Filter by minimum score
-        filtered_results = [r for r in search_results if r.score >= min_score]
+        results = _merge(plan, semantic_results, lexical_results, min_score)
+        search_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+        response = _build_response(query, results, limit, search_time_ms)
+        result_cache.put(cache_key, generation, response)
         
-        # Transform to retrieved documents
-        retrieved_docs = []
-        for result in filtered_results[:limit]:
-            doc = RetrievedDocument(
-                text=result.text,
-                score=result.score,
-                user_name=result.metadata.get("user_name", "Unknown"),
-                timestamp=result.metadata.get("timestamp", ""),
-                message_id=result.metadata.get("message_id", 0),
-                formatted=_format_for_llm(result),
+        logger.info(f"Retrieved {len(response.results)} documents in {search_time_ms}ms")
+        
+        return response
+    except Exception as e:
+        logger.error(f"Retrieval failed: {e}")
+        raise
+
+
+async def retrieve_many(requests: list[RetrievalRequest]) -> list[RetrievalResponse]:
+    """
+    Retrieve relevant documents for several queries at once.
+    
+    All queries that need vector search are embedded in one request and
+    scored against the vector store together; each keeps its own filters,
+    limit, minimum score and retrieval mode.
+    
+    Args:
+        requests: Queries to run
+    
+    Returns:
+        One response per request, in request order
+    """
+    if not requests:
+        return []
+    
+    start_time = datetime.now()
+    
+    config = get_config()
+    if not config.rag.enabled:
+        return [
+            RetrievalResponse(query=r.query, results=[], total_found=0, search_time_ms=0)
+            for r in requests
+        ]
+    
+    init_vectorstore()
+    
+    all_plans = [_retrieval_plan(r.query, r.mode or config.rag.retrieval_mode) for r in requests]
+    cache_keys = [
+        result_cache.make_key(r.query, r.chat_id, r.user_id, r.limit, r.min_score, plan)
+        for r, plan in zip(requests, all_plans)
+    ]
+    cached = [result_cache.get(key) for key in cache_keys]
+    misses = [i for i, response in enumerate(cached) if response is None]
+    if not misses:
+        return [_from_cache(response, start_time) for response in cached]
+    generations = [result_cache.generation(cache_keys[i]) for i in misses]
+    all_requests = requests
+    requests = [all_requests[i] for i in misses]
+    plans = [all_plans[i] for i in misses]
+    
+    logger.info(
+        f"Retrieving for {len(requests)} queries"
+        f"{f' ({len(all_requests) - len(requests)} cached)' if len(requests) < len(all_requests) else ''}"
+    )
+    
+    try:
+        semantic_results: list[list[SearchResult]] = [[] for _ in requests]
+        semantic = [i for i, plan in enumerate(plans) if plan != "lexical"]
+        if semantic:
+            processed = [preprocess_text(requests[i].query) or requests[i].query for i in semantic]
+            query_embeddings = await create_embeddings(processed, spec=active_spec())
+            
+            batch = await search_many(
+                query_embeddings,
+                limits=[requests[i].limit * 2 for i in semantic],  # Get extra for filtering
+                chat_ids=[requests[i].chat_id for i in semantic],
+                user_ids=[requests[i].user_id for i in semantic],
             )
-            retrieved_docs.append(doc)
+            for i, results in zip(semantic, batch):
+                semantic_results[i] = results
         
-        search_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+        responses = []
+        for r, plan, vector_results in zip(requests, plans, semantic_results):
+            lexical_results = []
+            if plan != "semantic":
+                lexical_results = await lexical_search(
+                    r.query,
+                    limit=r.limit * 2,
+                    chat_id=r.chat_id,
+                    user_id=r.user_id,
+                )
+            results = _merge(plan, vector_results, lexical_results, r.min_score)
+            responses.append((r, results))
         
-        logger.info(f"Retrieved {len(retrieved_docs)} documents in {search_time_ms}ms")
+        search_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+        responses = [
+            _build_response(r.query, results, r.limit, search_time_ms)
+            for r, results in responses
+        ]
+        for i, entry_generation, response in zip(misses, generations, responses):
+            result_cache.put(cache_keys[i], entry_generation, response)
         
-        return RetrievalResponse(
-            query=query,
-            results=retrieved_docs,
-            total_found=len(filtered_results),
-            search_time_ms=search_time_ms,
+        logger.info(
+            f"Retrieved {sum(len(r.results) for r in responses)} documents "
+            f"for {len(requests)} queries in {search_time_ms}ms"
         )
+        
+        fresh = dict(zip(misses, responses))
+        return [
+            fresh[i] if i in fresh else _from_cache(cached[i], start_time)
+            for i in range(len(all_requests))
+        ]
     except Exception as e:
-        logger.error(f"Retrieval failed: {e}")
+        logger.error(f"Batched retrieval failed: {e}")
         raise
 
 
+def _from_cache(response: RetrievalResponse, start_time: datetime) -> RetrievalResponse:
+    """A cached response, with its own result list and this lookup's time."""
+    search_time_ms = int((datetime.now() - start_time).total_seconds() * 1000)
+    logger.debug(f"Retrieval cache hit for query: \"{response.query[:50]}\"")
+    return replace(response, results=list(response.results), search_time_ms=search_time_ms)
+
+
+def is_keyword_query(query: str) -> bool:
+    """
+    Whether a query looks like a keyword lookup rather than a question.
+    
+    Short queries containing an identifier (#123, @alice, E1234,
+    ECONNREFUSED, snake_case, v1.2, src/main.py, handler()) are answered
+    well by BM25 alone. Short queries made of ordinary words ("deploy
+    failed") are not: they may be paraphrased in the messages, so they
+    keep semantic search.
+    """
+    words = query.split()
+    if not words or len(words) > 4 or "?" in query:
+        return False
+    
+    lower_query = query.lower()
+    if any(lower_query.startswith(q) for q in ["what ", "who ", "when ", "where ", "why ", "how "]):
+        return False
+    
+    return any(_IDENTIFIER_PATTERN.search(w.strip(",;:!\"'")) for w in words)
+
+
+def _retrieval_plan(query: str, mode: str) -> str:
+    """Resolve the retrieval mode for one query (hybrid may take the lexical fast path)."""
+    if mode == "hybrid" and is_keyword_query(query):
+        return "lexical"
+    if mode in ("lexical", "hybrid"):
+        return mode
+    return "semantic"
+
+
+def _merge(
+    plan: str,
+    semantic_results: list[SearchResult],
+    lexical_results: list[SearchResult],
+    min_score: float,
+) -> list[SearchResult]:
+    """Combine the result lists a plan produced, best first."""
+    semantic_results = [r for r in semantic_results if r.score >= min_score]
+    if plan == "semantic":
+        return semantic_results
+    if plan == "lexical":
+        return lexical_results
+    return _reciprocal_rank_fusion([semantic_results, lexical_results])
+
+
+def _reciprocal_rank_fusion(rankings: list[list[SearchResult]]) -> list[SearchResult]:
+    """
+    Fuse ranked lists: each document scores sum(1 / (k + rank)) over the
+    lists it appears in, so agreement between lists outranks a single
+    high position.
+    """
+    k = get_config().rag.rrf_k
+    fused: dict[str, SearchResult] = {}
+    scores: dict[str, float] = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, 1):
+            fused.setdefault(result.id, result)
+            scores[result.id] = scores.get(result.id, 0.0) + 1.0 / (k + rank)
+    
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [
+        SearchResult(
+            id=doc_id,
+            text=fused[doc_id].text,
+            score=scores[doc_id],
+            metadata=fused[doc_id].metadata,
+        )
+        for doc_id in ordered
+    ]
+
+
+def _build_response(
+    query: str,
+    results: list[SearchResult],
+    limit: int,
+    search_time_ms: int,
+) -> RetrievalResponse:
+    """Turn the best (already filtered) search results into retrieved documents."""
+    retrieved_docs = []
+    for result in results[:limit]:
+        doc = RetrievedDocument(
+            text=result.text,
+            score=result.score,
+            user_name=result.metadata.get("user_name", "Unknown"),
+            timestamp=result.metadata.get("timestamp", ""),
+            message_id=result.metadata.get("message_id", 0),
+            formatted=_format_for_llm(result),
+        )
+        retrieved_docs.append(doc)
+    
+    return RetrievalResponse(
+        query=query,
+        results=retrieved_docs,
+        total_found=len(results),
+        search_time_ms=search_time_ms,
+    )
+
+
 def _format_for_llm(result: SearchResult) -> str:
     """Format a search result for LLM context."""
     timestamp = result.metadata.get("timestamp", "")
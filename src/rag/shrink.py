@@ -0,0 +1,62 @@
+"""
+Shrink Tool
+
+Truncates the stored embeddings of every chat partition to a smaller width
+(for example 1536 -> 512 or 256), in place and without re-embedding:
+
+    python -m src.rag.shrink 512
+
+Run it while the bot is stopped, then set RAG_EMBEDDING_DIMENSIONS to the
+same width so new messages and queries are embedded at it as well. For
+backends whose vectors can be truncated (OpenAI) the index's embedding
+version is updated to match, so that setting does not start a re-embedding
+migration.
+"""
+
+import argparse
+import asyncio
+
+from dotenv import load_dotenv
+
+from ..config import load_config
+from ..utils.logger import setup_logging, get_logger
+from .embedding_backends import create_backend
+from .migration import active_spec
+from .vectorstore import init_vectorstore, shrink_index, set_active_version, close_vectorstore
+
+
+async def main(dimensions: int) -> None:
+    """Shrink every partition of the configured vector store."""
+    logger = get_logger("shrink")
+
+    init_vectorstore()
+    try:
+        shrunk = await shrink_index(dimensions)
+    finally:
+        await close_vectorstore()
+    logger.info(f"Shrunk {shrunk} partitions to {dimensions} dimensions")
+
+    spec = active_spec()
+    backend = create_backend(spec.backend, dimensions)
+    if backend.truncatable:
+        # Keep the preprocessing part of the version: the texts did not change
+        _, _, preprocess = spec.version.rpartition("+")
+        set_active_version(f"{backend.space}+{preprocess}", spec.backend, backend.dimensions)
+    else:
+        logger.warning(
+            f"{spec.backend} embeddings are not truncatable; the index keeps version "
+            f"{spec.version} and changing RAG_EMBEDDING_DIMENSIONS re-embeds it"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shrink stored embeddings to fewer dimensions")
+    parser.add_argument("dimensions", type=int, help="New embedding width")
+    args = parser.parse_args()
+    if args.dimensions <= 0:
+        parser.error("dimensions must be positive")
+
+    load_dotenv()
+    config = load_config()
+    setup_logging(level=config.app.log_level)
+    asyncio.run(main(args.dimensions))
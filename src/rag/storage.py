@@ -0,0 +1,435 @@
+"""
+Storage Module
+
+Binary on-disk format for the vector store.
+
+A snapshot directory holds three files:
+- vectors-<gen>.f32: raw little-endian float32 rows, memory-mapped on load
+- documents-<gen>.jsonl: one {"id", "text", "metadata"} line per row
+- manifest.json: generation, dimensions, committed row count, live document
+  count, sidecar length and the last write-ahead log sequence number folded
+  into the snapshot
+
+With a quantization mode (see quantization.py) it also holds a compact code
+matrix, codes-<gen>.bin, that searches scan instead of the float32 rows, plus
+codebook-<gen>.npy for product quantization. Codes are derived data: they
+are (re)built from the float32 rows whenever the configured mode changes.
+
+Appends write only the new rows and then atomically replace the manifest,
+which is the commit point: bytes past the committed lengths (e.g. from a
+crash mid-append) are ignored and truncated on the next load. Full rewrites
+go to a new generation of files, so the old snapshot stays valid until the
+new manifest lands.
+"""
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from ..utils.logger import get_logger
+from .quantization import PQ_MIN_TRAIN_ROWS, get_codec
+
+logger = get_logger("storage")
+
+FORMAT_VERSION = 1
+
+MANIFEST_FILE = "manifest.json"
+
+_DTYPE = np.dtype("<f4")
+
+_ENCODE_CHUNK = 16384
+
+
+@dataclass
+class Snapshot:
+    """Contents of a snapshot as loaded from disk."""
+    vectors: Optional[np.ndarray]  # Read-only memmap of shape (count, dimensions)
+    ids: list[str]
+    texts: list[str]
+    metadata: list[dict]
+    dimensions: Optional[int]
+    codes: Optional[np.ndarray] = None  # Read-only memmap of quantized rows
+    codec: Optional[object] = None
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+
+def _fsync_dir(path: Path) -> None:
+    """Flush a directory entry so a rename survives a crash (best effort)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SnapshotStore:
+    """Append-friendly binary snapshot stored in one directory."""
+
+    def __init__(self, directory: Path, quantization: str = "none", pq_subvectors: int = 0):
+        self.directory = Path(directory)
+        self.manifest_path = self.directory / MANIFEST_FILE
+        self.quantization = quantization
+        self.pq_subvectors = pq_subvectors
+
+        self.generation = 0
+        self.dimensions: Optional[int] = None
+        self.count = 0
+        # Rows not superseded by a later row with the same id
+        self.live = 0
+        self.applied_lsn = 0
+        self._documents_bytes = 0
+
+        # Codec of the code matrix; rows are encoded only once it is trained
+        self.codec = None
+        self._encoded = False
+
+    @property
+    def vectors_path(self) -> Path:
+        return self.directory / f"vectors-{self.generation}.f32"
+
+    @property
+    def documents_path(self) -> Path:
+        return self.directory / f"documents-{self.generation}.jsonl"
+
+    @property
+    def codes_path(self) -> Path:
+        return self.directory / f"codes-{self.generation}.bin"
+
+    @property
+    def codebook_path(self) -> Path:
+        return self.directory / f"codebook-{self.generation}.npy"
+
+    @property
+    def _codes_bytes(self) -> int:
+        if not self._encoded:
+            return 0
+        return self.count * self.codec.width * self.codec.dtype.itemsize
+
+    def exists(self) -> bool:
+        """Whether a committed snapshot is present."""
+        return self.manifest_path.exists()
+
+    def _read_manifest(self) -> dict:
+        with open(self.manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {manifest.get('version')}")
+        return manifest
+
+    def _write_manifest(self) -> None:
+        """Atomically replace the manifest (the commit point)."""
+        manifest = {
+            "version": FORMAT_VERSION,
+            "generation": self.generation,
+            "dimensions": self.dimensions,
+            "count": self.count,
+            "live": self.live,
+            "documents_bytes": self._documents_bytes,
+            "applied_lsn": self.applied_lsn,
+            "encoding": self.codec.name if self._encoded else "none",
+        }
+        if self._encoded and self.codec.name == "pq":
+            manifest["pq_subvectors"] = self.codec.subvectors
+            if not self.codebook_path.exists():
+                self._write_codebook()
+
+        tmp_path = self.manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+        _fsync_dir(self.directory)
+
+    def _write_codebook(self) -> None:
+        tmp_path = self.codebook_path.with_suffix(".tmp.npy")
+        with open(tmp_path, "wb") as f:
+            np.save(f, self.codec.codebooks)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.codebook_path)
+
+    def read_count(self) -> tuple[int, int]:
+        """
+        Live document count and applied LSN, read from the manifest without
+        loading (superseded rows are not counted).
+        """
+        manifest = self._read_manifest()
+        return manifest.get("live", manifest["count"]), manifest.get("applied_lsn", 0)
+
+    def load(self) -> Snapshot:
+        """
+        Load the committed snapshot.
+
+        Embeddings are memory-mapped rather than read, so this is cheap
+        regardless of index size; only the metadata sidecar is parsed.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        if not self.exists():
+            self.generation = 0
+            self.dimensions = None
+            self.count = 0
+            self.live = 0
+            self.applied_lsn = 0
+            self._documents_bytes = 0
+            self.codec = None
+            self._encoded = False
+            return Snapshot(vectors=None, ids=[], texts=[], metadata=[], dimensions=None)
+
+        manifest = self._read_manifest()
+        self.generation = manifest["generation"]
+        self.dimensions = manifest["dimensions"]
+        self.count = manifest["count"]
+        self.live = manifest.get("live", self.count)
+        self._documents_bytes = manifest["documents_bytes"]
+        self.applied_lsn = manifest.get("applied_lsn", 0)
+        self._load_codec(manifest)
+
+        # Drop any uncommitted tail left behind by an interrupted append
+        vectors_bytes = self.count * (self.dimensions or 0) * _DTYPE.itemsize
+        committed_files = [
+            (self.vectors_path, vectors_bytes),
+            (self.documents_path, self._documents_bytes),
+        ]
+        if self._encoded:
+            committed_files.append((self.codes_path, self._codes_bytes))
+        for path, committed in committed_files:
+            if not path.exists():
+                path.touch()
+            if path.stat().st_size > committed:
+                logger.warning(f"Truncating uncommitted data in {path.name}")
+                os.truncate(path, committed)
+
+        self._remove_stale_generations()
+
+        ids, texts, metadata = [], [], []
+        with open(self.documents_path, "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record["id"])
+                texts.append(record["text"])
+                metadata.append(record["metadata"])
+
+        if len(ids) != self.count:
+            raise ValueError(
+                f"Snapshot sidecar has {len(ids)} rows, manifest expects {self.count}"
+            )
+
+        vectors = None
+        if self.count:
+            vectors = self._map_vectors()
+            if self.codec is not None and not self._encoded:
+                self._encode_all()
+
+        return Snapshot(
+            vectors=vectors,
+            ids=ids,
+            texts=texts,
+            metadata=metadata,
+            dimensions=self.dimensions,
+            codes=self._map_codes(),
+            codec=self.codec if self._encoded else None,
+        )
+
+    def mapped(self) -> tuple[Optional[np.ndarray], Optional[np.ndarray]]:
+        """Fresh read-only maps of the committed (vectors, codes)."""
+        if not self.count:
+            return None, None
+        return self._map_vectors(), self._map_codes()
+
+    def _map_vectors(self) -> np.memmap:
+        return np.memmap(
+            self.vectors_path,
+            dtype=_DTYPE,
+            mode="r",
+            shape=(self.count, self.dimensions),
+        )
+
+    def _map_codes(self) -> Optional[np.memmap]:
+        if not self._encoded or not self.count:
+            return None
+        return np.memmap(
+            self.codes_path,
+            dtype=self.codec.dtype,
+            mode="r",
+            shape=(self.count, self.codec.width),
+        )
+
+    def _load_codec(self, manifest: dict) -> None:
+        """Set up the configured codec, reusing the stored codes if they match it."""
+        self.codec = None
+        self._encoded = False
+        if self.quantization == "none" or not self.dimensions:
+            return
+
+        self.codec = get_codec(self.quantization, self.dimensions, self.pq_subvectors)
+        encoding = manifest.get("encoding", "none")
+        if encoding != self.codec.name:
+            return
+        if encoding == "pq":
+            if manifest.get("pq_subvectors") != self.codec.subvectors or not self.codebook_path.exists():
+                return
+            self.codec.codebooks = np.load(self.codebook_path)
+        self._encoded = True
+
+    def _encode_all(self) -> None:
+        """
+        Build the code matrix for every committed row from the float32 rows
+        (first use of a quantization mode, or a PQ snapshot reaching the
+        training size).
+        """
+        if not self.codec.trained:
+            if self.count < PQ_MIN_TRAIN_ROWS:
+                return
+            logger.info(f"Training PQ codebooks on {self.count} rows in {self.directory.name}")
+            self.codec.train(self._map_vectors())
+            self.codebook_path.unlink(missing_ok=True)
+
+        logger.info(f"Encoding {self.count} rows as {self.codec.name} in {self.directory.name}")
+        vectors = self._map_vectors()
+        with open(self.codes_path, "wb") as f:
+            for start in range(0, self.count, _ENCODE_CHUNK):
+                f.write(self.codec.encode(vectors[start:start + _ENCODE_CHUNK]).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._encoded = True
+        self._write_manifest()
+
+    def append(
+        self,
+        vectors: np.ndarray,
+        ids: list[str],
+        texts: list[str],
+        metadata: list[dict],
+        applied_lsn: Optional[int] = None,
+        live: Optional[int] = None,
+    ) -> None:
+        """
+        Append rows without rewriting existing data.
+
+        `applied_lsn` records the newest log entry these rows cover; `live`
+        is the number of live documents in the snapshot once they are added
+        (default: every appended row is a new document).
+        """
+        if applied_lsn is not None:
+            self.applied_lsn = max(self.applied_lsn, applied_lsn)
+        self.live = self.live + len(ids) if live is None else live
+
+        if not ids:
+            if applied_lsn is not None:
+                self._write_manifest()
+            return
+
+        vectors = np.ascontiguousarray(vectors, dtype=_DTYPE)
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+            if self.quantization != "none":
+                self.codec = get_codec(self.quantization, self.dimensions, self.pq_subvectors)
+        elif vectors.shape[1] != self.dimensions:
+            raise ValueError(
+                f"Cannot append {vectors.shape[1]}-dim rows to a {self.dimensions}-dim snapshot"
+            )
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        with open(self.vectors_path, "ab") as f:
+            f.write(vectors.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        payload = "".join(
+            json.dumps({"id": doc_id, "text": text, "metadata": meta}) + "\n"
+            for doc_id, text, meta in zip(ids, texts, metadata)
+        ).encode("utf-8")
+        with open(self.documents_path, "ab") as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+        if self._encoded:
+            with open(self.codes_path, "ab") as f:
+                f.write(self.codec.encode(vectors).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+        self.count += len(ids)
+        self._documents_bytes += len(payload)
+        if self.codec is not None and not self._encoded:
+            # Commits the new rows together with their codes
+            self._encode_all()
+            if self._encoded:
+                return
+        self._write_manifest()
+
+    def _remove_stale_generations(self) -> None:
+        """Delete data files left over from older (or abandoned) generations."""
+        current = {
+            self.vectors_path.name,
+            self.documents_path.name,
+            self.codes_path.name,
+            self.codebook_path.name,
+        }
+        for pattern in ("vectors-*.f32", "documents-*.jsonl", "codes-*.bin", "codebook-*.npy"):
+            for path in self.directory.glob(pattern):
+                if path.name not in current:
+                    path.unlink(missing_ok=True)
+
+    def rewrite(
+        self,
+        vectors: Optional[np.ndarray],
+        ids: list[str],
+        texts: list[str],
+        metadata: list[dict],
+        applied_lsn: Optional[int] = None,
+        dimensions: Optional[int] = None,
+    ) -> None:
+        """
+        Replace the whole snapshot (used for migration, compaction, shrinking
+        and clearing).
+
+        The new rows are written to the next generation of files and only
+        become visible once the manifest is replaced. `dimensions` sets the
+        width of the new snapshot (default: the rows' width, or unchanged).
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.generation += 1
+        self.count = 0
+        self.live = 0
+        self._documents_bytes = 0
+        if dimensions is None:
+            dimensions = vectors.shape[1] if vectors is not None and len(ids) else self.dimensions
+        if dimensions != self.dimensions:
+            # Codes and codebooks are tied to the old width
+            self.codec = None
+        self.dimensions = dimensions
+        if self.codec is None and self.quantization != "none" and self.dimensions:
+            self.codec = get_codec(self.quantization, self.dimensions, self.pq_subvectors)
+        if applied_lsn is not None:
+            self.applied_lsn = max(self.applied_lsn, applied_lsn)
+
+        # Trained PQ codebooks carry over to the new generation
+        self._encoded = self.codec is not None and self.codec.trained
+        for path in (self.vectors_path, self.documents_path, self.codes_path):
+            path.write_bytes(b"")
+
+        if ids:
+            self.append(vectors, ids, texts, metadata)
+        else:
+            self._write_manifest()
+
+        self._remove_stale_generations()
@@ -1,18 +1,45 @@
 """
 Vector Store Module
 
-Simple in-memory vector store with JSON file persistence.
-Stores message embeddings for semantic search.
+Vector store with binary, memory-mapped persistence.
+Stores message embeddings for semantic search in a contiguous
+float32 matrix (see matrix_index.py and storage.py).
+
+The index is partitioned by chat_id (partition.py): every chat has its own
+matrix, snapshot and write-ahead log under <vector_db_path>/chats/<chat_id>/,
+so a chat-filtered search only touches that chat's vectors and partitions
+are loaded lazily and can be unloaded independently.
+
+Inserts are appended to the partition's write-ahead log (wal.py) and folded
+into its snapshot by background compaction; the log is replayed on load.
+
+Every document carries the embedding version that produced its vector, and
+the store records the version of its partitions in embedding_versions.json.
+While the embedding model changes, a second, shadow set of partitions (in
+its own directory) is filled with vectors of the new version next to the
+active one; searches keep using the active partitions until
+promote_shadow() swaps the two in one step (see migration.py).
 """
 
+import asyncio
+import heapq
 import json
-from dataclasses import dataclass, asdict
+import os
+import shutil
+import time
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
 
+import numpy as np
+
 from ..utils.logger import get_logger
 from ..config import get_config
-from .embeddings import cosine_similarity
+from .matrix_index import MatrixIndex
+from .partition import Partition, shutdown_build_pool
+from .result_cache import invalidate_chats, invalidate_all
+from .storage import SnapshotStore, MANIFEST_FILE
+from .wal import SEGMENT_PATTERN
 
 logger = get_logger("vectorstore")
 
@@ -35,6 +62,8 @@ class Document:
     text: str
     embedding: list[float]
     metadata: dict
+    # Embedding version of `embedding` (None = the active version)
+    embedding_version: Optional[str] = None
 
 
 @dataclass
@@ -47,64 +76,343 @@ class SearchResult:
 
 
 # Vector store instance
-_documents: dict[str, Document] = {}
-_persist_path: Optional[Path] = None
+_vector_dir: Optional[Path] = None
+_partitions: dict[int, Partition] = {}
 _initialized = False
 
+_compaction_wakeup = asyncio.Event()
+_flush_wakeup = asyncio.Event()
+_flush_task: Optional[asyncio.Task] = None
+_compaction_task: Optional[asyncio.Task] = None
+
+PARTITIONS_DIR = "chats"
+VERSIONS_FILE = "embedding_versions.json"
+
+# Embedding versions of the active and shadow partitions. A record is
+# {"version", "backend", "dimensions", "dir"}; dir holds its partitions.
+_versions: dict[str, Optional[dict]] = {"active": None, "shadow": None}
+_shadow_partitions: dict[int, Partition] = {}
+# (chat_id, doc_id) added to the active partitions but not to the shadow ones
+_shadow_gaps: set[tuple[int, str]] = set()
+# Versions replaced by a promotion; late documents of these are ignored
+_retired_versions: set[str] = set()
+
+# Partition used for documents without a chat_id
+UNPARTITIONED_CHAT_ID = 0
+
+# Legacy JSON file written by earlier versions (migrated on first start)
+LEGACY_JSON_FILE = "vectors.json"
+
 
 def init_vectorstore() -> None:
     """Initialize the vector store."""
-    global _documents, _persist_path, _initialized
+    global _vector_dir, _initialized
     
     if _initialized:
         return
     
     config = get_config()
-    _persist_path = Path(config.rag.vector_db_path) / "vectors.json"
-    _persist_path.parent.mkdir(parents=True, exist_ok=True)
+    _vector_dir = Path(config.rag.vector_db_path)
+    _vector_dir.mkdir(parents=True, exist_ok=True)
+    
+    versions_path = _vector_dir / VERSIONS_FILE
+    if versions_path.exists():
+        with open(versions_path, "r") as f:
+            _versions.update(json.load(f))
+    
+    # One-shot migration from the single-index layouts
+    _migrate_unpartitioned()
+    
+    # Discover partitions; they are loaded on first use
+    _discover_partitions(_partitions, shadow=False)
+    if _versions["shadow"]:
+        _discover_partitions(_shadow_partitions, shadow=True)
     
-    # Load existing data
-    if _persist_path.exists():
+    _initialized = True
+    logger.info(f"Vector store initialized ({len(_partitions)} chat partitions)")
+    if _versions["shadow"]:
+        logger.info(f"Shadow index for embedding version {_versions['shadow']['version']} in progress")
+
+
+def _partitions_dir(shadow: bool = False) -> Path:
+    record = _versions["shadow" if shadow else "active"]
+    return _vector_dir / (record["dir"] if record else PARTITIONS_DIR)
+
+
+def _discover_partitions(partitions: dict[int, Partition], shadow: bool) -> None:
+    directory = _partitions_dir(shadow)
+    directory.mkdir(parents=True, exist_ok=True)
+    for path in directory.iterdir():
         try:
-            with open(_persist_path, "r") as f:
+            chat_id = int(path.name)
+        except ValueError:
+            continue
+        if path.is_dir() and chat_id not in partitions:
+            partitions[chat_id] = _new_partition(chat_id, shadow)
+
+
+def _new_partition(chat_id: int, shadow: bool = False) -> Partition:
+    config = get_config()
+    return Partition(
+        chat_id,
+        _partitions_dir(shadow) / str(chat_id),
+        partition_by_user=config.rag.partition_by_user,
+        quantization=config.rag.quantization,
+        pq_subvectors=config.rag.pq_subvectors,
+        rescore=config.rag.rescore_factor,
+    )
+
+
+def _migrate_unpartitioned() -> None:
+    """Split a vectors.json file or a pre-partitioning snapshot into chat partitions."""
+    legacy_path = _vector_dir / LEGACY_JSON_FILE
+    root_store = SnapshotStore(_vector_dir)
+    has_root_snapshot = root_store.exists() or any(_vector_dir.glob(SEGMENT_PATTERN))
+    
+    if not has_root_snapshot and not legacy_path.exists():
+        return
+    
+    logger.info("Migrating vector store to per-chat partitions...")
+    
+    try:
+        if has_root_snapshot:
+            source = Partition(UNPARTITIONED_CHAT_ID, _vector_dir)
+            source.load()
+            migrated = source.index
+        else:
+            with open(legacy_path, "r") as f:
                 data = json.load(f)
-            
-            for doc_id, doc_data in data.items():
-                _documents[doc_id] = Document(
-                    id=doc_data["id"],
-                    text=doc_data["text"],
-                    embedding=doc_data["embedding"],
-                    metadata=doc_data["metadata"],
+            migrated = MatrixIndex()
+            for doc_data in data.values():
+                migrated.add(
+                    doc_data["id"],
+                    doc_data["text"],
+                    doc_data["embedding"],
+                    doc_data["metadata"],
                 )
-            
-            logger.info(f"Loaded {len(_documents)} documents from disk")
+        
+        by_chat: dict[int, list[int]] = {}
+        for row in migrated.live_rows():
+            _, _, metadata = migrated.document(row)
+            by_chat.setdefault(_partition_key(metadata), []).append(row)
+        
+        for chat_id, rows in by_chat.items():
+            documents = [migrated.document(row) for row in rows]
+            SnapshotStore(_partitions_dir() / str(chat_id)).rewrite(
+                migrated.vectors(rows),
+                [doc_id for doc_id, _, _ in documents],
+                [text for _, text, _ in documents],
+                [metadata for _, _, metadata in documents],
+            )
+        
+        # Remove the manifest first: it marks the migration as done
+        if has_root_snapshot:
+            source.wal.close()
+            (_vector_dir / MANIFEST_FILE).unlink(missing_ok=True)
+            for pattern in ("vectors-*.f32", "documents-*.jsonl", SEGMENT_PATTERN):
+                for path in _vector_dir.glob(pattern):
+                    path.unlink(missing_ok=True)
+        if legacy_path.exists():
+            legacy_path.rename(legacy_path.with_suffix(".json.migrated"))
+        
+        logger.info(
+            f"Migrated {len(migrated)} documents into {len(by_chat)} chat partitions"
+        )
+    except Exception as e:
+        logger.error(f"Failed to migrate vector store: {e}")
+
+
+def _partition_key(metadata: dict) -> int:
+    """Partition (chat) a document belongs to."""
+    chat_id = metadata.get("chat_id")
+    try:
+        return int(chat_id) if chat_id is not None else UNPARTITIONED_CHAT_ID
+    except (TypeError, ValueError):
+        return UNPARTITIONED_CHAT_ID
+
+
+def _chat_id_from_doc_id(doc_id: str) -> Optional[int]:
+    """Document ids are "<chat_id>:<message_id>"; recover the chat part."""
+    prefix, sep, _ = doc_id.partition(":")
+    if not sep:
+        return None
+    try:
+        return int(prefix)
+    except ValueError:
+        return None
+
+
+def _get_partition(chat_id: int, create: bool = False, shadow: bool = False) -> Optional[Partition]:
+    """Get a partition (active, or shadow), loading it on first use."""
+    partitions = _shadow_partitions if shadow else _partitions
+    partition = partitions.get(chat_id)
+    if partition is None:
+        if not create:
+            return None
+        partition = _new_partition(chat_id, shadow)
+        partitions[chat_id] = partition
+    
+    if not partition.loaded:
+        try:
+            partition.load()
         except Exception as e:
-            logger.warning(f"Could not load existing data: {e}")
-            _documents = {}
+            logger.warning(f"Could not load partition for chat {chat_id}: {e}")
+            partition.index.clear()
+            partition.loaded = True
     
-    _initialized = True
-    logger.info("Vector store initialized")
+    partition.last_used = time.monotonic()
+    return partition
+
+
+def _all_partitions() -> list[Partition]:
+    """Every active partition, loaded."""
+    return [_get_partition(chat_id) for chat_id in list(_partitions)]
 
 
-def _persist() -> None:
-    """Save documents to disk."""
-    if not _persist_path:
+def _every_partition() -> list[Partition]:
+    """Active and shadow partitions (loaded or not)."""
+    return [*_partitions.values(), *_shadow_partitions.values()]
+
+
+async def load_partition(chat_id: int) -> bool:
+    """Load a chat's partition into memory. Returns False if it does not exist."""
+    if not _initialized:
+        init_vectorstore()
+    return _get_partition(chat_id) is not None
+
+
+async def unload_partition(chat_id: int) -> None:
+    """Persist a chat's partition and release its memory."""
+    partition = _partitions.get(chat_id)
+    if partition:
+        await partition.unload(get_config().rag.compaction_dead_ratio)
+
+
+async def persist_partition(chat_id: int) -> None:
+    """Fold a chat's logged inserts into its snapshot."""
+    partition = _partitions.get(chat_id)
+    if partition:
+        await partition.compact(get_config().rag.compaction_dead_ratio)
+
+
+async def _evict_partitions(keep: set[int]) -> None:
+    """Unload least recently used partitions beyond RAG_MAX_LOADED_PARTITIONS."""
+    config = get_config()
+    max_loaded = config.rag.max_loaded_partitions
+    if max_loaded <= 0:
         return
     
+    loaded = [p for p in _every_partition() if p.loaded and p.chat_id not in keep]
+    excess = len(loaded) + len(keep) - max_loaded
+    if excess <= 0:
+        return
+    
+    loaded.sort(key=lambda p: p.last_used)
+    for partition in loaded[:excess]:
+        await partition.unload(config.rag.compaction_dead_ratio)
+        logger.debug(f"Unloaded partition for chat {partition.chat_id}")
+
+
+def _start_background_tasks() -> None:
+    """Start the WAL flusher and compactor on the running event loop."""
+    global _flush_task, _compaction_task
+    
     try:
-        data = {}
-        for doc_id, doc in _documents.items():
-            data[doc_id] = {
-                "id": doc.id,
-                "text": doc.text,
-                "embedding": doc.embedding,
-                "metadata": doc.metadata,
-            }
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    
+    if _flush_task is None or _flush_task.done():
+        _flush_task = loop.create_task(_flush_loop())
+    if _compaction_task is None or _compaction_task.done():
+        _compaction_task = loop.create_task(_compaction_loop())
+
+
+async def _flush_loop() -> None:
+    """fsync the write-ahead logs in batches, off the event loop."""
+    config = get_config()
+    interval = config.rag.wal_fsync_interval_ms / 1000
+    
+    while True:
+        try:
+            await asyncio.wait_for(_flush_wakeup.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        _flush_wakeup.clear()
         
-        with open(_persist_path, "w") as f:
-            json.dump(data, f)
-    except Exception as e:
-        logger.error(f"Failed to persist data: {e}")
+        dirty = [p.wal for p in _every_partition() if p.loaded and p.wal.unsynced]
+        if dirty:
+            try:
+                await asyncio.to_thread(lambda: [wal.sync() for wal in dirty])
+            except Exception as e:
+                logger.error(f"Failed to sync write-ahead log: {e}")
+
+
+async def _compaction_loop() -> None:
+    """Periodically fold the write-ahead logs into the snapshots."""
+    config = get_config()
+    
+    while True:
+        try:
+            await asyncio.wait_for(
+                _compaction_wakeup.wait(),
+                timeout=config.rag.compaction_interval,
+            )
+        except asyncio.TimeoutError:
+            pass
+        _compaction_wakeup.clear()
+        
+        await compact()
+
+
+async def compact() -> None:
+    """Fold logged inserts into the snapshot of every loaded partition."""
+    config = get_config()
+    for partition in _every_partition():
+        await partition.compact(config.rag.compaction_dead_ratio)
+
+
+async def shrink_index(dimensions: int) -> int:
+    """
+    Truncate every partition's stored embeddings to `dimensions`, in place.
+    
+    Partitions keep working with full-width query and document embeddings
+    (they are truncated to each partition's width); set
+    RAG_EMBEDDING_DIMENSIONS to the same value to also embed at that width.
+    
+    Returns:
+        Number of partitions that were shrunk
+    """
+    if not _initialized:
+        init_vectorstore()
+    
+    config = get_config()
+    shrunk = 0
+    for chat_id in list(_partitions):
+        was_loaded = _partitions[chat_id].loaded
+        partition = _get_partition(chat_id)
+        if await partition.shrink(dimensions):
+            shrunk += 1
+        if not was_loaded:
+            await partition.unload(config.rag.compaction_dead_ratio)
+    return shrunk
+
+
+async def close_vectorstore() -> None:
+    """Stop background work, persist every partition and close files."""
+    global _flush_task, _compaction_task
+    
+    for task in (_flush_task, _compaction_task):
+        if task:
+            task.cancel()
+    _flush_task = None
+    _compaction_task = None
+    
+    config = get_config()
+    for partition in _every_partition():
+        await partition.unload(config.rag.compaction_dead_ratio)
+    shutdown_build_pool()
+    logger.info("Vector store closed")
 
 
 async def add_documents(documents: list[Document]) -> None:
@@ -115,10 +423,68 @@ async def add_documents(documents: list[Document]) -> None:
     if not documents:
         return
     
+    config = get_config()
+    active = _versions["active"]
+    shadow = _versions["shadow"]
+    
+    # Check every version before writing anything, so a batch is never half-added
+    if active is not None:
+        known = {None, active["version"], *_retired_versions}
+        if shadow is not None:
+            known.add(shadow["version"])
+        unknown = {doc.embedding_version for doc in documents} - known
+        if unknown:
+            raise ValueError(
+                f"Documents have embedding versions {', '.join(sorted(unknown))}, "
+                f"the index uses {active['version']}"
+            )
+    
+    # Route by embedding version; never mix versions in one partition
+    routed: list[tuple[Document, bool]] = []
     for doc in documents:
-        _documents[doc.id] = doc
+        version = doc.embedding_version
+        if version is None or active is None or version == active["version"]:
+            routed.append((doc, False))
+        elif shadow is not None and version == shadow["version"]:
+            routed.append((doc, True))
+        # Otherwise retired: embedded just before a promotion; its new-version twin is kept
+    
+    touched: set[int] = set()
+    touched_partitions: dict[int, Partition] = {}
+    added_active: set[tuple[int, str]] = set()
+    added_shadow: set[tuple[int, str]] = set()
+    
+    for doc, to_shadow in routed:
+        chat_id = _partition_key(doc.metadata)
+        partition = _get_partition(chat_id, create=True, shadow=to_shadow)
+        version = doc.embedding_version or (active["version"] if active else None)
+        metadata = {**doc.metadata, "embedding_version": version} if version else doc.metadata
+        try:
+            partition.add(doc.id, doc.text, doc.embedding, metadata)
+        except Exception as e:
+            logger.error(f"Failed to add document {doc.id} to chat {chat_id}: {e}")
+            continue
+        (added_shadow if to_shadow else added_active).add((chat_id, doc.id))
+        touched.add(chat_id)
+        touched_partitions[id(partition)] = partition
+    
+    if shadow is not None:
+        _shadow_gaps.update(added_active - added_shadow)
+        _shadow_gaps.difference_update(added_shadow)
+    
+    # Cached retrievals over these chats are stale now
+    invalidate_chats({chat_id for chat_id, _ in added_active})
+    
+    _start_background_tasks()
+    for partition in touched_partitions.values():
+        partition.maybe_build_ann()
+        if partition.wal.unsynced >= config.rag.wal_fsync_batch:
+            _flush_wakeup.set()
+        if partition.pending_rows >= config.rag.compaction_threshold:
+            _compaction_wakeup.set()
+    
+    await _evict_partitions(keep=touched)
     
-    _persist()
     logger.info(f"Added {len(documents)} documents to vector store")
 
 
@@ -134,7 +500,7 @@ async def search(
     Args:
         query_embedding: Query vector
         limit: Max results
-        chat_id: Optional filter by chat
+        chat_id: Optional filter by chat (searches only that chat's partition)
         user_id: Optional filter by user
     
     Returns:
@@ -143,48 +509,379 @@ async def search(
     if not _initialized:
         init_vectorstore()
     
+    if chat_id:
+        partition = _get_partition(chat_id)
+        partitions = [partition] if partition else []
+    else:
+        partitions = _all_partitions()
+    
+    # One matrix-vector product per partition, then a partial sort
+    candidates = []
+    for partition in partitions:
+        rows, scores = partition.search(query_embedding, limit=limit, user_id=user_id)
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            candidates.append((score, partition, row))
+    
+    if len(partitions) > 1:
+        candidates = heapq.nlargest(limit, candidates, key=lambda c: c[0])
+    
+    results = _to_results(candidates)
+    
+    if chat_id:
+        await _evict_partitions(keep={chat_id})
+    
+    return results
+
+
+async def search_many(
+    query_embeddings: list[list[float]],
+    limits: list[int],
+    chat_ids: Optional[list[Optional[int]]] = None,
+    user_ids: Optional[list[Optional[int]]] = None,
+) -> list[list[SearchResult]]:
+    """
+    Search for several queries at once.
+    
+    Queries are grouped by the partitions they cover, and each partition
+    scores its group with one matrix-matrix product.
+    
+    Args:
+        query_embeddings: Query vectors
+        limits: Max results per query
+        chat_ids: Optional chat filter per query
+        user_ids: Optional user filter per query
+    
+    Returns:
+        Sorted search results per query, in query order
+    """
+    if not _initialized:
+        init_vectorstore()
+    
+    count = len(query_embeddings)
+    chat_ids = chat_ids or [None] * count
+    user_ids = user_ids or [None] * count
+    if count == 0:
+        return []
+    
+    queries = np.asarray(query_embeddings, dtype=np.float32)
+    
+    # Partition -> queries that cover it
+    groups: dict[int, tuple[Partition, list[int]]] = {}
+    for i, chat_id in enumerate(chat_ids):
+        if chat_id:
+            partition = _get_partition(chat_id)
+            targets = [partition] if partition else []
+        else:
+            targets = _all_partitions()
+        for partition in targets:
+            groups.setdefault(id(partition), (partition, []))[1].append(i)
+    
+    candidates: list[list] = [[] for _ in range(count)]
+    for partition, members in groups.values():
+        batch = partition.search_many(
+            queries[members],
+            [limits[i] for i in members],
+            [user_ids[i] for i in members],
+        )
+        for i, (rows, scores) in zip(members, batch):
+            for row, score in zip(rows.tolist(), scores.tolist()):
+                candidates[i].append((score, partition, row))
+    
     results = []
+    for i in range(count):
+        best = heapq.nlargest(limits[i], candidates[i], key=lambda c: c[0])
+        results.append(_to_results(best))
     
-    for doc in _documents.values():
-        # Apply filters
-        if chat_id and doc.metadata.get("chat_id") != chat_id:
-            continue
-        if user_id and doc.metadata.get("user_id") != user_id:
-            continue
-        
-        # Calculate similarity
-        score = cosine_similarity(query_embedding, doc.embedding)
-        
+    touched = {chat_id for chat_id in chat_ids if chat_id}
+    if touched:
+        await _evict_partitions(keep=touched)
+    
+    return results
+
+
+async def lexical_search(
+    query: str,
+    limit: int = 10,
+    chat_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+) -> list[SearchResult]:
+    """
+    Keyword search with the partitions' BM25 indexes (no embedding needed).
+    
+    Args:
+        query: Query text
+        limit: Max results
+        chat_id: Optional filter by chat (searches only that chat's partition)
+        user_id: Optional filter by user
+    
+    Returns:
+        Results sorted by BM25 score
+    """
+    if not _initialized:
+        init_vectorstore()
+    
+    if chat_id:
+        partition = _get_partition(chat_id)
+        partitions = [partition] if partition else []
+    else:
+        partitions = _all_partitions()
+    
+    candidates = []
+    for partition in partitions:
+        rows, scores = partition.lexical_search(query, limit=limit, user_id=user_id)
+        for row, score in zip(rows.tolist(), scores.tolist()):
+            candidates.append((score, partition, row))
+    
+    if len(partitions) > 1:
+        candidates = heapq.nlargest(limit, candidates, key=lambda c: c[0])
+    
+    results = _to_results(candidates)
+    
+    if chat_id:
+        await _evict_partitions(keep={chat_id})
+    
+    return results
+
+
+def _to_results(candidates: list[tuple[float, Partition, int]]) -> list[SearchResult]:
+    """Turn (score, partition, row) candidates into search results."""
+    results = []
+    for score, partition, row in candidates:
+        doc_id, text, metadata = partition.index.document(row)
         results.append(SearchResult(
-            id=doc.id,
-            text=doc.text,
+            id=doc_id,
+            text=text,
             score=score,
-            metadata=doc.metadata,
+            metadata=metadata,
         ))
-    
-    # Sort by score descending
-    results.sort(key=lambda x: x.score, reverse=True)
-    
-    return results[:limit]
+    return results
 
 
 async def get_document_count() -> int:
-    """Get the total number of documents."""
+    """
+    Get the total number of documents.
+    
+    Unloaded partitions are counted from their snapshot manifest.
+    """
     if not _initialized:
         init_vectorstore()
-    return len(_documents)
+    return sum(partition.stored_count() for partition in _partitions.values())
 
 
-async def document_exists(doc_id: str) -> bool:
-    """Check if a document exists."""
+async def document_exists(doc_id: str, chat_id: Optional[int] = None) -> bool:
+    """
+    Check if a document exists.
+    
+    The partition is taken from `chat_id`, or from the "<chat_id>:" prefix of
+    the id; otherwise every partition is checked.
+    """
     if not _initialized:
         init_vectorstore()
-    return doc_id in _documents
+    
+    if chat_id is None:
+        chat_id = _chat_id_from_doc_id(doc_id)
+    if chat_id is not None:
+        partition = _get_partition(chat_id)
+        return partition is not None and doc_id in partition
+    
+    return any(doc_id in partition for partition in _all_partitions())
 
 
 async def clear_all() -> None:
     """Clear all documents."""
-    global _documents
-    _documents = {}
-    _persist()
+    if not _initialized:
+        init_vectorstore()
+    
+    for partition in _every_partition():
+        try:
+            await partition.destroy()
+        except Exception as e:
+            logger.error(f"Failed to delete partition of chat {partition.chat_id}: {e}")
+    _partitions.clear()
+    _shadow_partitions.clear()
+    _shadow_gaps.clear()
+    invalidate_all()
+    
     logger.warning("Cleared all documents from vector store")
+
+
+def get_embedding_versions() -> dict[str, Optional[dict]]:
+    """
+    Get the embedding versions of the index.
+    
+    Returns:
+        {"active": record, "shadow": record}; a record is {"version",
+        "backend", "dimensions", "dir"}, None if there is none
+    """
+    if not _initialized:
+        init_vectorstore()
+    return {role: dict(record) if record else None for role, record in _versions.items()}
+
+
+def _save_versions() -> None:
+    """Atomically replace the versions file."""
+    path = _vector_dir / VERSIONS_FILE
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(_versions, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def set_active_version(version: str, backend: str, dimensions: int) -> None:
+    """
+    Record the embedding version of the active partitions.
+    
+    Used to stamp an index that has no version yet, or whose vectors changed
+    in place (shrink_index); it does not touch the stored vectors.
+    """
+    if not _initialized:
+        init_vectorstore()
+    
+    active = _versions["active"]
+    _versions["active"] = {
+        "version": version,
+        "backend": backend,
+        "dimensions": dimensions,
+        "dir": active["dir"] if active else PARTITIONS_DIR,
+    }
+    _save_versions()
+    logger.info(f"Active embedding version: {version}")
+
+
+async def begin_shadow(version: str, backend: str, dimensions: int) -> None:
+    """
+    Start an empty shadow index for a new embedding version.
+    
+    An existing shadow index (of another version) is discarded.
+    """
+    if not _initialized:
+        init_vectorstore()
+    
+    await discard_shadow()
+    _versions["shadow"] = {
+        "version": version,
+        "backend": backend,
+        "dimensions": dimensions,
+        "dir": f"{PARTITIONS_DIR}-{int(time.time())}",
+    }
+    _partitions_dir(shadow=True).mkdir(parents=True, exist_ok=True)
+    _save_versions()
+    logger.info(f"Started shadow index for embedding version {version}")
+
+
+async def discard_shadow() -> None:
+    """Delete the shadow index, if any."""
+    if not _initialized:
+        init_vectorstore()
+    
+    shadow = _versions["shadow"]
+    if shadow is None:
+        return
+    
+    directory = _partitions_dir(shadow=True)
+    _versions["shadow"] = None
+    _save_versions()
+    
+    for partition in list(_shadow_partitions.values()):
+        try:
+            await partition.destroy()
+        except Exception as e:
+            logger.error(f"Failed to delete shadow partition of chat {partition.chat_id}: {e}")
+    _shadow_partitions.clear()
+    _shadow_gaps.clear()
+    await asyncio.to_thread(shutil.rmtree, directory, True)
+    logger.info(f"Discarded shadow index for embedding version {shadow['version']}")
+
+
+def list_chat_ids() -> list[int]:
+    """Chats that have an active partition."""
+    if not _initialized:
+        init_vectorstore()
+    return sorted(_partitions)
+
+
+def missing_from_shadow(chat_id: int) -> list[tuple[str, str, dict]]:
+    """
+    Documents of a chat's active partition that its shadow partition lacks.
+    
+    Returns:
+        (doc_id, text, metadata) per missing document
+    """
+    if not _initialized:
+        init_vectorstore()
+    
+    active = _get_partition(chat_id)
+    if active is None or _versions["shadow"] is None:
+        return []
+    shadow = _get_partition(chat_id, shadow=True)
+    
+    missing = []
+    for row in active.index.live_rows():
+        doc_id, text, metadata = active.index.document(row)
+        if shadow is None or doc_id not in shadow:
+            missing.append((doc_id, text, metadata))
+    return missing
+
+
+def _prune_shadow_gaps() -> None:
+    """Forget gaps the shadow index has filled since."""
+    for chat_id, doc_id in list(_shadow_gaps):
+        partition = _get_partition(chat_id, shadow=True)
+        if partition is not None and doc_id in partition:
+            _shadow_gaps.discard((chat_id, doc_id))
+
+
+def shadow_gaps() -> set[int]:
+    """Chats with documents added since they were last copied to the shadow index."""
+    _prune_shadow_gaps()
+    return {chat_id for chat_id, _ in _shadow_gaps}
+
+
+async def promote_shadow() -> bool:
+    """
+    Make the shadow index the active one, in one step.
+    
+    Refused while documents added to the active index are missing from the
+    shadow one (see shadow_gaps()). The old partitions are deleted after
+    the switch; searches already running finish on them.
+    
+    Returns:
+        True if the shadow index was promoted
+    """
+    global _partitions, _shadow_partitions
+    
+    if not _initialized:
+        init_vectorstore()
+    
+    shadow = _versions["shadow"]
+    if shadow is None:
+        return False
+    _prune_shadow_gaps()
+    if _shadow_gaps:
+        return False
+    
+    # No await between here and _save_versions(): the switch is atomic
+    old_record = _versions["active"]
+    old_partitions = _partitions
+    old_directory = _partitions_dir()
+    _partitions, _shadow_partitions = _shadow_partitions, {}
+    _versions["active"], _versions["shadow"] = shadow, None
+    if old_record:
+        _retired_versions.add(old_record["version"])
+    _save_versions()
+    invalidate_all()
+    
+    logger.info(
+        f"Promoted embedding version {shadow['version']} "
+        f"({len(_partitions)} chat partitions)"
+    )
+    
+    for partition in old_partitions.values():
+        try:
+            await partition.destroy()
+        except Exception as e:
+            logger.error(f"Failed to delete retired partition of chat {partition.chat_id}: {e}")
+    await asyncio.to_thread(shutil.rmtree, old_directory, True)
+    return True
@@ -0,0 +1,260 @@
+"""
+Write-Ahead Log Module
+
+Append-only log of vector store inserts.
+New documents are written here first (O(1) per insert) and folded into the
+binary snapshot later by background compaction. After a crash the log is
+replayed on top of the snapshot.
+
+Each record is framed as:
+    <payload length: u32> <crc32: u32> <lsn: u64> <payload>
+where the payload is a length-prefixed JSON header ({"id", "text", "metadata"})
+followed by the raw float32 embedding. A torn or corrupt record ends replay
+and is truncated away.
+"""
+
+import json
+import os
+import struct
+import threading
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+from ..utils.logger import get_logger
+
+logger = get_logger("wal")
+
+SEGMENT_PATTERN = "wal-*.log"
+
+_FRAME = struct.Struct("<IIQ")
+_JSON_LENGTH = struct.Struct("<I")
+_DTYPE = np.dtype("<f4")
+
+
+@dataclass
+class WALRecord:
+    """A logged insert."""
+    lsn: int
+    doc_id: str
+    text: str
+    metadata: dict
+    vector: np.ndarray
+
+
+def _segment_path(directory: Path, sequence: int) -> Path:
+    return directory / f"wal-{sequence:08d}.log"
+
+
+def _segment_sequence(path: Path) -> int:
+    return int(path.stem.split("-", 1)[1])
+
+
+def _encode(lsn: int, doc_id: str, text: str, metadata: dict, vector: np.ndarray) -> bytes:
+    header = json.dumps({"id": doc_id, "text": text, "metadata": metadata}).encode("utf-8")
+    payload = (
+        _JSON_LENGTH.pack(len(header))
+        + header
+        + np.ascontiguousarray(vector, dtype=_DTYPE).tobytes()
+    )
+    crc = zlib.crc32(struct.pack("<Q", lsn) + payload)
+    return _FRAME.pack(len(payload), crc, lsn) + payload
+
+
+def _decode(lsn: int, payload: bytes) -> WALRecord:
+    (header_length,) = _JSON_LENGTH.unpack_from(payload)
+    start = _JSON_LENGTH.size
+    header = json.loads(payload[start:start + header_length])
+    vector = np.frombuffer(payload[start + header_length:], dtype=_DTYPE)
+    return WALRecord(
+        lsn=lsn,
+        doc_id=header["id"],
+        text=header["text"],
+        metadata=header["metadata"],
+        vector=vector,
+    )
+
+
+class WALSegment:
+    """One append-only log file."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, "ab")
+        self._lock = threading.Lock()
+        self._closed = False
+        self.records = 0
+
+    def write(self, data: bytes) -> None:
+        """Write to the OS page cache (durable after the next sync)."""
+        self._file.write(data)
+        self._file.flush()
+
+    def sync(self) -> None:
+        """fsync the segment. Safe to call from a worker thread."""
+        with self._lock:
+            if self._closed:
+                return
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        """Sync and close the segment."""
+        with self._lock:
+            if self._closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._closed = True
+
+
+class WriteAheadLog:
+    """Segmented write-ahead log living next to a snapshot."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self.next_lsn = 1
+        self.unsynced = 0
+        self._current: Optional[WALSegment] = None
+
+    def segments(self) -> list[Path]:
+        """All segment files, oldest first."""
+        return sorted(self.directory.glob(SEGMENT_PATTERN), key=_segment_sequence)
+
+    def replay(self, after_lsn: int = 0) -> Iterator[WALRecord]:
+        """
+        Yield logged records newer than `after_lsn`, oldest first.
+
+        Stops at the first torn or corrupt record and truncates the log there.
+        """
+        self.next_lsn = max(self.next_lsn, after_lsn + 1)
+
+        segments = self.segments()
+        for index, path in enumerate(segments):
+            with open(path, "rb") as f:
+                data = f.read()
+
+            offset = 0
+            while offset < len(data):
+                if offset + _FRAME.size > len(data):
+                    break
+                length, crc, lsn = _FRAME.unpack_from(data, offset)
+                start = offset + _FRAME.size
+                payload = data[start:start + length]
+                if len(payload) != length or zlib.crc32(struct.pack("<Q", lsn) + payload) != crc:
+                    break
+
+                offset = start + length
+                self.next_lsn = max(self.next_lsn, lsn + 1)
+                if lsn > after_lsn:
+                    yield _decode(lsn, payload)
+
+            if offset < len(data):
+                logger.warning(f"Discarding torn WAL tail in {path.name} at byte {offset}")
+                os.truncate(path, offset)
+                # Anything logged after a torn record cannot be trusted
+                for later in segments[index + 1:]:
+                    later.unlink(missing_ok=True)
+                return
+
+    def logged_ids(self, after_lsn: int = 0) -> set[str]:
+        """
+        Document ids of records newer than `after_lsn`, without decoding
+        their embeddings or repairing the log (for counting unloaded
+        partitions; replay() remains the authority).
+        """
+        ids = set()
+        for path in self.segments():
+            with open(path, "rb") as f:
+                while True:
+                    frame = f.read(_FRAME.size)
+                    if len(frame) < _FRAME.size:
+                        break
+                    length, _, lsn = _FRAME.unpack(frame)
+                    if lsn <= after_lsn:
+                        f.seek(length, os.SEEK_CUR)
+                        continue
+                    prefix = f.read(_JSON_LENGTH.size)
+                    if len(prefix) < _JSON_LENGTH.size:
+                        break
+                    (header_length,) = _JSON_LENGTH.unpack(prefix)
+                    header = f.read(header_length)
+                    try:
+                        ids.add(json.loads(header)["id"])
+                    except (ValueError, KeyError):
+                        # Torn record: replay stops here too
+                        return ids
+                    f.seek(length - _JSON_LENGTH.size - header_length, os.SEEK_CUR)
+        return ids
+
+    def open(self) -> None:
+        """Start a fresh segment for new appends (done lazily on first append)."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        existing = self.segments()
+        sequence = _segment_sequence(existing[-1]) + 1 if existing else 1
+        self._current = WALSegment(_segment_path(self.directory, sequence))
+
+    def append(self, doc_id: str, text: str, metadata: dict, vector: np.ndarray) -> int:
+        """
+        Log one insert.
+
+        Returns:
+            The record's log sequence number
+        """
+        if self._current is None:
+            self.open()
+
+        lsn = self.next_lsn
+        self.next_lsn += 1
+
+        self._current.write(_encode(lsn, doc_id, text, metadata, vector))
+        self._current.records += 1
+        self.unsynced += 1
+        return lsn
+
+    @property
+    def last_lsn(self) -> int:
+        """LSN of the most recent append (0 if nothing was ever logged)."""
+        return self.next_lsn - 1
+
+    @property
+    def current_records(self) -> int:
+        """Records in the active segment."""
+        return self._current.records if self._current else 0
+
+    def sync(self) -> None:
+        """fsync the active segment. Safe to call from a worker thread."""
+        current = self._current
+        self.unsynced = 0
+        if current:
+            current.sync()
+
+    def rotate(self) -> list[Path]:
+        """
+        Seal the active segment; the next append starts a new one.
+
+        Returns:
+            Paths of all sealed segments (to be removed once compacted)
+        """
+        self.close()
+        return self.segments()
+
+    def remove(self, paths: list[Path]) -> None:
+        """Delete sealed segments that have been folded into the snapshot."""
+        for path in paths:
+            path.unlink(missing_ok=True)
+
+    def reset(self) -> None:
+        """Drop every segment (LSNs keep increasing)."""
+        self.close()
+        self.remove(self.segments())
+
+    def close(self) -> None:
+        """Sync and close the active segment."""
+        if self._current:
+            self._current.close()
+            self._current = None
+        self.unsynced = 0
@@ -1,4 +1,4 @@
-"""Tools module - Scheduler and Telegram actions."""
+"""Tools module - Scheduler, Telegram actions and the tool registry."""
 
 from .scheduler import (
     TaskScheduler,
@@ -19,6 +19,13 @@ from .telegram_actions import (
     unpin_message,
     get_bot_info,
 )
+from .registry import (
+    set_tool_group,
+    remove_tool_group,
+    get_catalog,
+    dispatch,
+    get_tool_stats,
+)
 
 __all__ = [
     # Scheduler
@@ -38,4 +45,10 @@ __all__ = [
     "pin_message",
     "unpin_message",
     "get_bot_info",
+    # Tool Registry
+    "set_tool_group",
+    "remove_tool_group",
+    "get_catalog",
+    "dispatch",
+    "get_tool_stats",
 ]
@@ -0,0 +1,139 @@
+"""
+Tool Registry
+
+Maps tool names to their handler coroutines and pre-built Anthropic
+schemas, so the agent dispatches a tool call with one dict lookup and
+sends the same catalog list with every request.
+
+Tools are registered in groups (built-in, Telegram, one per MCP server).
+The catalog is the groups' schemas in registration order; it is rebuilt
+only when a group changes (an MCP server connects or disconnects), which
+also keeps the request prefix stable for prompt caching.
+
+Each tool records its call count, errors and latency (get_tool_stats()).
+"""
+
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from ..utils.logger import get_logger
+
+logger = get_logger("tool-registry")
+
+# handler(args, context) -> result text
+ToolHandler = Callable[[dict, Any], Awaitable[str]]
+
+
+@dataclass
+class RegisteredTool:
+    """A tool with its schema, handler and usage statistics."""
+    name: str
+    schema: dict
+    handler: ToolHandler
+    group: str
+    calls: int = 0
+    errors: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+
+# Registry state
+_tools: dict[str, RegisteredTool] = {}
+_groups: dict[str, list[str]] = {}
+_catalog: Optional[list[dict]] = None
+
+
+def set_tool_group(group: str, tools: list[tuple[dict, ToolHandler]]) -> None:
+    """
+    Register a group of tools, replacing the group's previous tools.
+
+    Args:
+        group: Group name (e.g. "telegram", "mcp:github")
+        tools: (Anthropic tool schema, handler) pairs
+    """
+    global _catalog
+
+    for name in _groups.pop(group, []):
+        _tools.pop(name, None)
+
+    names = []
+    for schema, handler in tools:
+        name = schema["name"]
+        existing = _tools.get(name)
+        if existing is not None:
+            logger.warning(f"Tool {name} from {group} replaces the one from {existing.group}")
+            _groups[existing.group].remove(name)
+        _tools[name] = RegisteredTool(name=name, schema=schema, handler=handler, group=group)
+        names.append(name)
+
+    if names:
+        _groups[group] = names
+    _catalog = None
+    logger.debug(f"Registered {len(names)} tools in group {group}")
+
+
+def remove_tool_group(group: str) -> None:
+    """Unregister a group's tools."""
+    set_tool_group(group, [])
+
+
+def get_catalog() -> list[dict]:
+    """
+    Schemas of every registered tool, in registration order.
+
+    The list is shared between calls; do not modify it.
+    """
+    global _catalog
+    if _catalog is None:
+        _catalog = [_tools[name].schema for names in _groups.values() for name in names]
+    return _catalog
+
+
+def has_tool(name: str) -> bool:
+    """Whether a tool is registered."""
+    return name in _tools
+
+
+async def dispatch(name: str, args: dict, context: Any = None) -> str:
+    """
+    Run a tool's handler.
+
+    Returns:
+        The handler's result text ("Unknown tool: ..." if none is registered)
+    """
+    tool = _tools.get(name)
+    if tool is None:
+        return f"Unknown tool: {name}"
+
+    started = time.monotonic()
+    failed = True
+    try:
+        result = await tool.handler(args, context)
+        failed = False
+        return result
+    finally:
+        elapsed = time.monotonic() - started
+        tool.calls += 1
+        tool.errors += failed
+        tool.total_seconds += elapsed
+        tool.max_seconds = max(tool.max_seconds, elapsed)
+
+
+def get_tool_stats() -> dict[str, dict]:
+    """
+    Per-tool usage of tools that have been called.
+
+    Returns:
+        {name: {"calls", "errors", "avg_ms", "max_ms"}}
+    """
+    return {
+        tool.name: {
+            "calls": tool.calls,
+            "errors": tool.errors,
+            "avg_ms": round(tool.total_seconds / tool.calls * 1000, 1),
+            "max_ms": round(tool.max_seconds * 1000, 1),
+        }
+        for tool in _tools.values()
+        if tool.calls
+    }
@@ -5,18 +5,42 @@ Provides Telegram API operations as tools for the AI agent.
 Mirrors the functionality of Slack-ClawdBot's slack-actions.ts.
 """
 
+import time
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional, Any
 
 from telegram import Bot
-from telegram.error import TelegramError
+from telegram.error import RetryAfter, TelegramError
 
 from ..utils.logger import get_logger
 from ..config import get_config
 
 logger = get_logger("telegram-actions")
 
+# Flood control: chat_id -> monotonic time until which Telegram refuses our requests
+_flood_wait_until: dict[int, float] = {}
+
+
+def _note_flood_wait(chat_id: int, error: RetryAfter) -> None:
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        retry_after = retry_after.total_seconds()
+    _flood_wait_until[chat_id] = time.monotonic() + float(retry_after)
+    logger.warning(f"Flood control in {chat_id}: retry in {retry_after}s")
+
+
+def flood_wait(chat_id: int) -> float:
+    """Seconds left of a flood-control wait Telegram imposed on a chat (0 if none)."""
+    until = _flood_wait_until.get(chat_id)
+    if until is None:
+        return 0.0
+    remaining = until - time.monotonic()
+    if remaining <= 0:
+        del _flood_wait_until[chat_id]
+        return 0.0
+    return remaining
+
 
 @dataclass
 class TelegramUser:
@@ -130,7 +154,7 @@ async def send_message(
     chat_id: int,
     text: str,
     reply_to_message_id: Optional[int] = None,
-    parse_mode: str = "Markdown"
+    parse_mode: Optional[str] = "Markdown"
 ) -> Optional[TelegramMessage]:
     """
     Send a message to a chat.
@@ -139,7 +163,7 @@ async def send_message(
         chat_id: Target chat ID
         text: Message text
         reply_to_message_id: Optional message to reply to
-        parse_mode: Markdown or HTML
+        parse_mode: Markdown or HTML (None = plain text)
     
     Returns:
         Sent message info or None on error
@@ -163,6 +187,9 @@ async def send_message(
             text=message.text,
             date=message.date,
         )
+    except RetryAfter as e:
+        _note_flood_wait(chat_id, e)
+        return None
     except TelegramError as e:
         logger.error(f"Failed to send message to {chat_id}: {e}")
         return None
@@ -213,7 +240,7 @@ async def edit_message(
     chat_id: int,
     message_id: int,
     text: str,
-    parse_mode: str = "Markdown"
+    parse_mode: Optional[str] = "Markdown"
 ) -> bool:
     """
     Edit an existing message.
@@ -222,7 +249,7 @@ async def edit_message(
         chat_id: Chat ID
         message_id: Message ID to edit
         text: New text
-        parse_mode: Markdown or HTML
+        parse_mode: Markdown or HTML (None = plain text)
     
     Returns:
         True if successful
@@ -235,8 +262,11 @@ async def edit_message(
             text=text,
             parse_mode=parse_mode,
         )
-        logger.info(f"Edited message {message_id} in {chat_id}")
+        logger.debug(f"Edited message {message_id} in {chat_id}")
         return True
+    except RetryAfter as e:
+        _note_flood_wait(chat_id, e)
+        return False
     except TelegramError as e:
         logger.error(f"Failed to edit message: {e}")
         return False
@@ -0,0 +1,82 @@
+"""Shared fixtures: an isolated configuration and a fresh vector store per test."""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+import src.config as config_module
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """Configuration pointing every data path at the test's temp directory."""
+    monkeypatch.chdir(tmp_path)  # no .env from the working tree
+    env = {
+        "TELEGRAM_BOT_TOKEN": "test-token",
+        "ANTHROPIC_API_KEY": "test-key",
+        "DATABASE_PATH": str(tmp_path / "db.sqlite"),
+        "VECTOR_DB_PATH": str(tmp_path / "vectors"),
+        "RAG_EMBEDDING_BACKEND": "hashing",
+        "RAG_EMBEDDING_WORKERS": "0",
+        "RAG_ANN_BUILD_WORKERS": "0",
+    }
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr(config_module, "config", None)
+    return config_module.load_config()
+
+
+def reload_config(monkeypatch, **env) -> None:
+    """Apply environment overrides to the test configuration."""
+    for name, value in env.items():
+        monkeypatch.setenv(name, str(value))
+    monkeypatch.setattr(config_module, "config", None)
+    config_module.load_config()
+
+
+@pytest.fixture
+def vectorstore(config, monkeypatch):
+    """The vector store module with its state reset (and restored afterwards)."""
+    from src.rag import embeddings, result_cache, vectorstore as module
+
+    monkeypatch.setattr(module, "_initialized", False)
+    monkeypatch.setattr(module, "_vector_dir", None)
+    monkeypatch.setattr(module, "_partitions", {})
+    monkeypatch.setattr(module, "_shadow_partitions", {})
+    monkeypatch.setattr(module, "_shadow_gaps", set())
+    monkeypatch.setattr(module, "_retired_versions", set())
+    monkeypatch.setattr(module, "_versions", {"active": None, "shadow": None})
+    monkeypatch.setattr(module, "_flush_task", None)
+    monkeypatch.setattr(module, "_compaction_task", None)
+    # Events bind to the loop that first waits on them; every test runs its own loop
+    monkeypatch.setattr(module, "_flush_wakeup", asyncio.Event())
+    monkeypatch.setattr(module, "_compaction_wakeup", asyncio.Event())
+    monkeypatch.setattr(embeddings, "_configured", None, raising=False)
+    result_cache.invalidate_all()
+    return module
+
+
+def random_unit_vectors(count: int, dimensions: int, seed: int = 0, clusters: int = 0) -> np.ndarray:
+    """Normalized float32 rows; with `clusters`, drawn around that many centres."""
+    rng = np.random.default_rng(seed)
+    vectors = rng.standard_normal((count, dimensions))
+    if clusters:
+        centres = rng.standard_normal((clusters, dimensions)) * 2
+        vectors = centres[rng.integers(0, clusters, count)] + vectors
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors.astype(np.float32)
+
+
+def reopen_vectorstore(module) -> None:
+    """Forget in-memory vector store state, as after a restart (files stay)."""
+    from src.rag import embeddings
+
+    module._initialized = False
+    module._partitions.clear()
+    module._shadow_partitions.clear()
+    module._shadow_gaps.clear()
+    module._retired_versions.clear()
+    module._versions.update(active=None, shadow=None)
+    embeddings._configured = None
+    module.init_vectorstore()
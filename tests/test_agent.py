@@ -0,0 +1,239 @@
+"""Context gathering, prompt-cache layout and tool execution in the agent."""
+
+import asyncio
+import copy
+import time
+import weakref
+from types import SimpleNamespace
+
+import pytest
+
+from src.agents import agent
+
+from .conftest import reload_config
+
+CONTEXT = agent.AgentContext(user_id=1, chat_id=2, session_id="s")
+
+
+@pytest.fixture
+def sources(config, monkeypatch):
+    """Stub context sources; set `delays[name]` or `errors[name]` to slow or break one."""
+    reload_config(monkeypatch, AI_CONTEXT_TIMEOUT=0.3, AI_CONTEXT_SOURCE_TIMEOUT=0.2, RAG_ENABLED="true")
+    delays: dict[str, float] = {}
+    errors: dict[str, Exception] = {}
+
+    async def memory(query, user_id):
+        await asyncio.sleep(delays.get("memory", 0))
+        if "memory" in errors:
+            raise errors["memory"]
+        return ["likes tea"]
+
+    async def rag(query, chat_id):
+        await asyncio.sleep(delays.get("rag", 0))
+        return "rag response"
+
+    def history(session_id, limit):
+        time.sleep(delays.get("history", 0))
+        return ["earlier message"]
+
+    monkeypatch.setattr(agent, "is_memory_enabled", lambda: True)
+    monkeypatch.setattr(agent, "should_use_rag", lambda query: True)
+    monkeypatch.setattr(agent, "search_memory", memory)
+    monkeypatch.setattr(agent, "retrieve", rag)
+    monkeypatch.setattr(agent, "get_session_history", history)
+    monkeypatch.setattr(agent, "get_session_window", history)
+    return delays, errors
+
+
+def test_sources_run_concurrently(sources):
+    delays, _ = sources
+    delays.update(memory=0.1, rag=0.1, history=0.1)
+
+    started = time.monotonic()
+    results, timings, dropped = asyncio.run(agent._gather_context("what did we decide?", CONTEXT))
+
+    assert time.monotonic() - started < 0.25
+    assert results == {"memory": ["likes tea"], "rag": "rag response", "history": ["earlier message"]}
+    assert set(timings) == {"memory", "rag", "history"}
+    assert dropped == []
+
+
+def test_slow_and_failing_sources_are_dropped(sources):
+    delays, errors = sources
+    delays["rag"] = 1.0
+    errors["memory"] = RuntimeError("mem0 is down")
+
+    started = time.monotonic()
+    results, timings, dropped = asyncio.run(agent._gather_context("what did we decide?", CONTEXT))
+
+    # The per-source timeout cuts the slow source off
+    assert time.monotonic() - started < 0.5
+    assert results == {"history": ["earlier message"]}
+    assert sorted(dropped) == ["memory", "rag"]
+    assert timings["rag"] >= 150
+
+
+class FakeMessages:
+    """Stands in for `client.messages`: two turns with a tool call, then a final answer."""
+
+    def __init__(self):
+        self.requests: list[dict] = []
+
+    async def create(self, **request):
+        self.requests.append(copy.deepcopy(request))
+        usage = SimpleNamespace(input_tokens=100, output_tokens=10, cache_read_input_tokens=80, cache_creation_input_tokens=0)
+        if len(self.requests) < 3:
+            text = SimpleNamespace(type="text", text="Let me check.")
+            tool_use = SimpleNamespace(type="tool_use", name="lookup", input={}, id=f"call-{len(self.requests)}")
+            return SimpleNamespace(stop_reason="tool_use", content=[text, tool_use], usage=usage)
+        return SimpleNamespace(stop_reason="end_turn", content=[SimpleNamespace(type="text", text="Done.")], usage=usage)
+
+    def stream(self, **request):
+        return FakeStream(self, request)
+
+
+class FakeStream:
+    """`client.messages.stream()`: yields the text blocks of the next response."""
+
+    def __init__(self, messages: FakeMessages, request: dict):
+        self.messages = messages
+        self.request = request
+
+    async def __aenter__(self):
+        self.response = await self.messages.create(**self.request)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    async def text_stream(self):
+        for block in self.response.content:
+            if block.type == "text":
+                yield block.text
+
+    async def get_final_message(self):
+        return self.response
+
+
+@pytest.fixture
+def model(sources, monkeypatch):
+    """A fake model client; history holds two earlier messages."""
+    fake = FakeMessages()
+    history = [SimpleNamespace(role="user", content="hi"), SimpleNamespace(role="assistant", content="hello")]
+
+    async def execute_tool(name, args, context):
+        return "tool output"
+
+    monkeypatch.setattr(agent, "_get_client", lambda: SimpleNamespace(messages=fake))
+    monkeypatch.setattr(agent, "get_session_history", lambda session_id, limit: history)
+    monkeypatch.setattr(agent, "get_session_window", lambda session_id, size: history)
+    monkeypatch.setattr(agent, "get_catalog", lambda: [{"name": "lookup"}])
+    monkeypatch.setattr(agent, "_execute_tool", execute_tool)
+    monkeypatch.setattr(agent, "add_message", lambda *args, **kwargs: None)
+    monkeypatch.setattr(agent, "is_memory_enabled", lambda: False)
+    monkeypatch.setattr(agent, "should_use_rag", lambda query: False)
+    return fake
+
+
+def _breakpoints(messages: list[dict]) -> list[int]:
+    """Indexes of the messages whose last block is a cache breakpoint."""
+    return [
+        i for i, message in enumerate(messages)
+        if isinstance(message["content"], list)
+        and isinstance(message["content"][-1], dict)
+        and "cache_control" in message["content"][-1]
+    ]
+
+
+def test_requests_place_cache_breakpoints(model):
+    response = asyncio.run(agent.process_message("what did we decide?", CONTEXT))
+    first, second, third = model.requests
+
+    assert response.content == "Done."
+    assert response.usage["cache_read_input_tokens"] == 240
+    assert first["system"][0]["cache_control"] == {"type": "ephemeral"}
+    # History ends in a breakpoint; the current turn's context comes after it
+    assert _breakpoints(first["messages"]) == [1]
+    assert "Current Date & Time" in first["messages"][2]["content"][0]["text"]
+    # The tool loop moves one breakpoint to its latest results
+    assert _breakpoints(second["messages"]) == [1, 4]
+    assert _breakpoints(third["messages"]) == [1, 6]
+
+
+def test_prompt_caching_can_be_turned_off(model, monkeypatch):
+    reload_config(monkeypatch, AI_PROMPT_CACHING="false")
+    asyncio.run(agent.process_message("what did we decide?", CONTEXT))
+
+    for request in model.requests:
+        assert "cache_control" not in request["system"][0]
+        assert _breakpoints(request["messages"]) == []
+
+
+def test_streamed_reply_is_stored_as_shown(model, monkeypatch):
+    stored = []
+    monkeypatch.setattr(agent, "add_message", lambda session_id, role, content, **kwargs: stored.append((role, content)))
+    pieces = []
+
+    response = asyncio.run(agent.process_message("what did we decide?", CONTEXT, on_text=pieces.append))
+
+    # Text written before the tool calls is part of the reply, in history too
+    shown = "Let me check.\n\nLet me check.\n\nDone."
+    assert "".join(pieces) == shown
+    assert response.content == shown
+    assert stored[-1] == ("assistant", shown)
+
+
+@pytest.fixture
+def tools(config, monkeypatch):
+    """A fake _execute_tool that logs start/end events; args set its delay or error."""
+    reload_config(monkeypatch, AI_TOOL_TIMEOUT=0.2)
+    events: list[tuple[str, str]] = []
+
+    async def execute_tool(name, args, context):
+        events.append(("start", args["tag"]))
+        await asyncio.sleep(args.get("delay", 0.05))
+        if "error" in args:
+            raise RuntimeError(args["error"])
+        events.append(("end", args["tag"]))
+        return f"{name} {args['tag']}"
+
+    monkeypatch.setattr(agent, "_execute_tool", execute_tool)
+    monkeypatch.setattr(agent, "_chat_locks", weakref.WeakValueDictionary())
+    return events
+
+
+def _call(name: str, tag: str, **args) -> SimpleNamespace:
+    return SimpleNamespace(type="tool_use", name=name, id=f"call-{tag}", input={"tag": tag, **args})
+
+
+def test_tool_calls_run_concurrently_in_order(tools):
+    blocks = [_call("lookup", "a", delay=0.1), _call("lookup", "b", delay=0.05), _call("lookup", "c", delay=0.1)]
+
+    started = time.monotonic()
+    outputs = asyncio.run(agent._execute_tool_calls(blocks, CONTEXT, {}))
+
+    assert time.monotonic() - started < 0.2
+    assert outputs == ["lookup a", "lookup b", "lookup c"]
+
+
+def test_chat_actions_run_one_at_a_time_per_chat(tools):
+    blocks = [
+        _call("send_message", "first", chat_id=7, delay=0.05),
+        _call("send_message", "other chat", chat_id=8, delay=0.01),
+        _call("send_message", "second", chat_id="7", delay=0.01),
+    ]
+    asyncio.run(agent._execute_tool_calls(blocks, CONTEXT, {}))
+
+    # Chat 7's actions do not overlap and keep their order; chat 8 does not wait
+    assert tools.index(("end", "first")) < tools.index(("start", "second"))
+    assert tools.index(("start", "other chat")) < tools.index(("end", "first"))
+
+
+def test_failing_and_slow_tool_calls_return_errors(tools):
+    blocks = [_call("lookup", "slow", delay=1.0), _call("lookup", "broken", error="boom"), _call("lookup", "ok")]
+    outputs = asyncio.run(agent._execute_tool_calls(blocks, CONTEXT, {}))
+
+    assert outputs[0].startswith("Tool error: lookup timed out")
+    assert outputs[1] == "Tool error: boom"
+    assert outputs[2] == "lookup ok"
@@ -0,0 +1,136 @@
+"""Recall of the approximate indexes and quantized scoring against exact search."""
+
+import asyncio
+
+import numpy as np
+
+from src.rag.hnsw import HNSWIndex
+from src.rag.ivf import IVFIndex
+from src.rag.matrix_index import MatrixIndex
+from src.rag.partition import Partition
+from src.rag.quantization import PQ_MIN_TRAIN_ROWS, get_codec
+
+from .conftest import random_unit_vectors
+
+DIMENSIONS = 32
+LIMIT = 10
+
+
+def _matrix(vectors: np.ndarray) -> MatrixIndex:
+    index = MatrixIndex()
+    for i, vector in enumerate(vectors):
+        index.add(f"d{i}", "text", vector, {})
+    return index
+
+
+def _recall(index: MatrixIndex, search, queries: np.ndarray) -> float:
+    """Mean overlap of `search(q)` with the exact top LIMIT rows."""
+    hits = 0
+    for q in queries:
+        exact, _ = index.search(q, limit=LIMIT)
+        approximate, _ = search(q)
+        hits += len(set(exact.tolist()) & set(approximate.tolist()))
+    return hits / (LIMIT * len(queries))
+
+
+def test_hnsw_recall_against_exact_search():
+    index = _matrix(random_unit_vectors(2000, DIMENSIONS))
+    graph = HNSWIndex(index, m=16, ef_construction=100, ef_search=128)
+    graph.build(index.size)
+
+    queries = random_unit_vectors(50, DIMENSIONS, seed=1)
+    assert _recall(index, lambda q: graph.search(q, limit=LIMIT), queries) >= 0.9
+
+
+def test_hnsw_visit_marks_survive_epoch_wraparound():
+    index = _matrix(random_unit_vectors(500, DIMENSIONS))
+    graph = HNSWIndex(index, m=8, ef_construction=50, ef_search=64)
+    graph.build(index.size)
+    queries = random_unit_vectors(5, DIMENSIONS, seed=1)
+    expected = [graph.search(q, limit=LIMIT)[0].tolist() for q in queries]
+
+    # Marks left by earlier searches must not count as visited after a wrap
+    graph._visit_epoch = np.iinfo(np.uint32).max - 2
+    assert [graph.search(q, limit=LIMIT)[0].tolist() for q in queries] == expected
+    assert graph._visit_epoch < 1000  # wrapped around
+
+
+def test_hnsw_skips_superseded_rows_and_round_trips(tmp_path):
+    vectors = random_unit_vectors(500, DIMENSIONS)
+    index = _matrix(vectors)
+    graph = HNSWIndex(index, m=8, ef_construction=64)
+    graph.build(index.size)
+
+    index.add("d3", "text", vectors[3], {})  # supersedes row 3
+    graph.catch_up()
+    rows, _ = graph.search(vectors[3], limit=1)
+    assert rows.tolist() == [500]
+
+    path = tmp_path / "graph.npz"
+    graph.save(path, generation=2)
+    assert HNSWIndex.load(path, index, generation=3) is None
+    loaded = HNSWIndex.load(path, index, generation=2)
+    assert loaded.size == graph.size
+    query = random_unit_vectors(1, DIMENSIONS, seed=5)[0]
+    np.testing.assert_array_equal(loaded.search(query, limit=LIMIT)[0], graph.search(query, limit=LIMIT)[0])
+
+
+def test_hnsw_remap_keeps_recall_after_rewrite():
+    vectors = random_unit_vectors(1500, DIMENSIONS)
+    index = _matrix(vectors)
+    graph = HNSWIndex(index, m=16, ef_construction=100, ef_search=128)
+    graph.build(index.size)
+
+    # A compaction rewrite drops every third row and renumbers the rest
+    keep = np.arange(index.size) % 3 != 0
+    mapping = np.where(keep, np.cumsum(keep) - 1, -1)
+    rewritten = _matrix(vectors[keep])
+    remapped = graph.remap(rewritten, mapping)
+
+    assert remapped.size == rewritten.size
+    queries = random_unit_vectors(50, DIMENSIONS, seed=1)
+    assert _recall(rewritten, lambda q: remapped.search(q, limit=LIMIT), queries) >= 0.9
+
+
+def test_ivf_recall_against_exact_search():
+    index = _matrix(random_unit_vectors(3000, DIMENSIONS, clusters=20))
+    ivf = IVFIndex(index, nlist=32, nprobe=8)
+    ivf.build(index.size)
+
+    queries = random_unit_vectors(50, DIMENSIONS, seed=1, clusters=20)
+    assert _recall(index, lambda q: ivf.search(q, limit=LIMIT), queries) >= 0.9
+    # Probing every list is exact
+    assert _recall(index, lambda q: ivf.search(q, limit=LIMIT, nprobe=32), queries) == 1.0
+
+
+def test_pq_scores_rank_like_exact_scores():
+    vectors = random_unit_vectors(PQ_MIN_TRAIN_ROWS, DIMENSIONS, clusters=20)
+    codec = get_codec("pq", DIMENSIONS, pq_subvectors=8)
+    codec.train(vectors)
+    codes = codec.encode(vectors)
+
+    hits = 0
+    queries = random_unit_vectors(20, DIMENSIONS, seed=1, clusters=20)
+    for q in queries:
+        exact = set(np.argsort(-(vectors @ q))[:LIMIT].tolist())
+        # Without rescoring, the true top 10 lies within the PQ top 100
+        approximate = set(np.argsort(-codec.scores(codes, q))[:100].tolist())
+        hits += len(exact & approximate)
+    assert hits / (LIMIT * len(queries)) >= 0.95
+
+
+def test_pq_partition_rescoring_matches_exact_search(config, tmp_path):
+    vectors = random_unit_vectors(PQ_MIN_TRAIN_ROWS, DIMENSIONS, clusters=20)
+    partition = Partition(1, tmp_path / "chat", quantization="pq", pq_subvectors=8, rescore=100)
+    partition.load()
+    for i, vector in enumerate(vectors):
+        partition.add(f"d{i}", "text", vector, {})
+    asyncio.run(partition.unload(dead_ratio=0.3))
+
+    partition = Partition(1, tmp_path / "chat", quantization="pq", pq_subvectors=8, rescore=100)
+    partition.load()
+    assert partition.store.codec is not None
+
+    exact = _matrix(vectors)
+    queries = random_unit_vectors(20, DIMENSIONS, seed=1, clusters=20)
+    assert _recall(exact, lambda q: partition.search(q, limit=LIMIT), queries) >= 0.95
@@ -0,0 +1,34 @@
+"""Session history windows."""
+
+import pytest
+
+from src.memory import database
+
+
+@pytest.fixture
+def session(config, monkeypatch):
+    """A fresh database with one session; returns its id."""
+    monkeypatch.setattr(database, "_connection", None)
+    database.init_database()
+    yield database.get_or_create_session(1, 1).id
+    database.close_database()
+
+
+def _contents(messages) -> list[str]:
+    return [m.content for m in messages]
+
+
+def test_window_advances_in_whole_steps(session):
+    for i in range(7):
+        database.add_message(session, "user", f"m{i}")
+    # Fewer than two windows: everything
+    assert _contents(database.get_session_window(session, size=4)) == [f"m{i}" for i in range(7)]
+
+    database.add_message(session, "user", "m7")
+    window = _contents(database.get_session_window(session, size=4))
+    assert window == ["m4", "m5", "m6", "m7"]
+
+    # The start stays put while the next messages arrive
+    for i in range(8, 11):
+        database.add_message(session, "user", f"m{i}")
+        assert _contents(database.get_session_window(session, size=4))[0] == "m4"
@@ -0,0 +1,98 @@
+"""The content-addressed embedding cache."""
+
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from src.rag import embedding_cache
+
+from .conftest import random_unit_vectors, reload_config
+
+DIMENSIONS = 8
+
+
+@pytest.fixture
+def cache(config, monkeypatch):
+    """The cache module with empty state, closed again after the test."""
+    monkeypatch.setattr(embedding_cache, "_memory", embedding_cache.OrderedDict())
+    monkeypatch.setattr(embedding_cache, "_connection", None)
+    monkeypatch.setattr(embedding_cache, "_disk_entries", 0)
+    monkeypatch.setattr(embedding_cache, "_touched", set())
+    monkeypatch.setattr(embedding_cache, "_stats", {"memory_hits": 0, "disk_hits": 0, "misses": 0})
+    yield embedding_cache
+    embedding_cache.close_embedding_cache()
+
+
+def _entries(count: int, start: int = 0) -> dict[str, list[float]]:
+    vectors = random_unit_vectors(count, DIMENSIONS, seed=start)
+    return {
+        embedding_cache.cache_key(f"text {start + i}", "model"): vector.tolist()
+        for i, vector in enumerate(vectors)
+    }
+
+
+def test_keys_depend_on_model_and_text():
+    key = embedding_cache.cache_key("hello", "model-a")
+    assert key == embedding_cache.cache_key("hello", "model-a")
+    assert key != embedding_cache.cache_key("hello", "model-b")
+    assert key != embedding_cache.cache_key("hello!", "model-a")
+
+
+def test_entries_survive_a_restart(cache):
+    entries = _entries(5)
+    keys = list(entries)
+
+    async def store_and_read():
+        await cache.store_cached(entries)
+        return await cache.get_cached(keys + ["missing"])
+
+    found = asyncio.run(store_and_read())
+    assert found.keys() == entries.keys()
+    assert cache.get_cache_stats()["memory_hits"] == 5
+
+    # A new process starts with an empty memory tier and reads from disk
+    cache.close_embedding_cache()
+    found = asyncio.run(cache.get_cached(keys))
+    for key in keys:
+        np.testing.assert_allclose(found[key], entries[key], rtol=1e-6)
+    stats = cache.get_cache_stats()
+    assert stats["disk_hits"] == 5
+    assert stats["misses"] == 1
+    assert stats["disk_entries"] == 5
+
+
+def test_disk_tier_evicts_least_recently_used(cache, monkeypatch):
+    reload_config(monkeypatch, RAG_EMBEDDING_CACHE_MEMORY_ENTRIES=1, RAG_EMBEDDING_CACHE_MAX_ENTRIES=10)
+    clock = itertools.count(1)
+    monkeypatch.setattr(cache, "time", SimpleNamespace(time=lambda: float(next(clock))))
+
+    first = _entries(5)
+
+    async def fill():
+        await cache.store_cached(first)
+        await cache.store_cached(_entries(5, start=5))
+        # Reading the first batch back makes it the most recently used
+        cache._memory.clear()
+        assert len(await cache.get_cached(list(first))) == 5
+        await cache.store_cached(_entries(3, start=10))
+
+    asyncio.run(fill())
+    assert cache.get_cache_stats()["disk_entries"] == 9
+
+    cache.close_embedding_cache()
+    assert asyncio.run(cache.get_cached(list(first))).keys() == first.keys()
+
+
+def test_disabled_cache_stores_nothing(cache, monkeypatch):
+    reload_config(monkeypatch, RAG_EMBEDDING_CACHE="false")
+    entries = _entries(3)
+
+    async def run():
+        await cache.store_cached(entries)
+        return await cache.get_cached(list(entries))
+
+    assert asyncio.run(run()) == {}
+    assert cache.get_cache_stats()["memory_entries"] == 0
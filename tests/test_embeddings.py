@@ -0,0 +1,173 @@
+"""Embedding backends, request coalescing, rate limits and retries."""
+
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.rag import embeddings
+from src.rag.embedding_backends import EmbeddingBackend, HashingBackend
+
+from .conftest import reload_config
+
+
+class _FakeBackend(EmbeddingBackend):
+    """Records every request; vectors encode the text length."""
+
+    model = "fake"
+    space = "fake"
+    dimensions = 2
+
+    def __init__(self, error: Exception = None):
+        self.calls: list[list[str]] = []
+        self.error = error
+        self.failures: list[Exception] = []  # raised by the next calls, in order
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        self.calls.append(list(texts))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        if self.failures:
+            raise self.failures.pop(0)
+        if self.error:
+            raise self.error
+        return [[float(len(t)), 1.0] for t in texts]
+
+    def is_retryable(self, error: Exception) -> bool:
+        return isinstance(error, ConnectionError)
+
+
+@pytest.fixture
+def api(config, monkeypatch):
+    """A fake embedding backend with coalescer state and the cache reset."""
+    reload_config(monkeypatch, RAG_EMBEDDING_CACHE="false", RAG_EMBEDDING_BATCH_WINDOW_MS=20)
+    fake = _FakeBackend()
+    monkeypatch.setattr(embeddings, "_configured", embeddings.EmbeddingSpec("fake", 2, "fake"))
+    monkeypatch.setattr(embeddings, "_backends", {("fake", 2): fake})
+    monkeypatch.setattr(embeddings, "_pending", {})
+    monkeypatch.setattr(embeddings, "_flush_handles", {})
+    monkeypatch.setattr(embeddings, "_batch_tasks", set())
+    monkeypatch.setattr(embeddings, "_request_limiter", None)
+    monkeypatch.setattr(embeddings, "_token_limiter", None)
+    monkeypatch.setattr(embeddings, "_batch_stats", {
+        "batches": 0,
+        "texts": 0,
+        "max_batch_size": 0,
+        "histogram": {bucket: 0 for bucket in embeddings._BATCH_BUCKETS},
+    })
+    return fake
+
+
+def test_concurrent_requests_share_one_batch(api):
+    texts = ["first message here", "second, longer message", "first message here", "third one, longest of all"]
+
+    async def run():
+        return await asyncio.gather(*(embeddings.create_embedding(text) for text in texts))
+
+    vectors = asyncio.run(run())
+
+    assert api.calls == [list(dict.fromkeys(texts))]  # one request, repeats sent once
+    assert [v[0] for v in vectors] == [float(len(t)) for t in texts]
+    stats = embeddings.get_embedding_stats()
+    assert stats["batches"] == 1
+    assert stats["max_batch_size"] == 3
+    assert stats["histogram"][4] == 1
+
+
+def test_zero_window_sends_each_request_alone(api, monkeypatch):
+    reload_config(monkeypatch, RAG_EMBEDDING_BATCH_WINDOW_MS=0)
+
+    async def run():
+        await asyncio.gather(*(embeddings.create_embedding(f"message number {i}") for i in range(3)))
+
+    asyncio.run(run())
+    assert len(api.calls) == 3
+    assert embeddings.get_embedding_stats()["batches"] == 0
+
+
+def test_batch_error_reaches_every_caller(api):
+    api.error = RuntimeError("rate limited")
+
+    async def run():
+        return await asyncio.gather(
+            *(embeddings.create_embedding(f"message number {i}") for i in range(3)),
+            return_exceptions=True,
+        )
+
+    results = asyncio.run(run())
+    assert len(api.calls) == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_token_bucket_waits_once_the_burst_is_spent():
+    bucket = embeddings._TokenBucket(per_minute=60000)  # 1000 per second
+
+    async def run():
+        await bucket.acquire(1000)  # the whole burst, at once
+        start = time.monotonic()
+        await bucket.acquire(100)
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.09
+
+
+def test_transient_errors_are_retried(api, monkeypatch):
+    reload_config(monkeypatch, RAG_EMBEDDING_MAX_RETRIES=2, RAG_EMBEDDING_RETRY_DELAY=0.001)
+    api.failures = [ConnectionError("reset"), ConnectionError("reset")]
+
+    vectors = asyncio.run(embeddings.create_embeddings(["a message to embed"]))
+    assert vectors == [[18.0, 1.0]]
+    assert len(api.calls) == 3
+
+    api.calls.clear()
+    api.failures = [ValueError("bad input")]
+    with pytest.raises(ValueError):
+        asyncio.run(embeddings.create_embeddings(["another message"]))
+    assert len(api.calls) == 1
+
+
+def test_batches_run_concurrently_and_report_progress(api, monkeypatch):
+    reload_config(monkeypatch, RAG_EMBEDDING_CONCURRENCY=2)
+    monkeypatch.setattr(embeddings, "MAX_BATCH_SIZE", 2)
+    texts = [f"message number {i}" for i in range(6)]
+    progress = []
+
+    vectors = asyncio.run(embeddings.create_embeddings(texts, on_progress=lambda done, total: progress.append(done)))
+
+    assert vectors == [[float(len(t)), 1.0] for t in texts]
+    assert len(api.calls) == 3
+    assert api.max_in_flight == 2
+    assert progress[0] == 0 and progress[-1] == 6
+    assert progress == sorted(progress)
+
+
+def test_hashing_backend_is_deterministic_and_normalized(config):
+    backend = HashingBackend(dimensions=256)
+    texts = ["the deploy failed again", "the deploy failed again today", "lunch at noon?"]
+
+    vectors = np.array(asyncio.run(backend.embed(texts)))
+    assert vectors.shape == (3, 256)
+    np.testing.assert_allclose(np.linalg.norm(vectors, axis=1), 1.0, rtol=1e-5)
+    np.testing.assert_array_equal(vectors, asyncio.run(backend.embed(texts)))
+    # Shared words and trigrams put related texts closer together
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+
+def test_hashing_backend_shuts_its_pool_down_off_the_event_loop(config):
+    class Pool:
+        def shutdown(self, wait, cancel_futures):
+            self.thread = threading.current_thread()
+
+    backend = HashingBackend(dimensions=256)
+    backend._pool = pool = Pool()
+    asyncio.run(backend.close())
+    assert pool.thread is not threading.main_thread()
+    assert backend._pool is None
@@ -0,0 +1,189 @@
+"""Indexing queue overflow policies and the spill file."""
+
+import asyncio
+
+import pytest
+
+from src.rag import indexer
+
+from .conftest import reload_config
+
+
+@pytest.fixture
+def queue(config, monkeypatch):
+    """Reset indexer state; returns a helper that installs a bounded queue."""
+    monkeypatch.setattr(indexer, "_queue", None)
+    monkeypatch.setattr(indexer, "_spilled", 0)
+    monkeypatch.setattr(indexer, "_spill_lock", asyncio.Lock())
+    monkeypatch.setattr(indexer, "_spill_wakeup", asyncio.Event())
+    monkeypatch.setattr(indexer, "_in_flight", {})
+    monkeypatch.setattr(indexer, "_stats", {"indexed": 0, "skipped": 0, "failed": 0, "dropped": 0})
+
+    def install(maxsize: int) -> asyncio.Queue:
+        monkeypatch.setattr(indexer, "_queue", asyncio.Queue(maxsize=maxsize))
+        return indexer._queue
+
+    return install
+
+
+async def _enqueue(count: int, start: int = 0) -> list[bool]:
+    return [
+        await indexer.enqueue_message(i, 1, 2, "user", f"message {i}")
+        for i in range(start, start + count)
+    ]
+
+
+def _drain(queue: asyncio.Queue) -> list[int]:
+    ids = []
+    while not queue.empty():
+        ids.append(queue.get_nowait().message_id)
+        queue.task_done()
+    return ids
+
+
+def test_spill_keeps_order_across_refills(queue):
+    async def run():
+        q = queue(3)
+        assert all(await _enqueue(10))
+        assert indexer._spilled == 7
+
+        order = _drain(q)
+        # New messages queue behind the spilled ones
+        await _enqueue(2, start=10)
+        assert q.empty()
+        while indexer._spilled:
+            await indexer._refill_from_spill()
+            order += _drain(q)
+        return order
+
+    assert asyncio.run(run()) == list(range(12))
+    assert not indexer._spill_path().exists()
+    assert not indexer._spill_offset_path().exists()
+
+
+def test_partially_drained_spill_survives_restart(queue):
+    async def run():
+        q = queue(4)
+        await _enqueue(10)
+        _drain(q)
+        await indexer._refill_from_spill()
+        return _drain(q)
+
+    assert asyncio.run(run()) == [4, 5, 6, 7]
+    # Only the unread tail is counted (and re-read) after a restart
+    assert indexer._count_spilled() == 2
+
+    async def resume():
+        q = queue(4)
+        indexer._spilled = indexer._count_spilled()
+        await indexer._refill_from_spill()
+        return _drain(q)
+
+    assert asyncio.run(resume()) == [8, 9]
+
+
+def test_spill_file_is_compacted_once_mostly_consumed(queue, monkeypatch):
+    monkeypatch.setattr(indexer, "_SPILL_COMPACT_BYTES", 1)
+
+    async def run():
+        q = queue(3)
+        await _enqueue(10)
+        _drain(q)
+        await indexer._refill_from_spill()
+        await indexer._refill_from_spill()  # queue is still full: no-op
+        _drain(q)
+        await indexer._refill_from_spill()
+        return _drain(q)
+
+    assert asyncio.run(run()) == [6, 7, 8]
+    # The consumed head was cut off: one line left, read from the start
+    path = indexer._spill_path()
+    assert len(path.read_bytes().splitlines()) == 1
+    assert indexer._read_spill_offset(path) == 0
+    assert indexer._count_spilled() == 1
+
+
+def _record_indexed(monkeypatch) -> list[int]:
+    indexed = []
+
+    async def index_jobs(jobs):
+        indexed.extend(job.message_id for job in jobs)
+        return len(jobs)
+
+    monkeypatch.setattr(indexer, "index_jobs", index_jobs)
+    return indexed
+
+
+async def _wait_for(condition, timeout: float = 2.0) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_idle_workers_wake_up_when_messages_spill(queue, monkeypatch):
+    indexed = _record_indexed(monkeypatch)
+
+    async def run():
+        queue(3)
+        workers = [asyncio.create_task(indexer._worker(n)) for n in range(2)]
+        await asyncio.sleep(0)  # both block on the empty queue
+        # E.g. messages left over by a stop: later ones spill behind them
+        await indexer._spill([indexer.IndexJob(i, 1, 2, "user", f"message {i}") for i in range(4)])
+        await _enqueue(2, start=4)
+        await _wait_for(lambda: len(indexed) == 6)
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    asyncio.run(run())
+    assert sorted(indexed) == list(range(6))
+    assert indexer._spilled == 0
+
+
+def test_failed_refill_is_retried_while_idle(queue, monkeypatch):
+    monkeypatch.setattr(indexer, "_SPILL_RETRY_INTERVAL", 0.01)
+    indexed = _record_indexed(monkeypatch)
+    read_offset = indexer._read_spill_offset
+    failures = []
+
+    def flaky_read_offset(path):
+        if not failures:
+            failures.append(path)
+            raise OSError("disk hiccup")
+        return read_offset(path)
+
+    monkeypatch.setattr(indexer, "_read_spill_offset", flaky_read_offset)
+
+    async def run():
+        queue(3)
+        await indexer._spill([indexer.IndexJob(i, 1, 2, "user", f"message {i}") for i in range(2)])
+        worker = asyncio.create_task(indexer._worker(0))
+        await _wait_for(lambda: len(indexed) == 2)
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+    asyncio.run(run())
+    assert failures and indexed == [0, 1]
+
+
+@pytest.mark.parametrize(
+    ("policy", "queued", "accepted"),
+    [
+        ("drop_newest", [0, 1, 2], [True] * 3 + [False] * 2),
+        ("drop_oldest", [2, 3, 4], [True] * 5),
+    ],
+)
+def test_drop_policies(queue, monkeypatch, policy, queued, accepted):
+    reload_config(monkeypatch, RAG_INDEX_QUEUE_POLICY=policy)
+
+    async def run():
+        q = queue(3)
+        results = await _enqueue(5)
+        return results, _drain(q)
+
+    results, order = asyncio.run(run())
+    assert results == accepted
+    assert order == queued
+    assert indexer._stats["dropped"] == 2
+    assert not indexer._spill_path().exists()
@@ -0,0 +1,76 @@
+"""Exact search over the embedding matrix."""
+
+import numpy as np
+
+from src.rag.matrix_index import MatrixIndex, top_k
+
+from .conftest import random_unit_vectors
+
+DIMENSIONS = 16
+
+
+def test_top_k_returns_best_first():
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3], dtype=np.float32)
+    assert top_k(scores, 3).tolist() == [1, 3, 2]
+    assert top_k(scores, 10).tolist() == [1, 3, 2, 4, 0]
+    assert top_k(scores, 0).shape == (0,)
+
+
+def test_search_matches_brute_force_across_growth():
+    vectors = random_unit_vectors(3000, DIMENSIONS)  # past the initial capacity
+    index = MatrixIndex()
+    for i, vector in enumerate(vectors):
+        index.add(f"d{i}", "text", vector * 3, {})  # stored normalized
+
+    query = random_unit_vectors(1, DIMENSIONS, seed=1)[0]
+    rows, scores = index.search(query, limit=10)
+    expected = np.argsort(-(vectors @ query))[:10]
+    assert rows.tolist() == expected.tolist()
+    np.testing.assert_allclose(scores, (vectors @ query)[expected], rtol=1e-5)
+
+
+def test_readding_an_id_supersedes_its_row():
+    vectors = random_unit_vectors(3, DIMENSIONS)
+    index = MatrixIndex()
+    index.add("a", "old", vectors[0], {})
+    index.add("b", "text", vectors[1], {})
+    row = index.add("a", "new", vectors[2], {})
+
+    assert len(index) == 2 and index.size == 3
+    rows, _ = index.search(vectors[0], limit=3)
+    assert 0 not in rows.tolist()
+    assert index.document(row) == ("a", "new", {})
+
+    assert index.remove("b")
+    assert not index.remove("b")
+    assert index.search(vectors[1], limit=3)[0].tolist() == [row]
+
+
+def test_search_filters_by_chat_and_user():
+    vectors = random_unit_vectors(6, DIMENSIONS)
+    index = MatrixIndex()
+    for i, vector in enumerate(vectors):
+        index.add(f"d{i}", "text", vector, {"chat_id": 100 + i % 2, "user_id": i % 3})
+
+    rows, _ = index.search(vectors[0], limit=10, chat_id=101)
+    assert sorted(rows.tolist()) == [1, 3, 5]
+    rows, _ = index.search(vectors[0], limit=10, chat_id=100, user_id=2)
+    assert rows.tolist() == [2]
+
+
+def test_search_many_matches_single_searches():
+    vectors = random_unit_vectors(200, DIMENSIONS)
+    index = MatrixIndex(partition_by_user=True)
+    for i, vector in enumerate(vectors):
+        index.add(f"d{i}", "text", vector, {"chat_id": 100 + i % 2, "user_id": i % 3})
+
+    queries = random_unit_vectors(4, DIMENSIONS, seed=1)
+    limits = [5, 10, 3, 7]
+    chat_ids = [None, 101, None, 100]
+    user_ids = [None, None, 2, 1]
+    batched = index.search_many(queries, limits, chat_ids, user_ids)
+
+    for q, limit, chat_id, user_id, (rows, scores) in zip(queries, limits, chat_ids, user_ids, batched):
+        expected_rows, expected_scores = index.search(q, limit=limit, chat_id=chat_id, user_id=user_id)
+        assert rows.tolist() == expected_rows.tolist()
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
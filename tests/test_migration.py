@@ -0,0 +1,113 @@
+"""Online migration to a new embedding version."""
+
+import asyncio
+
+import pytest
+
+from src.rag import embeddings, migration
+from src.rag.indexer import IndexJob, index_jobs
+
+from .conftest import random_unit_vectors, reload_config, reopen_vectorstore
+
+
+def _jobs(start: int, count: int) -> list[IndexJob]:
+    return [
+        IndexJob(i, 100 + i % 3, 1, "user", f"message number {i} about topic {i % 5}")
+        for i in range(start, start + count)
+    ]
+
+
+def test_migration_promotes_new_dimensions(vectorstore, monkeypatch):
+    async def index():
+        assert await index_jobs(_jobs(0, 30)) == 30
+        await vectorstore.close_vectorstore()
+
+    asyncio.run(index())
+    old = migration.active_spec()
+
+    reload_config(monkeypatch, RAG_EMBEDDING_DIMENSIONS=256)
+    reopen_vectorstore(vectorstore)
+    target = embeddings.configured_spec()
+    assert target.version != old.version
+
+    async def migrate():
+        state = await migration.run_migration()
+        count = await vectorstore.get_document_count()
+        await vectorstore.close_vectorstore()
+        return state, count
+
+    state, count = asyncio.run(migrate())
+    assert state["promoted"]
+    assert state["migrated"] == 30
+    assert state["chats_total"] == 3
+    assert count == 30
+
+    # The promoted index is the active one after a restart
+    reopen_vectorstore(vectorstore)
+    versions = vectorstore.get_embedding_versions()
+    assert versions["active"]["version"] == target.version
+    assert versions["shadow"] is None
+    partition = vectorstore._partitions[100]
+    partition.load()
+    assert partition.index.dimensions == 256
+
+
+def test_promotion_catches_up_with_live_writes(vectorstore, monkeypatch):
+    async def index():
+        await index_jobs(_jobs(0, 12))
+        await vectorstore.close_vectorstore()
+
+    asyncio.run(index())
+    reload_config(monkeypatch, RAG_EMBEDDING_DIMENSIONS=256)
+    reopen_vectorstore(vectorstore)
+    target = embeddings.configured_spec()
+
+    async def migrate():
+        await vectorstore.begin_shadow(target.version, target.backend, target.dimensions)
+        # Written to both versions while the shadow index exists
+        assert await index_jobs(_jobs(12, 3)) == 3
+        state = await migration.run_migration()
+        count = await vectorstore.get_document_count()
+        await vectorstore.close_vectorstore()
+        return state, count
+
+    state, count = asyncio.run(migrate())
+    assert state["promoted"]
+    assert state["migrated"] == 12
+    assert count == 15
+
+
+def test_migration_to_the_active_version_is_a_no_op(vectorstore):
+    async def run():
+        await index_jobs(_jobs(0, 6))
+        state = await migration.run_migration()
+        await vectorstore.close_vectorstore()
+        return state
+
+    state = asyncio.run(run())
+    assert not state["promoted"]
+    assert state["migrated"] == 0
+    assert vectorstore.get_embedding_versions()["shadow"] is None
+
+
+def test_unknown_embedding_versions_reject_the_whole_batch(vectorstore):
+    from src.rag.vectorstore import Document
+
+    async def run():
+        await index_jobs(_jobs(0, 3))
+        active = migration.active_spec()
+        vectors = random_unit_vectors(3, active.dimensions)
+        documents = [
+            Document(id=f"d{i}", text="text", embedding=vector.tolist(), metadata={"chat_id": 100},
+                     embedding_version=version)
+            for i, (vector, version) in enumerate(zip(vectors, [active.version, "model-a+p1", "model-b+p1"]))
+        ]
+        with pytest.raises(ValueError) as error:
+            await vectorstore.add_documents(documents)
+        count = await vectorstore.get_document_count()
+        await vectorstore.close_vectorstore()
+        return str(error.value), count
+
+    message, count = asyncio.run(run())
+    assert "model-a+p1" in message and "model-b+p1" in message
+    assert count == 3
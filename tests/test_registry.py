@@ -0,0 +1,74 @@
+"""Tool dispatch, the cached catalog and per-tool statistics."""
+
+import asyncio
+
+import pytest
+
+from src.tools import registry
+
+
+@pytest.fixture
+def tools(monkeypatch):
+    """An empty registry (the agent's registrations are restored afterwards)."""
+    monkeypatch.setattr(registry, "_tools", {})
+    monkeypatch.setattr(registry, "_groups", {})
+    monkeypatch.setattr(registry, "_catalog", None)
+    return registry
+
+
+def _tool(name: str, result: str = "ok", error: Exception = None):
+    async def handler(args, context):
+        if error:
+            raise error
+        return f"{result} {args.get('x', '')}".strip()
+
+    return {"name": name, "description": name, "input_schema": {"type": "object"}}, handler
+
+
+def test_dispatch_runs_the_registered_handler(tools):
+    tools.set_tool_group("builtin", [_tool("echo", "echoed")])
+
+    assert asyncio.run(tools.dispatch("echo", {"x": 1})) == "echoed 1"
+    assert asyncio.run(tools.dispatch("missing", {})) == "Unknown tool: missing"
+    assert tools.has_tool("echo") and not tools.has_tool("missing")
+
+
+def test_catalog_is_cached_until_a_group_changes(tools):
+    tools.set_tool_group("builtin", [_tool("a"), _tool("b")])
+    tools.set_tool_group("mcp:github", [_tool("c")])
+
+    catalog = tools.get_catalog()
+    assert [schema["name"] for schema in catalog] == ["a", "b", "c"]
+    assert tools.get_catalog() is catalog
+
+    # A reconnecting server replaces its group; a later group can take over a name
+    tools.set_tool_group("mcp:github", [_tool("d")])
+    tools.set_tool_group("mcp:notion", [_tool("a")])
+    assert [schema["name"] for schema in tools.get_catalog()] == ["b", "d", "a"]
+
+    tools.remove_tool_group("mcp:github")
+    assert [schema["name"] for schema in tools.get_catalog()] == ["b", "a"]
+    assert not tools.has_tool("d")
+
+
+def test_stats_count_calls_and_errors(tools):
+    tools.set_tool_group("builtin", [_tool("good"), _tool("bad", error=RuntimeError("boom")), _tool("unused")])
+
+    asyncio.run(tools.dispatch("good", {}))
+    asyncio.run(tools.dispatch("good", {}))
+    with pytest.raises(RuntimeError):
+        asyncio.run(tools.dispatch("bad", {}))
+
+    stats = tools.get_tool_stats()
+    assert set(stats) == {"good", "bad"}
+    assert stats["good"]["calls"] == 2 and stats["good"]["errors"] == 0
+    assert stats["bad"] == {**stats["bad"], "calls": 1, "errors": 1}
+    assert stats["good"]["max_ms"] >= stats["good"]["avg_ms"]
+
+
+def test_agent_registers_a_handler_for_every_tool():
+    from src.agents import agent
+
+    names = [schema["name"] for schema in agent.BUILT_IN_TOOLS + agent.TELEGRAM_TOOLS]
+    assert all(registry.has_tool(name) for name in names)
+    assert [schema["name"] for schema in registry.get_catalog()][:len(names)] == names
@@ -0,0 +1,100 @@
+"""Invalidation and expiry of cached retrieval results."""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from src.rag import result_cache
+
+from .conftest import random_unit_vectors, reload_config
+
+
+@pytest.fixture
+def cache(config, monkeypatch):
+    """The result cache with empty state."""
+    monkeypatch.setattr(result_cache, "_entries", result_cache.OrderedDict())
+    monkeypatch.setattr(result_cache, "_chat_generations", {})
+    monkeypatch.setattr(result_cache, "_write_generation", 0)
+    monkeypatch.setattr(result_cache, "_pruned_generation", 0)
+    monkeypatch.setattr(result_cache, "_epoch", 0)
+    monkeypatch.setattr(result_cache, "_stats", {"hits": 0, "misses": 0, "invalidations": 0})
+    return result_cache
+
+
+def _cached(cache, query: str, chat_id=None) -> tuple:
+    key = cache.make_key(query, chat_id, None, 10, 0.3, "semantic")
+    cache.put(key, cache.generation(key), f"response to {query}")
+    return key
+
+
+def test_writes_invalidate_only_their_chat(cache):
+    chat_one = _cached(cache, "deploy status", chat_id=1)
+    chat_two = _cached(cache, "deploy status", chat_id=2)
+    every_chat = _cached(cache, "deploy status")
+    assert cache.get(cache.make_key("  deploy   status ", 1, None, 10, 0.3, "semantic")) is not None
+
+    cache.invalidate_chats({1})
+
+    assert cache.get(chat_one) is None
+    assert cache.get(chat_two) == "response to deploy status"
+    # Searches over every chat depend on every write
+    assert cache.get(every_chat) is None
+
+
+def test_results_computed_during_a_write_are_not_cached(cache):
+    key = cache.make_key("release notes", 1, None, 10, 0.3, "semantic")
+    generation = cache.generation(key)
+    cache.invalidate_chats({1})  # lands while the search runs
+    cache.put(key, generation, "stale")
+    assert cache.get(key) is None
+
+
+def test_entries_expire_and_stay_bounded(cache, monkeypatch):
+    reload_config(monkeypatch, RAG_RESULT_CACHE_SIZE=2, RAG_RESULT_CACHE_TTL=10)
+    now = [0.0]
+    monkeypatch.setattr(cache, "time", SimpleNamespace(monotonic=lambda: now[0]))
+
+    first = _cached(cache, "first", chat_id=1)
+    second = _cached(cache, "second", chat_id=1)
+    _cached(cache, "third", chat_id=1)  # evicts the least recently used
+    assert cache.get_result_cache_stats()["entries"] == 2
+    assert cache.get(first) is None
+    assert cache.get(second) == "response to second"
+
+    now[0] = 10.0
+    assert cache.get(second) is None
+
+
+def test_chat_generations_stay_bounded(cache, monkeypatch):
+    reload_config(monkeypatch, RAG_RESULT_CACHE_SIZE=4)
+    written = _cached(cache, "written", chat_id=1)
+    unwritten = _cached(cache, "unwritten", chat_id=2)
+    in_flight = cache.make_key("in flight", 3, None, 10, 0.3, "semantic")
+    generation = cache.generation(in_flight)
+
+    cache.invalidate_chats({1})
+    written = _cached(cache, "written", chat_id=1)
+    for chat_id in range(3, 1000):
+        cache.invalidate_chats({chat_id})
+
+    assert len(cache._chat_generations) <= 64
+    # Pruning keeps cached entries, and still refuses results from before a write
+    assert cache.get(written) == "response to written"
+    assert cache.get(unwritten) == "response to unwritten"
+    cache.put(in_flight, generation, "stale")
+    assert cache.get(in_flight) is None
+
+
+def test_vector_store_writes_invalidate_the_cache(vectorstore):
+    from src.rag.vectorstore import Document
+
+    key = _cached(result_cache, "what changed", chat_id=5)
+    vector = random_unit_vectors(1, 16)[0].tolist()
+
+    async def write():
+        await vectorstore.add_documents([Document(id="d", text="text", embedding=vector, metadata={"chat_id": 5})])
+        await vectorstore.close_vectorstore()
+
+    asyncio.run(write())
+    assert result_cache.get(key) is None
@@ -0,0 +1,46 @@
+"""Query routing and rank fusion."""
+
+import pytest
+
+from src.rag.retriever import _reciprocal_rank_fusion, is_keyword_query
+from src.rag.vectorstore import SearchResult
+
+
+def _results(*ids: str) -> list[SearchResult]:
+    return [SearchResult(id=doc_id, text=doc_id, score=1.0, metadata={}) for doc_id in ids]
+
+
+def test_rrf_rewards_agreement_between_rankings(config):
+    fused = _reciprocal_rank_fusion([_results("a", "b", "c"), _results("c", "d", "b")])
+
+    assert [r.id for r in fused] == ["c", "b", "a", "d"]
+    k = config.rag.rrf_k
+    assert fused[0].score == pytest.approx(1 / (k + 3) + 1 / (k + 1))
+    assert fused[2].score == pytest.approx(1 / (k + 1))
+
+
+def test_rrf_keeps_single_ranking_order(config):
+    fused = _reciprocal_rank_fusion([_results("x", "y", "z"), []])
+    assert [r.id for r in fused] == ["x", "y", "z"]
+
+
+@pytest.mark.parametrize(
+    "query",
+    ["#1234", "@alice", "ECONNREFUSED", "E1234 crash", "user_id", "v1.2", "src/main.py", "handler()", "getUserName"],
+)
+def test_identifier_queries_are_keyword_queries(query):
+    assert is_keyword_query(query)
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "deploy failed",
+        "what is ECONNREFUSED",
+        "why did #1234 break?",
+        "who mentioned the release notes for v1.2 last week",
+        "",
+    ],
+)
+def test_ordinary_queries_keep_semantic_search(query):
+    assert not is_keyword_query(query)
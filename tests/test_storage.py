@@ -0,0 +1,205 @@
+"""Snapshot, write-ahead log and partition crash recovery."""
+
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+from src.rag.partition import Partition
+from src.rag.storage import SnapshotStore
+from src.rag.wal import WriteAheadLog
+
+from .conftest import random_unit_vectors, reopen_vectorstore
+
+DIMENSIONS = 16
+
+
+def _fill(partition: Partition, vectors: np.ndarray, prefix: str = "doc") -> None:
+    for i, vector in enumerate(vectors):
+        partition.add(f"{prefix}-{i}", f"text {i}", vector, {"row": i})
+
+
+def test_snapshot_truncates_uncommitted_tail(tmp_path):
+    vectors = random_unit_vectors(10, DIMENSIONS)
+    store = SnapshotStore(tmp_path)
+    store.append(vectors, [f"d{i}" for i in range(10)], ["t"] * 10, [{}] * 10, applied_lsn=10)
+
+    # An append that died before its manifest was written
+    with open(store.vectors_path, "ab") as f:
+        f.write(b"\x00" * 64)
+    with open(store.documents_path, "ab") as f:
+        f.write(b'{"id": "torn"')
+
+    reopened = SnapshotStore(tmp_path)
+    snapshot = reopened.load()
+    assert snapshot.ids == [f"d{i}" for i in range(10)]
+    assert reopened.applied_lsn == 10
+    np.testing.assert_allclose(snapshot.vectors, vectors)
+
+
+def test_snapshot_rewrite_replaces_the_previous_generation(tmp_path):
+    vectors = random_unit_vectors(6, DIMENSIONS)
+    store = SnapshotStore(tmp_path)
+    store.append(vectors[:4], ["a", "b", "c", "d"], ["t"] * 4, [{}] * 4)
+    old_files = {store.vectors_path, store.documents_path}
+
+    store.rewrite(vectors[4:], ["e", "f"], ["t"] * 2, [{"n": 1}] * 2)
+
+    assert not any(path.exists() for path in old_files)
+    snapshot = SnapshotStore(tmp_path).load()
+    assert snapshot.ids == ["e", "f"]
+    assert snapshot.metadata == [{"n": 1}] * 2
+    np.testing.assert_allclose(snapshot.vectors, vectors[4:])
+
+
+def test_wal_replay_stops_at_torn_record(tmp_path):
+    wal = WriteAheadLog(tmp_path)
+    vectors = random_unit_vectors(3, DIMENSIONS)
+    for i, vector in enumerate(vectors):
+        wal.append(f"d{i}", "text", {"i": i}, vector)
+    wal.close()
+
+    segment = wal.segments()[-1]
+    os.truncate(segment, segment.stat().st_size - 5)
+
+    records = list(WriteAheadLog(tmp_path).replay())
+    assert [r.doc_id for r in records] == ["d0", "d1"]
+    np.testing.assert_allclose(records[1].vector, vectors[1])
+    # The torn tail was cut away, so a second replay sees the same log
+    assert [r.doc_id for r in WriteAheadLog(tmp_path).replay()] == ["d0", "d1"]
+
+
+def test_wal_replay_skips_applied_records(tmp_path):
+    wal = WriteAheadLog(tmp_path)
+    for i, vector in enumerate(random_unit_vectors(5, DIMENSIONS)):
+        wal.append(f"d{i}", "text", {}, vector)
+    wal.close()
+
+    replayed = WriteAheadLog(tmp_path)
+    assert [r.lsn for r in replayed.replay(after_lsn=3)] == [4, 5]
+    assert replayed.next_lsn == 6
+    assert WriteAheadLog(tmp_path).logged_ids(after_lsn=3) == {"d3", "d4"}
+
+
+def test_partition_recovers_uncompacted_rows(config, tmp_path):
+    vectors = random_unit_vectors(20, DIMENSIONS)
+    partition = Partition(1, tmp_path / "chat")
+    partition.load()
+    _fill(partition, vectors)
+    partition.wal.sync()
+    # Crash: nothing was compacted and the partition is never closed
+
+    recovered = Partition(1, tmp_path / "chat")
+    recovered.load()
+    assert len(recovered) == 20
+    rows, _ = recovered.search(vectors[7], limit=1)
+    assert recovered.index.document(int(rows[0]))[0] == "doc-7"
+
+
+def test_compaction_appends_then_replays_only_newer_rows(config, tmp_path):
+    vectors = random_unit_vectors(30, DIMENSIONS)
+    partition = Partition(1, tmp_path / "chat")
+    partition.load()
+    _fill(partition, vectors[:20])
+    asyncio.run(partition.compact(dead_ratio=0.3))
+
+    assert partition.store.count == 20
+    assert partition.pending_rows == 0
+    assert len(partition.wal.segments()) == 0
+
+    for i in range(20, 30):
+        partition.add(f"doc-{i}", f"text {i}", vectors[i], {"row": i})
+    partition.wal.sync()
+
+    recovered = Partition(1, tmp_path / "chat")
+    recovered.load()
+    assert len(recovered) == 30
+    assert recovered.compacted_rows == 20
+    assert recovered.pending_rows == 10
+
+
+def test_compaction_rewrites_when_too_many_rows_are_dead(config, tmp_path):
+    vectors = random_unit_vectors(10, DIMENSIONS)
+    partition = Partition(1, tmp_path / "chat")
+    partition.load()
+    _fill(partition, vectors)
+    asyncio.run(partition.compact(dead_ratio=0.3))
+    generation = partition.store.generation
+
+    # Re-adding an id supersedes its earlier row
+    _fill(partition, vectors[:5][::-1])
+    assert partition.index.size == 15 and len(partition) == 10
+    asyncio.run(partition.compact(dead_ratio=0.3))
+
+    assert partition.store.generation == generation + 1
+    assert partition.store.count == 10
+    assert partition.index.size == 10
+
+    recovered = Partition(1, tmp_path / "chat")
+    recovered.load()
+    assert len(recovered) == 10
+    rows, _ = recovered.search(vectors[4], limit=1)
+    assert recovered.index.document(int(rows[0]))[0] == "doc-0"
+
+
+def test_shrink_truncates_stored_embeddings(config, tmp_path):
+    vectors = random_unit_vectors(20, DIMENSIONS)
+    partition = Partition(1, tmp_path / "chat")
+    partition.load()
+    _fill(partition, vectors)
+    assert asyncio.run(partition.shrink(8))
+    assert not asyncio.run(partition.shrink(8))
+    asyncio.run(partition.unload(dead_ratio=0.3))
+
+    shrunk = Partition(1, tmp_path / "chat")
+    shrunk.load()
+    assert shrunk.index.dimensions == 8
+    # Full-width embeddings are cut down to the partition's width
+    shrunk.add("wide", "text", random_unit_vectors(1, DIMENSIONS, seed=3)[0], {})
+    rows, _ = shrunk.search(vectors[7], limit=1)
+    assert shrunk.index.document(int(rows[0]))[0] == "doc-7"
+    with pytest.raises(ValueError):
+        shrunk.add("narrow", "text", vectors[0][:4], {})
+
+
+def test_stored_count_of_unloaded_partition(config, tmp_path):
+    vectors = random_unit_vectors(12, DIMENSIONS)
+    partition = Partition(1, tmp_path / "chat")
+    partition.load()
+    _fill(partition, vectors[:10])
+    _fill(partition, vectors[:3])  # three superseded rows
+    asyncio.run(partition.unload(dead_ratio=0.9))
+
+    unloaded = Partition(1, tmp_path / "chat")
+    assert unloaded.stored_count() == 10
+
+    # Rows still only in the log are counted too
+    unloaded.load()
+    unloaded.add("new", "text", vectors[11], {})
+    unloaded.wal.close()
+    assert Partition(1, tmp_path / "chat").stored_count() == 11
+
+
+def test_document_count_survives_restart(vectorstore):
+    from src.rag.vectorstore import Document
+
+    vectors = random_unit_vectors(8, DIMENSIONS)
+    documents = [
+        Document(id=f"d{i}", text="text", embedding=vectors[i].tolist(), metadata={"chat_id": 1 + i % 2})
+        for i in range(8)
+    ]
+
+    async def write():
+        vectorstore.init_vectorstore()
+        await vectorstore.add_documents(documents)
+        await vectorstore.add_documents(documents[:2])  # re-indexed, not new
+        assert await vectorstore.get_document_count() == 8
+        await vectorstore.close_vectorstore()
+
+    asyncio.run(write())
+
+    # A fresh process discovers the partitions without loading them
+    reopen_vectorstore(vectorstore)
+    assert not any(p.loaded for p in vectorstore._partitions.values())
+    assert asyncio.run(vectorstore.get_document_count()) == 8
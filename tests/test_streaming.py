@@ -0,0 +1,140 @@
+"""Message splitting and the streaming reply's edits."""
+
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+
+from src.bot import streaming
+from src.bot.streaming import CURSOR, StreamingReply, split_message
+from src.tools.telegram_actions import TelegramMessage
+
+from .conftest import reload_config
+
+
+def test_split_message_prefers_line_breaks():
+    text = "a" * 30 + "\n" + "b" * 30 + "\n" + "c" * 5
+    assert split_message(text, limit=40) == ["a" * 30, "b" * 30 + "\n" + "c" * 5]
+
+
+def test_split_message_cuts_long_lines_at_the_limit():
+    chunks = split_message("x" * 95, limit=40)
+    assert chunks == ["x" * 40, "x" * 40, "x" * 15]
+
+
+def test_split_message_chunks_are_stable_as_text_grows():
+    text = "\n".join(f"line {i}" for i in range(200))
+    for end in range(100, len(text), 97):
+        chunks = split_message(text[:end], limit=120)
+        assert chunks[:-1] == split_message(text, limit=120)[:len(chunks) - 1]
+
+
+class FakeTelegram:
+    """Records sends and edits; can answer one call with a flood-control error."""
+
+    def __init__(self):
+        self.messages: dict[int, tuple[str, str]] = {}
+        self.sent: list[int] = []
+        self.flood_until = 0.0
+        self.flood_next = 0.0
+
+    def _flooded(self) -> bool:
+        if self.flood_next:
+            self.flood_until = time.monotonic() + self.flood_next
+            self.flood_next = 0.0
+            return True
+        return False
+
+    async def send_message(self, chat_id, text, reply_to_message_id=None, parse_mode="Markdown"):
+        if self._flooded():
+            return None
+        message_id = len(self.sent) + 1
+        self.sent.append(message_id)
+        self.messages[message_id] = (text, parse_mode)
+        return TelegramMessage(message_id, chat_id, None, text, datetime.now())
+
+    async def edit_message(self, chat_id, message_id, text, parse_mode="Markdown"):
+        if self._flooded():
+            return False
+        self.messages[message_id] = (text, parse_mode)
+        return True
+
+    def flood_wait(self, chat_id) -> float:
+        return max(0.0, self.flood_until - time.monotonic())
+
+    def texts(self) -> list[str]:
+        return [self.messages[i][0] for i in self.sent]
+
+
+@pytest.fixture
+def telegram(config, monkeypatch):
+    reload_config(monkeypatch, TELEGRAM_STREAM_EDIT_INTERVAL=0.01, TELEGRAM_STREAM_GROUP_EDIT_INTERVAL=0.01)
+    fake = FakeTelegram()
+    monkeypatch.setattr(streaming, "send_message", fake.send_message)
+    monkeypatch.setattr(streaming, "edit_message", fake.edit_message)
+    monkeypatch.setattr(streaming, "flood_wait", fake.flood_wait)
+    monkeypatch.setattr(streaming, "split_message", lambda text: split_message(text, limit=50))
+    return fake
+
+
+def test_streaming_reply_edits_then_finishes_with_markdown(telegram):
+    async def run():
+        reply = StreamingReply(1)
+        reply.append("Hello")
+        await asyncio.sleep(0.05)
+        assert telegram.texts() == ["Hello" + CURSOR]
+        reply.append(" *world*")
+        await reply.finish()
+
+    asyncio.run(run())
+    assert telegram.messages[1] == ("Hello *world*", "Markdown")
+
+
+def test_streaming_reply_rolls_over_into_new_messages(telegram):
+    lines = [f"line {i:02d} " + "x" * 20 for i in range(6)]
+
+    async def run():
+        reply = StreamingReply(1, group=True)
+        for line in lines:
+            reply.append(line + "\n")
+            await asyncio.sleep(0.02)
+        await reply.finish()
+
+    asyncio.run(run())
+    assert telegram.texts() == split_message("\n".join(lines) + "\n", limit=50)
+
+
+def test_streaming_reply_waits_out_flood_control(telegram):
+    async def run():
+        reply = StreamingReply(1)
+        reply.append("partial")
+        await asyncio.sleep(0.05)
+        reply.append(" and the rest")
+        telegram.flood_next = 0.1  # the final edit is refused once
+        await reply.finish()
+
+    asyncio.run(run())
+    assert telegram.texts() == ["partial and the rest"]
+
+
+def test_streaming_reply_sends_fallback_when_nothing_streamed(telegram):
+    async def run():
+        reply = StreamingReply(1)
+        await reply.finish(fallback="Sorry, no answer")
+
+    asyncio.run(run())
+    assert telegram.texts() == ["Sorry, no answer"]
+
+
+def test_failed_reply_ends_with_the_error_notice(telegram):
+    async def run():
+        reply = StreamingReply(1)
+        reply.append("Half an ans")
+        await asyncio.sleep(0.05)
+        await reply.fail("Sorry, something went wrong.")
+        empty = StreamingReply(2)
+        await empty.fail("Sorry, something went wrong.")
+
+    asyncio.run(run())
+    assert telegram.texts() == ["Half an ans\n\nSorry, something went wrong.", "Sorry, something went wrong."]